@@ -1,14 +1,37 @@
+import sys
+
+if __name__ == "__main__" and "--cli" in sys.argv:
+    # Dispatched before any GUI import: headless machines often have no
+    # tkinter at all, and the CLI doesn't need it.
+    import cli
+
+    sys.exit(cli.main([arg for arg in sys.argv[1:] if arg != "--cli"]))
+
 import os
 import queue
-import shutil
 import subprocess
 import threading
+import time
 import tkinter as tk
-import sys
 import webbrowser
-from datetime import datetime
 from tkinter import filedialog, messagebox, ttk
 
+import engine
+import journal
+import listview
+import logview
+from engine import (
+    FORMATS,
+    SOURCE_VALUE,
+    Settings,
+    ffmpeg_download_url,
+    find_ffmpeg_in_common_paths,
+    format_duration,
+    parse_float,
+    set_ffmpeg_path,
+    which_ffmpeg,
+)
+
 try:
     from tkinterdnd2 import DND_FILES, TkinterDnD
 
@@ -20,129 +43,17 @@ except Exception as exc:
     DND_ERROR = f"{type(exc).__name__}: {exc}"
     BASE_TK = tk.Tk
 
-FORMATS = {
-    "wav": {
-        "label": "WAV (pcm_s16le)",
-        "codec": "pcm_s16le",
-        "ext": "wav",
-        "bitrate": False,
-    },
-    "mp3": {
-        "label": "MP3 (libmp3lame)",
-        "codec": "libmp3lame",
-        "ext": "mp3",
-        "bitrate": True,
-        "bitrate_default": "192k",
-    },
-    "m4a": {
-        "label": "M4A (AAC)",
-        "codec": "aac",
-        "ext": "m4a",
-        "bitrate": True,
-        "bitrate_default": "192k",
-    },
-    "aac": {
-        "label": "AAC (raw)",
-        "codec": "aac",
-        "ext": "aac",
-        "bitrate": True,
-        "bitrate_default": "192k",
-    },
-    "flac": {
-        "label": "FLAC",
-        "codec": "flac",
-        "ext": "flac",
-        "bitrate": False,
-    },
-    "opus": {
-        "label": "Opus (libopus)",
-        "codec": "libopus",
-        "ext": "opus",
-        "bitrate": True,
-        "bitrate_default": "128k",
-    },
-    "ogg": {
-        "label": "Ogg Vorbis (libvorbis)",
-        "codec": "libvorbis",
-        "ext": "ogg",
-        "bitrate": True,
-        "bitrate_default": "160k",
-    },
-}
-
 APP_VERSION = "0.1"
-SOURCE_VALUE = "ソース一致"
-FORCE_MISSING_FFMPEG = False
-FFMPEG_PATH = None
-FORCE_PLATFORM = None
-
-
-def which_ffmpeg():
-    if FORCE_MISSING_FFMPEG:
-        return None
-    if FFMPEG_PATH and os.path.isfile(FFMPEG_PATH):
-        return FFMPEG_PATH
-    exe = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
-    return shutil.which(exe)
-
-
-def which_ffprobe():
-    if FFMPEG_PATH:
-        base_dir = os.path.dirname(FFMPEG_PATH)
-        exe = "ffprobe.exe" if os.name == "nt" else "ffprobe"
-        candidate = os.path.join(base_dir, exe)
-        if os.path.isfile(candidate):
-            return candidate
-    exe = "ffprobe.exe" if os.name == "nt" else "ffprobe"
-    return shutil.which(exe)
-
-def set_ffmpeg_path(path):
-    global FFMPEG_PATH
-    if path and os.path.isfile(path):
-        FFMPEG_PATH = path
-        dir_path = os.path.dirname(path)
-        os.environ["PATH"] = dir_path + os.pathsep + os.environ.get("PATH", "")
-        return True
-    return False
-
-def find_ffmpeg_in_common_paths():
-    candidates = []
-    platform = FORCE_PLATFORM or sys.platform
-    if platform.startswith("win"):
-        candidates += [
-            r"C:\ffmpeg\bin\ffmpeg.exe",
-            r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
-            r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe",
-        ]
-    elif platform == "darwin":
-        candidates += [
-            "/opt/homebrew/bin/ffmpeg",
-            "/usr/local/bin/ffmpeg",
-        ]
-    else:
-        candidates += [
-            "/usr/bin/ffmpeg",
-            "/usr/local/bin/ffmpeg",
-        ]
-    for path in candidates:
-        if os.path.isfile(path):
-            return path
-    return None
-
-def ffmpeg_download_url():
-    platform = FORCE_PLATFORM or sys.platform
-    if platform.startswith("win"):
-        return "https://www.gyan.dev/ffmpeg/builds/"
-    if platform == "darwin":
-        return "https://ffmpeg.org/download.html#build-mac"
-    return "https://ffmpeg.org/download.html#build-linux"
-
-
-def safe_stem(path):
-    base = os.path.basename(path)
-    if "." in base:
-        return ".".join(base.split(".")[:-1])
-    return base
+
+# GUI labels -> engine setting values
+KEEP_STRIP = {"保持": "keep", "削除": "strip"}
+BITRATE_MODES = {"CBR": "cbr", "VBR": "vbr", "カスタム": "custom"}
+OVERWRITE_POLICIES = {"上書き": "overwrite", "スキップ": "skip", "連番": "number"}
+POST_ACTIONS = {"なし": "none", "コピー": "copy", "移動": "move"}
+PRIORITIES = {"低": "low", "アイドル": "idle"}
+CPU_SHARES = {"75%": 75, "50%": 50, "25%": 25}
+
+INGEST_BATCH = 500
 
 
 ABOUT_DESCRIPTION = (
@@ -151,18 +62,6 @@ ABOUT_DESCRIPTION = (
 )
 
 
-def parse_float(value):
-    try:
-        return float(value)
-    except Exception:
-        return None
-
-
-def ensure_dir(path):
-    if path and not os.path.isdir(path):
-        os.makedirs(path, exist_ok=True)
-
-
 class App(BASE_TK):
     def __init__(self):
         super().__init__()
@@ -172,8 +71,15 @@ class App(BASE_TK):
         self.minsize(720, 560)
 
         self.log_queue = queue.Queue()
+        self.ingest_queue = queue.Queue()
+        self.status_queue = queue.Queue()
+        self.input_set = engine.InputSet()
         self.worker = None
-        self.files = []
+        self.control = None
+        self.watch_service = None
+        self.progress_snapshot = None
+        self._progress_shown = None
+        self.file_model = listview.FileListModel()
         self.option_rows = {}
         self.option_visible = {}
         self.option_reset = {}
@@ -181,6 +87,7 @@ class App(BASE_TK):
 
         self._build_menu()
         self._build_ui()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         self._poll_log()
 
     def _build_ui(self):
@@ -190,11 +97,11 @@ class App(BASE_TK):
         file_frame = ttk.LabelFrame(main, text="入力ファイル", padding=10)
         file_frame.pack(fill=tk.BOTH, expand=True)
 
-        self.listbox = tk.Listbox(file_frame, height=8)
-        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.file_view = listview.VirtualListView(file_frame, self.file_model, on_delete=self.remove_selected)
+        self.file_view.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         if DND_AVAILABLE:
-            self.listbox.drop_target_register(DND_FILES)
-            self.listbox.dnd_bind("<<Drop>>", self.on_drop)
+            self.file_view.canvas.drop_target_register(DND_FILES)
+            self.file_view.canvas.dnd_bind("<<Drop>>", self.on_drop)
             self.empty_hint = ttk.Label(
                 file_frame, text="ドラッグ&ドロップ可能", foreground="#777777"
             )
@@ -210,10 +117,12 @@ class App(BASE_TK):
         btns.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0))
 
         ttk.Button(btns, text="追加", command=self.add_files).pack(fill=tk.X)
+        ttk.Button(btns, text="フォルダ追加", command=self.add_folder).pack(fill=tk.X, pady=(6, 0))
         ttk.Button(btns, text="削除", command=self.remove_selected).pack(
             fill=tk.X, pady=6
         )
         ttk.Button(btns, text="クリア", command=self.clear_files).pack(fill=tk.X)
+        ttk.Button(btns, text="選択を中止", command=self.cancel_selected).pack(fill=tk.X, pady=(6, 0))
 
         out_frame = ttk.LabelFrame(main, text="出力", padding=10)
         out_frame.pack(fill=tk.X, pady=(10, 0))
@@ -261,32 +170,64 @@ class App(BASE_TK):
         fmt_frame = ttk.LabelFrame(main, text="形式", padding=10)
         fmt_frame.pack(fill=tk.X, pady=(10, 0))
 
+        fmt_row = ttk.Frame(fmt_frame)
+        fmt_row.pack(fill=tk.X)
+
         self.format_var = tk.StringVar(value="wav")
         fmt_values = [f"{k} - {v['label']}" for k, v in FORMATS.items()]
         self.format_combo = ttk.Combobox(
-            fmt_frame, values=fmt_values, state="readonly"
+            fmt_row, values=fmt_values, state="readonly"
         )
         self.format_combo.current(0)
         self.format_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
         self.format_combo.bind("<<ComboboxSelected>>", self.on_format_change)
 
         self.bitrate_var = tk.StringVar(value="")
-        self.bitrate_entry = ttk.Entry(fmt_frame, textvariable=self.bitrate_var, width=10)
+        self.bitrate_entry = ttk.Entry(fmt_row, textvariable=self.bitrate_var, width=10)
         self.bitrate_entry.pack(side=tk.LEFT, padx=(10, 0))
-        self.bitrate_label = ttk.Label(fmt_frame, text="ビットレート (例: 192k)")
+        self.bitrate_label = ttk.Label(fmt_row, text="ビットレート (例: 192k)")
         self.bitrate_label.pack(side=tk.LEFT, padx=(6, 0))
 
+        extra_row = ttk.Frame(fmt_frame)
+        extra_row.pack(fill=tk.X, pady=(6, 0))
+        ttk.Label(extra_row, text="同時出力").pack(side=tk.LEFT)
+        self.extra_formats = {}
+        for key in FORMATS:
+            var = tk.BooleanVar(value=False)
+            self.extra_formats[key] = var
+            ttk.Checkbutton(extra_row, text=key, variable=var).pack(side=tk.LEFT, padx=(8, 0))
+
         action_frame = ttk.Frame(main)
         action_frame.pack(fill=tk.X, pady=(10, 0))
 
         self.convert_btn = ttk.Button(action_frame, text="変換", command=self.start_convert)
         self.convert_btn.pack(side=tk.LEFT)
+        self.pause_btn = ttk.Button(action_frame, text="一時停止", command=self.toggle_pause, state="disabled")
+        self.pause_btn.pack(side=tk.LEFT, padx=(8, 0))
+        self.cancel_btn = ttk.Button(action_frame, text="中止", command=self.cancel_all, state="disabled")
+        self.cancel_btn.pack(side=tk.LEFT, padx=(8, 0))
 
         self.open_out_btn = ttk.Button(
             action_frame, text="出力フォルダを開く", command=self.open_out_dir
         )
         self.open_out_btn.pack(side=tk.LEFT, padx=(8, 0))
 
+        self.watch_btn = ttk.Button(action_frame, text="フォルダ監視", command=self.toggle_watch)
+        self.watch_btn.pack(side=tk.LEFT, padx=(8, 0))
+
+        progress_frame = ttk.Frame(main)
+        progress_frame.pack(fill=tk.X, pady=(8, 0))
+        self.progress_value = tk.DoubleVar(value=0.0)
+        ttk.Progressbar(
+            progress_frame, maximum=100.0, variable=self.progress_value
+        ).pack(fill=tk.X)
+        self.progress_text = tk.StringVar(value="")
+        ttk.Label(progress_frame, textvariable=self.progress_text).pack(anchor="w")
+        self.progress_jobs_text = tk.StringVar(value="")
+        ttk.Label(
+            progress_frame, textvariable=self.progress_jobs_text, justify="left", foreground="#555555"
+        ).pack(anchor="w")
+
         status_frame = ttk.Frame(main)
         status_frame.pack(fill=tk.X, pady=(6, 0))
         ttk.Label(status_frame, textvariable=self.ffmpeg_status).pack(side=tk.LEFT)
@@ -303,10 +244,8 @@ class App(BASE_TK):
         adv_frame.pack(fill=tk.BOTH, expand=True)
         self._build_options(adv_frame)
 
-        log_frame = ttk.Frame(log_tab)
-        log_frame.pack(fill=tk.BOTH, expand=True)
-        self.log_text = tk.Text(log_frame, height=10, state=tk.DISABLED)
-        self.log_text.pack(fill=tk.BOTH, expand=True)
+        self.log_pane = logview.LogPane(log_tab)
+        self.log_pane.pack(fill=tk.BOTH, expand=True)
 
         self.on_format_change()
         self.on_output_mode_change()
@@ -316,6 +255,7 @@ class App(BASE_TK):
         ok = self.check_ffmpeg(show_message=False, exit_on_missing=False, allow_pick=False)
         if ok:
             self.deiconify()
+            self.after(200, self.offer_resume)
             return True
         self.show_ffmpeg_onboarding()
         return False
@@ -339,7 +279,7 @@ class App(BASE_TK):
         self.config(menu=menubar)
 
     def pick_ffmpeg(self, show_message=True):
-        initial = os.path.dirname(FFMPEG_PATH) if FFMPEG_PATH else None
+        initial = os.path.dirname(engine.FFMPEG_PATH) if engine.FFMPEG_PATH else None
         filename = filedialog.askopenfilename(
             title="ffmpeg を選択",
             initialdir=initial,
@@ -369,7 +309,7 @@ class App(BASE_TK):
             text="FFmpeg が見つかりません。",
             font=("TkDefaultFont", 12, "bold"),
         ).pack(anchor="w")
-        platform = FORCE_PLATFORM or sys.platform
+        platform = engine.FORCE_PLATFORM or sys.platform
         if platform == "darwin":
             info_text = (
                 "macOS では Homebrew による FFmpeg インストールを推奨しています。\n"
@@ -810,7 +750,7 @@ class App(BASE_TK):
         row = add_row("loudnorm", "ラウドネス正規化")
         self.loudnorm_var = tk.StringVar(value=SOURCE_VALUE)
         self.loudnorm_combo = ttk.Combobox(
-            row, values=[SOURCE_VALUE, "有効"], state="readonly", width=10
+            row, values=[SOURCE_VALUE, "有効", "2パス"], state="readonly", width=10
         )
         self.loudnorm_combo.pack(side=tk.LEFT)
         self.loudnorm_combo.set(SOURCE_VALUE)
@@ -903,7 +843,7 @@ class App(BASE_TK):
         row = add_row("parallel", "並列数")
         self.parallel_var = tk.StringVar(value=SOURCE_VALUE)
         self.parallel_combo = ttk.Combobox(
-            row, values=[SOURCE_VALUE, "1", "2", "4", "8"], state="readonly", width=10
+            row, values=[SOURCE_VALUE, "自動", "1", "2", "4", "8"], state="readonly", width=10
         )
         self.parallel_combo.pack(side=tk.LEFT)
         self.parallel_combo.set(SOURCE_VALUE)
@@ -939,6 +879,93 @@ class App(BASE_TK):
         self.info_combo.set(SOURCE_VALUE)
         register_reset("info", lambda: self.info_combo.set(SOURCE_VALUE))
 
+        # 32 変換キャッシュ
+        row = add_row("cache", "変換キャッシュ")
+        self.cache_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, "有効", "ハッシュ照合"], state="readonly", width=12
+        )
+        self.cache_combo.pack(side=tk.LEFT)
+        self.cache_combo.set(SOURCE_VALUE)
+        register_reset("cache", lambda: self.cache_combo.set(SOURCE_VALUE))
+
+        # 33 ストリームコピー
+        row = add_row("stream_copy", "ストリームコピー")
+        self.stream_copy_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, "常に再エンコード"], state="readonly", width=16
+        )
+        self.stream_copy_combo.pack(side=tk.LEFT)
+        self.stream_copy_combo.set(SOURCE_VALUE)
+        register_reset("stream_copy", lambda: self.stream_copy_combo.set(SOURCE_VALUE))
+
+        # 34 出力検証
+        row = add_row("verify_output", "出力検証")
+        self.verify_output_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, "有効"], state="readonly", width=12
+        )
+        self.verify_output_combo.pack(side=tk.LEFT)
+        self.verify_output_combo.set(SOURCE_VALUE)
+        register_reset("verify_output", lambda: self.verify_output_combo.set(SOURCE_VALUE))
+
+        # 35 優先度 (作業中の PC で裏で回す用)
+        row = add_row("priority", "優先度")
+        self.priority_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, *PRIORITIES], state="readonly", width=12
+        )
+        self.priority_combo.pack(side=tk.LEFT)
+        self.priority_combo.set(SOURCE_VALUE)
+        register_reset("priority", lambda: self.priority_combo.set(SOURCE_VALUE))
+
+        # 36 CPU上限
+        row = add_row("cpu_share", "CPU上限")
+        self.cpu_share_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, *CPU_SHARES], state="readonly", width=12
+        )
+        self.cpu_share_combo.pack(side=tk.LEFT)
+        self.cpu_share_combo.set(SOURCE_VALUE)
+        register_reset("cpu_share", lambda: self.cpu_share_combo.set(SOURCE_VALUE))
+
+        # 37 分割エンコード (長い 1 ファイルを複数コアで)
+        row = add_row("segment_parallel", "分割エンコード")
+        self.segment_parallel_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, "有効"], state="readonly", width=12
+        )
+        self.segment_parallel_combo.pack(side=tk.LEFT)
+        self.segment_parallel_combo.set(SOURCE_VALUE)
+        register_reset("segment_parallel", lambda: self.segment_parallel_combo.set(SOURCE_VALUE))
+
+        # 38 無音で分割 (ライブ・会議の長い録音をトラックに)
+        row = add_row("split_silence", "無音で分割")
+        self.split_silence_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, "有効"], state="readonly", width=10
+        )
+        self.split_silence_combo.pack(side=tk.LEFT)
+        self.split_silence_combo.set(SOURCE_VALUE)
+        self.split_gap = tk.StringVar(value="2")
+        self.split_min_length = tk.StringVar(value="60")
+        ttk.Label(row, text="無音 (秒)").pack(side=tk.LEFT, padx=(6, 0))
+        ttk.Entry(row, textvariable=self.split_gap, width=5).pack(side=tk.LEFT, padx=(4, 8))
+        ttk.Label(row, text="最短 (秒)").pack(side=tk.LEFT)
+        ttk.Entry(row, textvariable=self.split_min_length, width=5).pack(side=tk.LEFT, padx=(4, 0))
+        register_reset("split_silence", lambda: self._reset_split())
+
+        # 39 CUE で分割 (ディスクイメージ + .cue)
+        row = add_row("split_cue", "CUE で分割")
+        self.split_cue_combo = ttk.Combobox(
+            row, values=[SOURCE_VALUE, "有効"], state="readonly", width=10
+        )
+        self.split_cue_combo.pack(side=tk.LEFT)
+        self.split_cue_combo.set(SOURCE_VALUE)
+        register_reset("split_cue", lambda: self.split_cue_combo.set(SOURCE_VALUE))
+
+        # 40 区間を切り出し (1 回のデコードで複数のクリップ)
+        row = add_row("regions", "区間を切り出し")
+        self.regions = tk.StringVar(value="")
+        self.regions_file = tk.StringVar(value="")
+        ttk.Entry(row, textvariable=self.regions, width=24).pack(side=tk.LEFT)
+        ttk.Button(row, text="リスト...", command=self.choose_regions_file).pack(side=tk.LEFT, padx=(6, 4))
+        ttk.Label(row, textvariable=self.regions_file).pack(side=tk.LEFT)
+        register_reset("regions", lambda: self._reset_regions())
+
         for key, row in self.option_rows.items():
             row.pack(fill=tk.X, pady=2)
 
@@ -1009,45 +1036,108 @@ class App(BASE_TK):
         self.loudnorm_combo.set(SOURCE_VALUE)
         self.loudnorm_target.set("-16")
 
+    def _reset_split(self):
+        self.split_silence_combo.set(SOURCE_VALUE)
+        self.split_gap.set("2")
+        self.split_min_length.set("60")
+
+    def _reset_regions(self):
+        self.regions.set("")
+        self.regions_file.set("")
+
+    def choose_regions_file(self):
+        path = filedialog.askopenfilename(
+            title="区間リストを選択",
+            filetypes=[("区間リスト", "*.csv *.tsv *.txt"), ("すべて", "*.*")],
+        )
+        if path:
+            self.regions_file.set(path)
+
+    def _check_regions(self, settings):
+        if not engine.extracts_regions(settings):
+            return True
+        try:
+            engine.extract_regions(settings, "")
+        except (OSError, ValueError) as exc:
+            messagebox.showwarning("区間", f"区間リストを読めません: {exc}")
+            return False
+        return True
+
     def add_files(self):
         paths = filedialog.askopenfilenames(title="音声ファイルを選択")
         if not paths:
             return
-        for path in paths:
-            self._add_file(path)
+        self._ingest(paths)
+
+    def add_folder(self):
+        path = filedialog.askdirectory(title="フォルダを選択")
+        if path:
+            self._ingest([path])
 
     def on_drop(self, event):
-        paths = self.tk.splitlist(event.data)
-        for path in paths:
-            if os.path.isfile(path):
-                self._add_file(path)
-        self.update_empty_hint()
+        self._ingest(self.tk.splitlist(event.data))
         return "break"
 
-    def _add_file(self, path):
-        if path not in self.files:
-            self.files.append(path)
-            self.listbox.insert(tk.END, path)
-        self.update_empty_hint()
+    def _ingest(self, paths):
+        # folders are walked and de-duplicated off the Tk thread; results come
+        # back in batches through ingest_queue
+        thread = threading.Thread(target=self._ingest_worker, args=(list(paths),), daemon=True)
+        thread.start()
+
+    def _ingest_worker(self, paths):
+        batch = []
+        for path in engine.iter_media_files(paths):
+            if self.input_set.add(path):
+                batch.append(path)
+                if len(batch) >= INGEST_BATCH:
+                    self.ingest_queue.put(batch)
+                    batch = []
+        if batch:
+            self.ingest_queue.put(batch)
+
+    def _drain_ingest(self):
+        added = []
+        try:
+            while True:
+                added.extend(self.ingest_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if added:
+            self.file_model.add_many(added)
+            self.update_empty_hint()
+
+    def _drain_status(self):
+        try:
+            while True:
+                job = self.status_queue.get_nowait()
+                self.file_model.update(
+                    job.path,
+                    status=job.state,
+                    duration=job.duration,
+                    size=job.total_size if job.finished else None,
+                )
+        except queue.Empty:
+            pass
 
     def remove_selected(self):
-        selected = list(self.listbox.curselection())
+        selected = self.file_view.selection()
         if not selected:
             return
-        for idx in reversed(selected):
-            self.listbox.delete(idx)
-            del self.files[idx]
+        for path in self.file_model.remove(selected):
+            self.input_set.discard(path)
+        self.file_view.clear_selection()
         self.update_empty_hint()
 
     def clear_files(self):
-        self.listbox.delete(0, tk.END)
-        self.files = []
+        self.file_model.clear()
+        self.file_view.clear_selection()
+        self.input_set.clear()
         self.update_empty_hint()
 
     def update_empty_hint(self):
         if not hasattr(self, "empty_hint"):
             return
-        if self.files:
+        if len(self.file_model):
             self.empty_hint.place_forget()
         else:
             self.empty_hint.place(relx=0.5, rely=0.5, anchor="center")
@@ -1086,9 +1176,9 @@ class App(BASE_TK):
         mode = self.output_mode.get()
         if mode == "custom":
             return self.out_dir.get().strip()
-        if not self.files:
+        if not len(self.file_model):
             return ""
-        base_dir = os.path.dirname(self.files[0])
+        base_dir = os.path.dirname(self.file_model.first_path())
         if mode == "sync":
             return base_dir
         subdir = self.subdir_name.get().strip()
@@ -1111,25 +1201,57 @@ class App(BASE_TK):
             self.bitrate_label.configure(state="disabled")
 
     def log(self, message):
-        self.log_queue.put(message)
+        self.log_queue.put(logview.LogRecord(message))
 
     def _poll_log(self):
+        records = []
         try:
             while True:
-                msg = self.log_queue.get_nowait()
-                self.log_text.configure(state=tk.NORMAL)
-                self.log_text.insert(tk.END, msg + "\n")
-                self.log_text.see(tk.END)
-                self.log_text.configure(state=tk.DISABLED)
+                records.append(self.log_queue.get_nowait())
         except queue.Empty:
             pass
+        self.log_pane.append(records)
+        self._drain_ingest()
+        self._drain_status()
+        self.file_view.refresh()
+        self._render_progress()
         self.after(100, self._poll_log)
 
+    def on_progress(self, snapshot):
+        # called from worker threads; the Tk loop picks it up in _poll_log
+        self.progress_snapshot = snapshot
+
+    def on_job_progress(self, job):
+        self.status_queue.put(job)
+
+    def _render_progress(self):
+        snapshot = self.progress_snapshot
+        if snapshot is None or snapshot is self._progress_shown:
+            return
+        self._progress_shown = snapshot
+        self.progress_value.set(snapshot.fraction * 100.0)
+        self.progress_text.set(
+            f"全体 {snapshot.fraction * 100:.0f}%  "
+            f"{snapshot.finished}/{snapshot.total} 件  "
+            f"経過 {format_duration(snapshot.elapsed)}  残り {format_duration(snapshot.eta)}"
+        )
+        lines = []
+        for job in snapshot.running:
+            speed = f"{job.speed:.1f}x" if job.speed else "-"
+            size = f"{job.total_size / 1048576:.1f}MB"
+            stage = {"analyzing": "解析中  ", "joining": "結合中  "}.get(job.state, "")
+            lines.append(
+                f"[{job.index}] {stage}{os.path.basename(job.path)}  {job.fraction * 100:.0f}%  "
+                f"{format_duration(job.out_time)}/{format_duration(job.duration)}  "
+                f"{speed}  {size}  残り {format_duration(job.eta)}"
+            )
+        self.progress_jobs_text.set("\n".join(lines))
+
     def start_convert(self):
         if self.worker and self.worker.is_alive():
             messagebox.showinfo("処理中", "変換が進行中です。")
             return
-        if not self.files:
+        if not len(self.file_model):
             messagebox.showwarning("入力なし", "入力ファイルを追加してください。")
             return
         mode = self.output_mode.get()
@@ -1149,310 +1271,269 @@ class App(BASE_TK):
         if not self.check_ffmpeg(show_message=True):
             return
 
+        settings = self._collect_settings()
+        if not self._check_regions(settings):
+            return
+        files = self.file_model.paths()
+        self.file_model.set_status_all("queued")
+        self._start_worker(self._convert_worker, settings, files)
+
+    def _start_worker(self, target, *args):
+        self.progress_snapshot = None
+        self.progress_value.set(0.0)
+        self.progress_text.set("")
+        self.progress_jobs_text.set("")
+        self.control = engine.BatchControl()
         self.convert_btn.configure(state="disabled")
-        self.worker = threading.Thread(target=self._convert_worker, daemon=True)
+        self.pause_btn.configure(state="normal", text="一時停止")
+        self.cancel_btn.configure(state="normal")
+        self.worker = threading.Thread(target=target, args=args, daemon=True)
         self.worker.start()
 
-    def _convert_worker(self):
-        selection = self.format_combo.get().split(" - ")[0]
-        fmt = FORMATS.get(selection, FORMATS["wav"])
-        codec = fmt["codec"]
-        ext = fmt["ext"]
-
-        bitrate = self.bitrate_var.get().strip()
-        use_bitrate = fmt.get("bitrate") and bitrate
+    def _worker_finished(self):
+        self.convert_btn.configure(state="normal")
+        self.pause_btn.configure(state="disabled", text="一時停止")
+        self.cancel_btn.configure(state="disabled")
 
-        self.log("変換を開始します...")
-        failures = 0
-        counter = 1
-
-        parallel = self.parallel_combo.get() if hasattr(self, "parallel_combo") else SOURCE_VALUE
-        parallel_count = 1
-        if parallel != SOURCE_VALUE:
-            try:
-                parallel_count = int(parallel)
-            except Exception:
-                parallel_count = 1
-
-        tasks = []
-        for path in self.files:
-            tasks.append((path, counter))
-            counter += 1
-
-        if parallel_count <= 1:
-            for path, index in tasks:
-                ok = self._convert_one(path, index, codec, ext, use_bitrate)
-                if not ok:
-                    failures += 1
-        else:
-            from concurrent.futures import ThreadPoolExecutor
-
-            with ThreadPoolExecutor(max_workers=parallel_count) as exe:
-                results = exe.map(
-                    lambda item: self._convert_one(item[0], item[1], codec, ext, use_bitrate),
-                    tasks,
-                )
-                for ok in results:
-                    if not ok:
-                        failures += 1
-
-        if failures:
-            self.log(f"完了 (エラーあり)。失敗: {failures}")
+    def toggle_pause(self):
+        if not self.control or not (self.worker and self.worker.is_alive()):
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.pause_btn.configure(text="一時停止")
+            self.log("再開しました。")
         else:
-            self.log("完了。")
-
-        self.after(0, lambda: self.convert_btn.configure(state="normal"))
-
-    def _convert_one(self, path, index, codec, ext, use_bitrate):
-        out_dir = self._resolve_output_dir(path)
-        if not out_dir:
-            return False
-        ensure_dir(out_dir)
-
-        name = safe_stem(path)
-        suffix = self.suffix_var.get().strip()
-        if suffix:
-            name = f"{name}{suffix}"
-
-        template = self.name_template_var.get().strip()
-        if template:
-            now = datetime.now().strftime("%Y%m%d")
-            name = template.replace("{name}", safe_stem(path))
-            name = name.replace("{ext}", ext)
-            name = name.replace("{date}", now)
-            name = name.replace("{n}", str(index))
-
-        out_path = os.path.join(out_dir, f"{name}.{ext}")
-        out_path = self._resolve_overwrite(out_path)
-        if not out_path:
-            self.log(f"スキップ: {path}")
-            return True
+            self.control.pause()
+            self.pause_btn.configure(text="再開")
+            self.log("一時停止しました。")
 
-        cmd, filters = self._build_command(path, out_path, codec, ext, use_bitrate)
-        if filters:
-            cmd += ["-af", ",".join(filters)]
-        cmd.append(out_path)
-
-        self.log(f"{path} -> {out_path}")
+    def cancel_all(self):
+        if not self.control or not (self.worker and self.worker.is_alive()):
+            return
+        if not messagebox.askyesno("中止", "変換を中止しますか?"):
+            return
+        self.control.cancel()
+        self.pause_btn.configure(state="disabled", text="一時停止")
+        self.cancel_btn.configure(state="disabled")
 
-        if self.info_combo.get() == "有効" and which_ffprobe():
-            self._log_media_info(path)
+    def cancel_selected(self):
+        if not self.control or not (self.worker and self.worker.is_alive()):
+            return
+        entries = self.file_model.entries
+        paths = [entries[entry_id].path for entry_id in self.file_view.selection() if entry_id in entries]
+        if paths:
+            self.control.cancel(paths)
+
+    def on_close(self):
+        busy = self.worker and self.worker.is_alive()
+        if busy and not messagebox.askyesno(
+            "終了", "変換中です。中断して終了しますか?\n(残りは次回起動時に再開できます)"
+        ):
+            return
+        threads = []
+        if busy:
+            self.control.shutdown()
+            threads.append(self.worker)
+        if self.watch_service:
+            service = self.watch_service
+            self.watch_service = None
+            stopper = threading.Thread(target=service.stop, kwargs={"cancel": True}, daemon=True)
+            stopper.start()
+            threads.append(stopper)
+        self._close_when_idle(threads, time.monotonic() + 10.0)
+
+    def _close_when_idle(self, threads, deadline):
+        # wait for the workers to reap their ffmpeg children before exiting
+        if any(thread.is_alive() for thread in threads) and time.monotonic() < deadline:
+            self.after(100, lambda: self._close_when_idle(threads, deadline))
+            return
+        self.destroy()
 
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+    def offer_resume(self):
+        try:
+            states = journal.pending()
+        except OSError:
+            return
+        if not states or (self.worker and self.worker.is_alive()):
+            return
+        state = states[-1]
+        remaining = state.remaining()
+        if not remaining:
+            state.discard()
+            return
+        answer = messagebox.askyesnocancel(
+            "中断したバッチ",
+            f"前回中断したバッチがあります ({state.created})。\n"
+            f"完了 {len(state.jobs) - len(remaining)} / {len(state.jobs)} 件\n\n"
+            f"残り {len(remaining)} 件を再開しますか?\n(「いいえ」で記録を破棄します)",
         )
-        if result.returncode != 0:
-            tail = result.stderr.strip().splitlines()[-6:]
-            for line in tail:
-                self.log(line)
-            return False
+        if answer is None:
+            return
+        if not answer:
+            state.discard()
+            return
+        if not self.check_ffmpeg(show_message=True):
+            return
+        paths = [job.input_path for job in state.jobs if self.input_set.add(job.input_path)]
+        self.file_model.add_many(paths)
+        self.update_empty_hint()
+        pending = {job.input_path for job in remaining}
+        for job in state.jobs:
+            self.file_model.update(job.input_path, status="queued" if job.input_path in pending else "done")
+        self._start_worker(self._resume_worker, state)
+
+    def toggle_watch(self):
+        if self.watch_service:
+            service = self.watch_service
+            self.watch_service = None
+            self.watch_btn.configure(text="フォルダ監視")
+            threading.Thread(target=service.stop, daemon=True).start()
+            return
+        if self.output_mode.get() == "custom" and not os.path.isdir(self.out_dir.get().strip()):
+            messagebox.showwarning("出力先", "出力フォルダが存在しません。")
+            return
+        if not self.check_ffmpeg(show_message=True):
+            return
+        settings = self._collect_settings()
+        if not self._check_regions(settings):
+            return
+        path = filedialog.askdirectory(title="監視するフォルダを選択")
+        if not path:
+            return
+        import watch
+
+        # the settings in effect now apply to every file that arrives until
+        # the watch is stopped
+        self.watch_service = watch.WatchService(settings, [path], log=self.log, progress=self.on_progress)
+        self.watch_service.start()
+        self.watch_btn.configure(text="監視停止")
+
+    def _collect_settings(self):
+        def choice(combo, mapping=None):
+            value = combo.get()
+            if value == SOURCE_VALUE:
+                return None
+            return mapping.get(value) if mapping else value
+
+        sample_rate = choice(self.sample_rate_combo)
+        if sample_rate == "カスタム":
+            sample_rate = self.sample_rate_custom.get().strip() or None
+
+        volume_db = None
+        if self.volume_combo.get() == "有効":
+            volume_db = self.volume_db.get().strip() or None
 
-        post = self.post_action_combo.get()
-        if post == "コピー":
+        parallel = 1
+        if self.parallel_combo.get() == "自動":
+            parallel = 0
+        elif self.parallel_combo.get() != SOURCE_VALUE:
             try:
-                shutil.copy2(path, out_dir)
-            except Exception as exc:
-                self.log(f"コピー失敗: {exc}")
-        elif post == "移動":
-            try:
-                shutil.move(path, out_dir)
-            except Exception as exc:
-                self.log(f"移動失敗: {exc}")
-
-        if self.info_combo.get() == "有効" and which_ffprobe():
-            self._log_media_info(out_path)
-
-        return True
-
-    def _resolve_output_dir(self, path):
-        if self.output_mode.get() == "custom":
-            return self.out_dir.get().strip()
-        base_dir = os.path.dirname(path)
-        if self.output_mode.get() == "sync":
-            return base_dir
-        subdir = self.subdir_name.get().strip()
-        if not subdir:
-            return base_dir
-        return os.path.join(base_dir, subdir)
-
-    def _resolve_overwrite(self, out_path):
-        policy = self.overwrite_combo.get()
-        if policy == SOURCE_VALUE or policy == "上書き":
-            return out_path
-        if not os.path.exists(out_path):
-            return out_path
-        if policy == "スキップ":
-            return ""
-        if policy == "連番":
-            base, ext = os.path.splitext(out_path)
-            idx = 1
-            while True:
-                candidate = f"{base}_{idx}{ext}"
-                if not os.path.exists(candidate):
-                    return candidate
-                idx += 1
-        return out_path
-
-    def _build_command(self, path, out_path, codec, ext, use_bitrate):
-        cmd = ["ffmpeg"]
-        overwrite_policy = self.overwrite_combo.get()
-        if overwrite_policy == "スキップ":
-            cmd.append("-n")
-        else:
-            cmd.append("-y")
-
-        cmd += ["-i", path]
-
-        if self.audio_only_combo.get() == "有効":
-            cmd.append("-vn")
-
-        if self.album_art_combo.get() == "削除":
-            cmd += ["-map", "0:a"]
-
-        if self.metadata_combo.get() == "削除":
-            cmd += ["-map_metadata", "-1"]
-
-        trim_start = parse_float(self.trim_start.get())
-        trim_end = parse_float(self.trim_end.get())
-        if trim_start is not None:
-            cmd += ["-ss", str(trim_start)]
-        if trim_end is not None:
-            cmd += ["-to", str(trim_end)]
-
-        # codec
-        if ext == "wav":
-            bit_depth = self.bit_depth_combo.get()
-            if bit_depth == "24":
-                codec = "pcm_s24le"
-            elif bit_depth == "32":
-                codec = "pcm_s32le"
-
-        cmd += ["-c:a", codec]
-
-        if ext == "flac" and self.flac_level_combo.get() != SOURCE_VALUE:
-            cmd += ["-compression_level", self.flac_level_combo.get()]
-
-        if ext in ("m4a", "aac") and self.aac_profile_combo.get() != SOURCE_VALUE:
-            profile_map = {"LC": "aac_low", "HE": "aac_he", "HEv2": "aac_he_v2"}
-            cmd += ["-profile:a", profile_map[self.aac_profile_combo.get()]]
-
-        if ext == "mp3" and self.stereo_mode_combo.get() != SOURCE_VALUE:
-            joint = "1" if self.stereo_mode_combo.get() == "joint" else "0"
-            cmd += ["-joint_stereo", joint]
-
-        q_value = None
-        bitrate_mode = self.bitrate_mode_combo.get()
-        bitrate_value = self.bitrate_value_var.get().strip()
-
-        if ext == "mp3" and self.mp3_vbr_combo.get() != SOURCE_VALUE:
-            q_value = self.mp3_vbr_combo.get()
-        elif ext == "ogg" and self.vorbis_quality_combo.get() != SOURCE_VALUE:
-            q_value = self.vorbis_quality_combo.get()
-        elif ext in ("ogg", "opus") and self.codec_quality_combo.get() != SOURCE_VALUE:
-            q_value = self.codec_quality_combo.get()
-        elif bitrate_mode == "VBR" and bitrate_value:
-            q_value = bitrate_value
-        elif self.quality_combo.get() != SOURCE_VALUE:
-            q_value = self.quality_combo.get()
-
-        if q_value:
-            cmd += ["-q:a", q_value]
-        else:
-            if bitrate_mode in ("CBR", "カスタム") and bitrate_value:
-                cmd += ["-b:a", bitrate_value]
-            elif use_bitrate and bitrate_mode == SOURCE_VALUE:
-                cmd += ["-b:a", bitrate]
-
-        if ext == "opus":
-            if self.opus_bandwidth_combo.get() != SOURCE_VALUE:
-                cmd += ["-bandwidth", self.opus_bandwidth_combo.get()]
-            if self.opus_frame_combo.get() != SOURCE_VALUE:
-                cmd += ["-frame_duration", self.opus_frame_combo.get()]
-            if self.opus_app_combo.get() != SOURCE_VALUE:
-                cmd += ["-application", self.opus_app_combo.get()]
-
-        if self.sample_rate_combo.get() != SOURCE_VALUE:
-            if self.sample_rate_combo.get() == "カスタム":
-                custom = self.sample_rate_custom.get().strip()
-                if custom:
-                    cmd += ["-ar", custom]
-            else:
-                cmd += ["-ar", self.sample_rate_combo.get()]
+                parallel = int(self.parallel_combo.get())
+            except Exception:
+                parallel = 1
 
-        if self.channels_combo.get() != SOURCE_VALUE:
-            cmd += ["-ac", self.channels_combo.get()]
+        primary = self.format_combo.get().split(" - ")[0]
+        formats = (primary,) + tuple(
+            key for key, var in self.extra_formats.items() if var.get() and key != primary
+        )
 
-        filters = []
+        return Settings(
+            formats=formats,
+            bitrate=self.bitrate_var.get().strip(),
+            output_mode=self.output_mode.get(),
+            subdir_name=self.subdir_name.get().strip(),
+            out_dir=self.out_dir.get().strip(),
+            sample_rate=sample_rate,
+            bitrate_mode=choice(self.bitrate_mode_combo, BITRATE_MODES),
+            bitrate_value=self.bitrate_value_var.get().strip(),
+            quality=choice(self.quality_combo),
+            channels=choice(self.channels_combo),
+            volume_db=volume_db,
+            bit_depth=choice(self.bit_depth_combo),
+            flac_level=choice(self.flac_level_combo),
+            stereo_mode=choice(self.stereo_mode_combo),
+            opus_bandwidth=choice(self.opus_bandwidth_combo),
+            codec_quality=choice(self.codec_quality_combo),
+            trim_start=parse_float(self.trim_start.get()),
+            trim_end=parse_float(self.trim_end.get()),
+            metadata=choice(self.metadata_combo, KEEP_STRIP),
+            suffix=self.suffix_var.get().strip(),
+            resample=choice(self.resample_combo),
+            dither=choice(self.dither_combo),
+            replaygain=choice(self.replaygain_combo),
+            silence_trim=self.silence_trim_combo.get() == "有効",
+            fade_in=parse_float(self.fade_in.get()),
+            fade_out_start=parse_float(self.fade_out_start.get()),
+            fade_out=parse_float(self.fade_out.get()),
+            loudnorm=self.loudnorm_combo.get() in ("有効", "2パス"),
+            loudnorm_two_pass=self.loudnorm_combo.get() == "2パス",
+            loudnorm_target=self.loudnorm_target.get().strip() or "-16",
+            aac_profile=choice(self.aac_profile_combo),
+            mp3_vbr=choice(self.mp3_vbr_combo),
+            opus_frame=choice(self.opus_frame_combo),
+            opus_app=choice(self.opus_app_combo),
+            vorbis_quality=choice(self.vorbis_quality_combo),
+            name_template=self.name_template_var.get().strip(),
+            overwrite=choice(self.overwrite_combo, OVERWRITE_POLICIES),
+            post_action=choice(self.post_action_combo, POST_ACTIONS),
+            parallel=parallel,
+            audio_only=self.audio_only_combo.get() == "有効",
+            album_art=choice(self.album_art_combo, KEEP_STRIP),
+            info=self.info_combo.get() == "有効",
+            cache=self.cache_combo.get() in ("有効", "ハッシュ照合"),
+            cache_hash=self.cache_combo.get() == "ハッシュ照合",
+            force_reencode=self.stream_copy_combo.get() == "常に再エンコード",
+            verify_output=self.verify_output_combo.get() == "有効",
+            priority=choice(self.priority_combo, PRIORITIES),
+            cpu_share=CPU_SHARES.get(self.cpu_share_combo.get(), 0),
+            segment_parallel=self.segment_parallel_combo.get() == "有効",
+            split_silence=self.split_silence_combo.get() == "有効",
+            split_gap=parse_float(self.split_gap.get()) or 2.0,
+            split_min_length=parse_float(self.split_min_length.get()) or 60.0,
+            split_cue=self.split_cue_combo.get() == "有効",
+            regions=self.regions.get(),
+            regions_file=self.regions_file.get().strip(),
+        )
 
-        if self.resample_combo.get() != SOURCE_VALUE or self.dither_combo.get() != SOURCE_VALUE:
-            params = []
-            if self.resample_combo.get() != SOURCE_VALUE:
-                params.append(f"resampler={self.resample_combo.get()}")
-            if self.sample_rate_combo.get() not in (SOURCE_VALUE, "カスタム"):
-                params.append(f"sample_rate={self.sample_rate_combo.get()}")
-            if self.sample_rate_combo.get() == "カスタム" and self.sample_rate_custom.get().strip():
-                params.append(f"sample_rate={self.sample_rate_custom.get().strip()}")
-            if self.dither_combo.get() != SOURCE_VALUE:
-                params.append(f"dither_method={self.dither_combo.get()}")
-            filters.append("aresample=" + ":".join(params))
+    def _convert_worker(self, settings, files):
+        try:
+            engine.run_batch(
+                settings,
+                files,
+                log=self.log,
+                progress=self.on_progress,
+                job_progress=self.on_job_progress,
+                batch_journal=journal.Journal.create(),
+                control=self.control,
+            )
+        except Exception as exc:
+            self.log(engine.log_line(f"エラー: {exc}", "error"))
+        finally:
+            self.after(0, self._worker_finished)
 
-        if self.volume_combo.get() == "有効":
-            vol = self.volume_db.get().strip()
-            if vol:
-                filters.append(f"volume={vol}dB")
-
-        if self.loudnorm_combo.get() == "有効":
-            lufs = self.loudnorm_target.get().strip() or "-16"
-            filters.append(f"loudnorm=I={lufs}:TP=-1.5:LRA=11")
-
-        if self.replaygain_combo.get() != SOURCE_VALUE:
-            filters.append(f"replaygain={self.replaygain_combo.get()}")
-
-        if self.silence_trim_combo.get() == "有効":
-            filters.append("silenceremove=start_periods=1:start_threshold=-50dB:stop_periods=1:stop_threshold=-50dB")
-
-        fade_in = parse_float(self.fade_in.get())
-        fade_out_start = parse_float(self.fade_out_start.get())
-        fade_out = parse_float(self.fade_out.get())
-        if fade_in is not None and fade_in > 0:
-            filters.append(f"afade=t=in:st=0:d={fade_in}")
-        if fade_out is not None and fade_out_start is not None:
-            filters.append(f"afade=t=out:st={fade_out_start}:d={fade_out}")
-
-        return cmd, filters
-
-    def _log_media_info(self, path):
-        cmd = [
-            which_ffprobe(),
-            "-v",
-            "error",
-            "-show_entries",
-            "stream=codec_name,codec_type,channels,sample_rate,bit_rate",
-            "-show_entries",
-            "format=duration,bit_rate",
-            "-of",
-            "default=nw=1",
-            path,
-        ]
-        if not cmd[0]:
-            return
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            for line in result.stdout.strip().splitlines():
-                self.log(f"info: {line}")
+    def _resume_worker(self, state):
+        try:
+            engine.resume_batch(
+                state,
+                log=self.log,
+                progress=self.on_progress,
+                job_progress=self.on_job_progress,
+                control=self.control,
+            )
+        except Exception as exc:
+            self.log(engine.log_line(f"エラー: {exc}", "error"))
+        finally:
+            self.after(0, self._worker_finished)
 
 
 if __name__ == "__main__":
     if "--test-no-ffmpeg" in sys.argv:
-        FORCE_MISSING_FFMPEG = True
+        engine.FORCE_MISSING_FFMPEG = True
     if "--test-mac" in sys.argv:
-        FORCE_PLATFORM = "darwin"
+        engine.FORCE_PLATFORM = "darwin"
     if "--test-linux" in sys.argv:
-        FORCE_PLATFORM = "linux"
+        engine.FORCE_PLATFORM = "linux"
     if "--test-win" in sys.argv:
-        FORCE_PLATFORM = "win32"
+        engine.FORCE_PLATFORM = "win32"
     app = App()
     app.mainloop()
@@ -0,0 +1,245 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+
+import cache
+import engine
+import metrics
+import scheduler
+from engine import FORMATS, Settings
+
+BENCH_VERSION = 1
+BENCH_DIR = "bench"
+
+
+@dataclass(frozen=True)
+class Material:
+    name: str
+    duration: float
+    sample_rate: int
+    channels: str
+
+    def lavfi(self):
+        # sine + seeded pink noise with one second of silence every ten, so
+        # silenceremove and loudnorm have something realistic to chew on
+        rate = self.sample_rate
+        return (
+            f"sine=frequency=440:sample_rate={rate}:duration={self.duration}[tone];"
+            f"anoisesrc=color=pink:seed=1234:amplitude=0.05:sample_rate={rate}:duration={self.duration}[noise];"
+            "[tone][noise]amix=inputs=2:duration=first,"
+            "volume=volume=0:enable='between(mod(t\\,10)\\,7\\,8)',"
+            f"aformat=sample_fmts=s16:channel_layouts={self.channels}"
+        )
+
+
+MATERIALS = (
+    Material("short-44k-stereo", 10.0, 44100, "stereo"),
+    Material("medium-48k-stereo", 60.0, 48000, "stereo"),
+    Material("medium-44k-mono", 60.0, 44100, "mono"),
+    Material("long-48k-stereo", 300.0, 48000, "stereo"),
+    Material("medium-96k-5.1", 60.0, 96000, "5.1"),
+)
+QUICK_MATERIALS = MATERIALS[:3]
+
+# expensive options, each measured on top of the baseline format
+OPTION_SCENARIOS = (
+    ("loudnorm", {"loudnorm": True}),
+    ("loudnorm-2pass", {"loudnorm": True, "loudnorm_two_pass": True}),
+    ("soxr-48k", {"resample": "soxr", "sample_rate": "48000"}),
+    ("dither", {"bit_depth": "16", "dither": "triangular"}),
+    ("silenceremove", {"silence_trim": True}),
+)
+BASELINE_FORMAT = "flac"
+PARALLEL_LEVELS = (1, 2, 0)
+# what background mode costs in throughput, all at auto parallelism
+PRIORITY_SCENARIOS = (
+    ("normal", {}),
+    ("low", {"priority": "low"}),
+    ("idle", {"priority": "idle"}),
+    ("cpu-50", {"cpu_share": 50}),
+)
+
+
+def bench_dir():
+    path = os.path.join(cache.cache_dir(), BENCH_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def ffmpeg_version(ffmpeg):
+    try:
+        result = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True, errors="replace")
+    except OSError:
+        return ""
+    return (result.stdout.splitlines() or [""])[0]
+
+
+def generate_material(ffmpeg, material, folder):
+    path = os.path.join(folder, f"{material.name}.wav")
+    if os.path.isfile(path):
+        return path
+    tmp = os.path.join(folder, f".{material.name}.tmp.wav")
+    cmd = [
+        ffmpeg,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-filter_complex",
+        material.lavfi(),
+        "-c:a",
+        "pcm_s16le",
+        "-bitexact",
+        tmp,
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"{material.name}: {result.stderr.strip()}")
+    os.replace(tmp, path)
+    return path
+
+
+def scenarios(formats=None):
+    base = Settings(formats=(BASELINE_FORMAT,), output_mode="custom", parallel=1)
+    for key in formats or FORMATS:
+        fmt = FORMATS[key]
+        bitrate = fmt.get("bitrate_default", "") if fmt.get("bitrate") else ""
+        yield f"format:{key}", replace(base, formats=(key,), bitrate=bitrate)
+    for name, values in OPTION_SCENARIOS:
+        yield f"option:{name}", replace(base, **values)
+    for parallel in PARALLEL_LEVELS:
+        yield f"parallel:{parallel or 'auto'}", replace(base, parallel=parallel)
+    for name, values in PRIORITY_SCENARIOS:
+        yield f"priority:{name}", replace(base, parallel=0, **values)
+
+
+def run_scenario(settings, files, repeat, log):
+    walls = []
+    records = []
+    failures = 0
+    for _ in range(repeat):
+        out_dir = tempfile.mkdtemp(prefix="bench-out-")
+        trace = os.path.join(out_dir, "metrics.jsonl")
+        try:
+            run_settings = replace(settings, out_dir=out_dir)
+            if settings.loudnorm_two_pass:
+                # measure the analysis pass every time, not the cached result
+                store = cache.store(engine.LOUDNORM_CACHE)
+                for path in files:
+                    store.delete(engine.loudnorm_cache_key(settings, path))
+            started = time.monotonic()
+            result = engine.run_batch(run_settings, files, log=log, metrics_log=metrics.MetricsLog(trace))
+            walls.append(time.monotonic() - started)
+            failures += result.failures
+            records = metrics.load(trace)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    audio = sum(record.get("duration") or 0.0 for record in records)
+    wall = statistics.median(walls)
+    return {
+        "files": len(files),
+        "audio_seconds": audio,
+        "wall": wall,
+        "walls": walls,
+        "realtime": audio / wall if wall else None,
+        "cpu_user": sum(record.get("cpu_user") or 0.0 for record in records),
+        "cpu_system": sum(record.get("cpu_system") or 0.0 for record in records),
+        "max_rss": max((record.get("max_rss") or 0 for record in records), default=0),
+        "job_wall_p50": metrics.percentile([record["wall"] for record in records if record.get("wall")], 50),
+        "layout": engine.batch_layout(settings, len(files)).describe(),
+        "failures": failures,
+    }
+
+
+def run(out_path, quick=False, repeat=1, formats=None, log=print):
+    ffmpeg = engine.which_ffmpeg()
+    folder = bench_dir()
+    materials = QUICK_MATERIALS if quick else MATERIALS
+    files = []
+    for material in materials:
+        log(f"素材を生成: {material.name}")
+        files.append(generate_material(ffmpeg, material, folder))
+
+    def quiet(message):
+        pass
+
+    results = []
+    for name, settings in scenarios(formats):
+        log(f"計測: {name}")
+        result = run_scenario(settings, files, repeat, quiet)
+        result["scenario"] = name
+        result["formats"] = list(settings.formats)
+        result["options"] = metrics.options_key(settings)
+        result["parallel"] = settings.parallel
+        result["priority"] = settings.priority or "normal"
+        result["cpu_share"] = settings.cpu_share or None
+        results.append(result)
+        realtime = f"{result['realtime']:.1f}x" if result["realtime"] else "-"
+        log(f"  {result['wall']:.2f}s  {realtime}  失敗 {result['failures']}")
+
+    document = {
+        "version": BENCH_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": {
+            **metrics.host_info(),
+            "cpus": os.cpu_count(),
+            "usable_cpus": scheduler.usable_cpu_count(),
+            "processor": platform.processor(),
+            "python": sys.version.split()[0],
+        },
+        "ffmpeg": ffmpeg_version(ffmpeg),
+        "repeat": repeat,
+        "materials": [
+            {"name": m.name, "duration": m.duration, "sample_rate": m.sample_rate, "channels": m.channels}
+            for m in materials
+        ],
+        "results": results,
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return document
+
+
+def load_result(path):
+    with open(path, "r", encoding="utf-8") as f:
+        document = json.load(f)
+    if document.get("version") != BENCH_VERSION:
+        raise ValueError(f"{path}: 未対応のベンチマーク形式です (version {document.get('version')})")
+    return document
+
+
+def compare(base, other):
+    rows = []
+    others = {result["scenario"]: result for result in other["results"]}
+    for result in base["results"]:
+        match = others.get(result["scenario"])
+        if not match:
+            continue
+        change = None
+        if result["wall"] and match["wall"]:
+            change = (match["wall"] - result["wall"]) / result["wall"] * 100.0
+        rows.append((result["scenario"], result["wall"], match["wall"], change))
+    return rows
+
+
+def format_comparison(base, other):
+    lines = [
+        f"A: {base['created']}  {base['host'].get('host')}  {base.get('ffmpeg', '')}",
+        f"B: {other['created']}  {other['host'].get('host')}  {other.get('ffmpeg', '')}",
+    ]
+    if base.get("materials") != other.get("materials"):
+        lines.append("注意: 素材セットが異なります")
+    width = max([len(row[0]) for row in compare(base, other)] + [8])
+    lines.append(f"{'scenario'.ljust(width)}  {'A (s)':>9}  {'B (s)':>9}  {'delta':>8}")
+    for scenario, wall_a, wall_b, change in compare(base, other):
+        delta = f"{change:+.1f}%" if change is not None else "-"
+        lines.append(f"{scenario.ljust(width)}  {wall_a:9.2f}  {wall_b:9.2f}  {delta:>8}")
+    return "\n".join(lines)
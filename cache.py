@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+SAMPLE_SIZE = 64 * 1024
+COMPACT_RATIO = 2
+# per store; beyond that the entries written longest ago are dropped (keys
+# include size and mtime, so an edited file leaves its old entry behind)
+MAX_ENTRIES = 20000
+
+
+def cache_dir():
+    override = os.environ.get("AUDIOCONVERTER_CACHE_DIR")
+    if override:
+        base = override
+    elif sys.platform.startswith("win"):
+        base = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"), "AudioConverter")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches/AudioConverter")
+    else:
+        xdg = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        base = os.path.join(xdg, "audioconverter")
+    os.makedirs(base, exist_ok=True)
+    return base
+
+
+def content_key(path):
+    # Size, mtime and sampled head/middle/tail blocks: stable across renames,
+    # cheap enough to compute for every file of a large batch. The samples
+    # alone miss an edit in between that keeps the length (a PCM master
+    # re-rendered in place), the mtime catches it.
+    st = os.stat(path)
+    size = st.st_size
+    digest = hashlib.sha1(f"{size}:{st.st_mtime_ns}".encode("ascii"))
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)}):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, content_hash=False):
+    st = os.stat(path)
+    fingerprint = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if content_hash:
+        fingerprint["sha256"] = file_hash(path)
+    return fingerprint
+
+
+def fingerprint_matches(recorded, path, content_hash=False):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if not recorded or recorded.get("size") != st.st_size:
+        return False
+    if recorded.get("mtime_ns") == st.st_mtime_ns:
+        return True
+    # touched but possibly unchanged: only a content hash can tell
+    return bool(content_hash and recorded.get("sha256") and recorded["sha256"] == file_hash(path))
+
+
+def output_record(path):
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def output_intact(record):
+    try:
+        st = os.stat(record["path"])
+    except (OSError, KeyError):
+        return False
+    return st.st_size == record.get("size") and st.st_mtime_ns == record.get("mtime_ns")
+
+
+def make_key(*parts):
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class JsonStore:
+    # Append-only JSON-lines key/value store. The last record for a key wins;
+    # the file is rewritten (on load or after a write) once stale records
+    # outnumber live ones or there are more than max_entries keys.
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = None
+        self._times = {}
+        self._lines = 0
+
+    def _load(self):
+        if self._data is not None:
+            return
+        self._data = {}
+        self._times = {}
+        self._lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._lines += 1
+                    key = record.get("k")
+                    if record.get("v") is None:
+                        self._data.pop(key, None)
+                        self._times.pop(key, None)
+                    else:
+                        self._data[key] = record["v"]
+                        self._times[key] = record.get("t", 0)
+        except FileNotFoundError:
+            pass
+        if self._needs_compaction():
+            self._compact()
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._load()
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._load()
+            if value is None:
+                self._data.pop(key, None)
+                self._times.pop(key, None)
+                self._append({"k": key, "v": None})
+            else:
+                self._data[key] = value
+                self._times[key] = round(time.time(), 3)
+                self._append({"k": key, "v": value, "t": self._times[key]})
+
+    def delete(self, key):
+        self.set(key, None)
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._data)
+
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+        self._lines += 1
+        if self._needs_compaction():
+            self._compact()
+
+    def _needs_compaction(self):
+        return len(self._data) > self.max_entries or self._lines > COMPACT_RATIO * max(len(self._data), 64)
+
+    def _compact(self):
+        if len(self._data) > self.max_entries:
+            newest = sorted(self._data, key=self._times.get, reverse=True)
+            for key in newest[self.max_entries :]:
+                del self._data[key]
+                del self._times[key]
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for key, value in self._data.items():
+                    record = {"k": key, "v": value, "t": self._times[key]}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+        except OSError:
+            # a read-only cache still works from memory
+            return
+        self._lines = len(self._data)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store(name):
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = JsonStore(os.path.join(cache_dir(), name))
+        return _stores[name]
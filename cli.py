@@ -0,0 +1,640 @@
+import argparse
+import json
+import os
+import shlex
+import signal
+import sys
+import time
+
+from dataclasses import replace
+
+import engine
+import metrics
+import tracks
+from engine import FORMATS, Settings
+
+
+def _formats(value):
+    try:
+        return engine.parse_formats(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def _parallel(value):
+    if value == "auto":
+        return 0
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("1 以上または auto を指定してください")
+    return count
+
+
+def _listen(value):
+    host, _, port = value.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError("HOST:PORT の形式で指定してください")
+
+
+def _cpu_share(value):
+    share = int(value.rstrip("%"))
+    if not 1 <= share <= 100:
+        raise argparse.ArgumentTypeError("1〜100 を指定してください")
+    return share
+
+
+def _add_convert_options(parser):
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=_formats,
+        default=("wav",),
+        help=f"{', '.join(FORMATS)} (カンマ区切りで複数指定: wav,mp3,opus)",
+    )
+    parser.add_argument("-b", "--bitrate", default=None, help="例: 192k (既定は形式ごとの値)")
+    parser.add_argument("--output-mode", choices=engine.SETTING_CHOICES["output_mode"], default=None)
+    parser.add_argument("--subdir", default="converted")
+    parser.add_argument("-o", "--out-dir", default="", help="指定すると --output-mode custom になります")
+    parser.add_argument("--sample-rate")
+    parser.add_argument("--bitrate-mode", choices=engine.SETTING_CHOICES["bitrate_mode"])
+    parser.add_argument("--bitrate-value", default="")
+    parser.add_argument("--quality")
+    parser.add_argument("--channels", choices=engine.SETTING_CHOICES["channels"])
+    parser.add_argument("--volume", metavar="DB")
+    parser.add_argument("--bit-depth", choices=engine.SETTING_CHOICES["bit_depth"])
+    parser.add_argument("--flac-level")
+    parser.add_argument("--stereo-mode", choices=engine.SETTING_CHOICES["stereo_mode"])
+    parser.add_argument("--opus-bandwidth", choices=engine.SETTING_CHOICES["opus_bandwidth"])
+    parser.add_argument("--codec-quality")
+    parser.add_argument("--trim-start", type=float)
+    parser.add_argument("--trim-end", type=float)
+    parser.add_argument("--metadata", choices=engine.SETTING_CHOICES["metadata"])
+    parser.add_argument("--suffix", default="")
+    parser.add_argument("--resample", choices=engine.SETTING_CHOICES["resample"])
+    parser.add_argument("--dither", choices=engine.SETTING_CHOICES["dither"])
+    parser.add_argument("--replaygain", choices=engine.SETTING_CHOICES["replaygain"])
+    parser.add_argument("--silence-trim", action="store_true")
+    parser.add_argument("--fade-in", type=float)
+    parser.add_argument("--fade-out-start", type=float)
+    parser.add_argument("--fade-out", type=float)
+    parser.add_argument("--loudnorm", metavar="LUFS", help="例: -16")
+    parser.add_argument(
+        "--loudnorm-two-pass", action="store_true", help="解析パス + リニア補正 (解析結果はキャッシュ)"
+    )
+    parser.add_argument("--aac-profile", choices=engine.SETTING_CHOICES["aac_profile"])
+    parser.add_argument("--mp3-vbr")
+    parser.add_argument("--opus-frame", choices=engine.SETTING_CHOICES["opus_frame"])
+    parser.add_argument("--opus-app", choices=engine.SETTING_CHOICES["opus_app"])
+    parser.add_argument("--vorbis-quality")
+    parser.add_argument("--name-template", default="", help="{name} {ext} {date} {n}")
+    parser.add_argument("--overwrite", choices=engine.SETTING_CHOICES["overwrite"])
+    parser.add_argument("--post-action", choices=engine.SETTING_CHOICES["post_action"])
+    parser.add_argument("-j", "--parallel", type=_parallel, default=1, help="並列数 または auto")
+    parser.add_argument("--audio-only", action="store_true")
+    parser.add_argument("--album-art", choices=engine.SETTING_CHOICES["album_art"])
+    parser.add_argument("--info", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="入力と argv が前回と同じならスキップ")
+    parser.add_argument("--cache-hash", action="store_true", help="--cache + 内容ハッシュで照合")
+    parser.add_argument(
+        "--force-reencode", action="store_true", help="コーデックが同じでもストリームコピーしない"
+    )
+    parser.add_argument("--verify", action="store_true", help="確定前に ffprobe で出力を検証")
+    parser.add_argument(
+        "--priority", choices=engine.SETTING_CHOICES["priority"], default="normal", help="ffmpeg の CPU/I/O 優先度"
+    )
+    parser.add_argument("--cpu-share", type=_cpu_share, default=0, metavar="PERCENT", help="使うコアの上限 (%%)")
+    parser.add_argument(
+        "--segment-parallel", action="store_true", help="長いファイルを区間に分けて並列にエンコード"
+    )
+    parser.add_argument("--split-cue", action="store_true", help="同じフォルダの .cue シートでトラックに分割")
+    parser.add_argument("--split-silence", action="store_true", help="無音の位置でトラックに分割")
+    parser.add_argument(
+        "--split-gap", type=float, default=2.0, metavar="SECONDS", help="分割に使う無音の最短長 (秒)"
+    )
+    parser.add_argument(
+        "--split-min-length", type=float, default=60.0, metavar="SECONDS", help="トラックの最短長 (秒)"
+    )
+    parser.add_argument(
+        "--regions", default="", metavar="LIST", help='切り出す区間 (例: "0:10-0:25; 1:30-2:00")'
+    )
+    parser.add_argument(
+        "--regions-file", default="", metavar="PATH", help="切り出す区間のリスト (CSV / タブ区切り)"
+    )
+
+
+def settings_from_args(args):
+    fmt = FORMATS[args.format[0]]
+    bitrate = args.bitrate
+    if bitrate is None:
+        bitrate = fmt.get("bitrate_default", "") if fmt.get("bitrate") else ""
+    output_mode = args.output_mode or ("custom" if args.out_dir else "sync")
+    return Settings(
+        formats=args.format,
+        bitrate=bitrate,
+        output_mode=output_mode,
+        subdir_name=args.subdir,
+        out_dir=args.out_dir,
+        sample_rate=args.sample_rate,
+        bitrate_mode=args.bitrate_mode,
+        bitrate_value=args.bitrate_value,
+        quality=args.quality,
+        channels=args.channels,
+        volume_db=args.volume,
+        bit_depth=args.bit_depth,
+        flac_level=args.flac_level,
+        stereo_mode=args.stereo_mode,
+        opus_bandwidth=args.opus_bandwidth,
+        codec_quality=args.codec_quality,
+        trim_start=args.trim_start,
+        trim_end=args.trim_end,
+        metadata=args.metadata,
+        suffix=args.suffix,
+        resample=args.resample,
+        dither=args.dither,
+        replaygain=args.replaygain,
+        silence_trim=args.silence_trim,
+        fade_in=args.fade_in,
+        fade_out_start=args.fade_out_start,
+        fade_out=args.fade_out,
+        loudnorm=args.loudnorm is not None,
+        loudnorm_target=args.loudnorm or "-16",
+        loudnorm_two_pass=args.loudnorm_two_pass,
+        aac_profile=args.aac_profile,
+        mp3_vbr=args.mp3_vbr,
+        opus_frame=args.opus_frame,
+        opus_app=args.opus_app,
+        vorbis_quality=args.vorbis_quality,
+        name_template=args.name_template,
+        overwrite=args.overwrite,
+        post_action=args.post_action,
+        parallel=args.parallel,
+        audio_only=args.audio_only,
+        album_art=args.album_art,
+        info=args.info,
+        cache=args.cache or args.cache_hash,
+        cache_hash=args.cache_hash,
+        force_reencode=args.force_reencode,
+        verify_output=args.verify,
+        priority=None if args.priority == "normal" else args.priority,
+        cpu_share=0 if args.cpu_share == 100 else args.cpu_share,
+        segment_parallel=args.segment_parallel,
+        split_silence=args.split_silence,
+        split_cue=args.split_cue,
+        split_gap=args.split_gap,
+        split_min_length=args.split_min_length,
+        regions=args.regions,
+        regions_file=args.regions_file,
+    )
+
+
+def _check_regions(settings):
+    # a typo in the list should stop the batch before anything runs
+    if not engine.extracts_regions(settings):
+        return True
+    try:
+        engine.extract_regions(settings, "")
+    except (OSError, ValueError) as exc:
+        print(f"区間リストを読めません: {exc}", file=sys.stderr)
+        return False
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="app.py --cli", description="AudioConverter (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="ファイルを変換")
+    _add_convert_options(convert)
+    convert.add_argument("--ffmpeg", help="ffmpeg のパス")
+    convert.add_argument("--dry-run", action="store_true", help="コマンドを表示のみ")
+    convert.add_argument("--progress", action="store_true", help="進捗を標準エラーに表示")
+    convert.add_argument("--metrics", metavar="PATH", help="ジョブ計測 (JSONL) の出力先")
+    convert.add_argument("--no-journal", action="store_true", help="中断再開用のジャーナルを書かない")
+    convert.add_argument("files", nargs="+", help="ファイルまたはフォルダ (再帰的に検索)")
+
+    watch = sub.add_parser("watch", help="フォルダを監視して追加されたファイルを変換")
+    _add_convert_options(watch)
+    watch.add_argument("--ffmpeg", help="ffmpeg のパス")
+    watch.add_argument("--recursive", action="store_true", help="サブフォルダも監視")
+    watch.add_argument("--poll", action="store_true", help="inotify を使わずポーリングで監視")
+    watch.add_argument("--progress", action="store_true", help="進捗を標準エラーに表示")
+    watch.add_argument("--metrics", metavar="PATH", help="ジョブ計測 (JSONL) の出力先")
+    watch.add_argument("dirs", nargs="+")
+
+    resume = sub.add_parser("resume", help="中断したバッチを再開")
+    resume.add_argument("--ffmpeg", help="ffmpeg のパス")
+    resume.add_argument("--list", action="store_true", help="再開できるバッチを一覧表示")
+    resume.add_argument("--discard", action="store_true", help="ジャーナルを破棄")
+    resume.add_argument("--progress", action="store_true", help="進捗を標準エラーに表示")
+    resume.add_argument("--metrics", metavar="PATH", help="ジョブ計測 (JSONL) の出力先")
+    resume.add_argument("batch", nargs="?", help="バッチ ID (既定: 最新)")
+
+    serve = sub.add_parser("serve", help="分散変換のコーディネーターを起動")
+    _add_convert_options(serve)
+    serve.add_argument(
+        "--listen", type=_listen, default=("127.0.0.1", 8765), metavar="HOST:PORT", help="既定: 127.0.0.1:8765"
+    )
+    serve.add_argument("--lease", type=float, default=30.0, metavar="SEC", help="ジョブのリース期間")
+    serve.add_argument("--attempts", type=int, default=3, help="リース切れ時の最大試行回数")
+    serve.add_argument("--token", help="共有トークン (既定: 環境変数 AUDIOCONVERTER_TOKEN)")
+    serve.add_argument("--progress", action="store_true", help="進捗を標準エラーに表示")
+    serve.add_argument("--metrics", metavar="PATH", help="ジョブ計測 (JSONL) の出力先")
+    serve.add_argument("--no-journal", action="store_true", help="中断再開用のジャーナルを書かない")
+    serve.add_argument("files", nargs="+", help="ファイルまたはフォルダ (全ホストから同じパスで見えること)")
+
+    worker = sub.add_parser("worker", help="コーディネーターからジョブを受け取って変換")
+    worker.add_argument("url", help="例: http://render01:8765")
+    worker.add_argument("-j", "--slots", type=_parallel, default=1, help="同時に受け取るジョブ数 または auto")
+    worker.add_argument("--ffmpeg", help="ffmpeg のパス")
+    worker.add_argument("--token", help="共有トークン (既定: 環境変数 AUDIOCONVERTER_TOKEN)")
+    worker.add_argument("--name", help="ワーカー名 (既定: ホスト名-PID)")
+
+    service = sub.add_parser("service", help="HTTP で変換を受け付けるサービスを起動")
+    service.add_argument(
+        "--listen", type=_listen, default=("127.0.0.1", 8766), metavar="HOST:PORT", help="既定: 127.0.0.1:8766"
+    )
+    service.add_argument("-j", "--jobs", type=_parallel, default=0, help="同時変換数 または auto (既定)")
+    service.add_argument("--queue", type=int, default=16, help="待ち行列の上限 (超えると 503)")
+    service.add_argument("--queue-timeout", type=float, default=300.0, metavar="SEC", help="空き待ちの上限")
+    service.add_argument(
+        "--priority", choices=engine.SETTING_CHOICES["priority"], default="normal", help="ffmpeg の CPU/I/O 優先度"
+    )
+    service.add_argument("--token", help="共有トークン (既定: 環境変数 AUDIOCONVERTER_TOKEN)")
+    service.add_argument("--spill-dir", help="シーク可能な出力が必要な形式 (m4a, wav) の一時フォルダ")
+    service.add_argument("--ffmpeg", help="ffmpeg のパス")
+    service.add_argument("--metrics", metavar="PATH", help="リクエスト計測 (JSONL) の出力先")
+
+    report = sub.add_parser("report", help="ジョブ計測 (JSONL) を集計")
+    report.add_argument("--metrics", metavar="PATH", help=f"既定: キャッシュフォルダの {metrics.METRICS_FILE}")
+    report.add_argument("--by", choices=list(metrics.GROUPINGS), default="format", help="集計単位")
+    report.add_argument("--since", metavar="DATE", help="この日時以降の記録のみ (例: 2024-01-31)")
+    report.add_argument("--batch", help="指定したバッチ ID のみ")
+    report.add_argument("--json", action="store_true", help="JSON で出力")
+
+    bench = sub.add_parser("bench", help="合成素材 (lavfi) でベンチマーク")
+    bench.add_argument("--ffmpeg", help="ffmpeg のパス")
+    bench.add_argument("-o", "--out", help="結果 JSON の出力先 (既定: bench-日時.json)")
+    bench.add_argument("--quick", action="store_true", help="短い素材のみで実行")
+    bench.add_argument("--repeat", type=int, default=1, help="各シナリオの繰り返し回数 (中央値を採用)")
+    bench.add_argument("-f", "--format", type=_formats, default=None, help="計測する形式 (既定: すべて)")
+    bench.add_argument("--compare", nargs=2, metavar=("A", "B"), help="2 つの結果 JSON を比較")
+    return parser
+
+
+def _check_ffmpeg(args):
+    if args.ffmpeg and not engine.set_ffmpeg_path(args.ffmpeg):
+        print(f"ffmpeg を確認できませんでした: {args.ffmpeg}", file=sys.stderr)
+        return False
+    if not engine.ensure_ffmpeg():
+        print("ffmpeg が見つかりません。PATH に追加して再度お試しください。", file=sys.stderr)
+        return False
+    return True
+
+
+def _install_signal_handlers(control):
+    # ffmpeg runs in its own process group, so terminal job control has to
+    # be forwarded: SIGTERM shuts down like Ctrl+C, Ctrl+Z pauses the
+    # encoders before stopping ourselves and SIGCONT resumes them.
+    if os.name == "nt":
+        return
+
+    def on_term(signum, frame):
+        raise KeyboardInterrupt
+
+    def on_tstp(signum, frame):
+        control.pause()
+        os.kill(os.getpid(), signal.SIGSTOP)
+
+    def on_cont(signum, frame):
+        control.resume()
+
+    signal.signal(signal.SIGTERM, on_term)
+    signal.signal(signal.SIGTSTP, on_tstp)
+    signal.signal(signal.SIGCONT, on_cont)
+
+
+def cmd_convert(args):
+    settings = settings_from_args(args)
+    if settings.output_mode == "custom" and not os.path.isdir(settings.out_dir):
+        print(f"出力フォルダが存在しません: {settings.out_dir}", file=sys.stderr)
+        return 2
+    missing = [path for path in args.files if not os.path.exists(path)]
+    for path in missing:
+        print(f"入力が見つかりません: {path}", file=sys.stderr)
+    # "a.flac" has no folder part to put the output next to
+    files = engine.unique_media_files([os.path.abspath(path) for path in args.files])
+    if not _check_regions(settings):
+        return 2
+
+    if args.dry_run:
+        for job in engine.plan_batch(settings, files):
+            sheet = tracks.find_cue(job.input_path) if settings.split_cue and job.outputs else None
+            if job.skip:
+                print(f"# skip: {job.input_path}")
+            elif engine.extracts_regions(settings) and job.outputs:
+                duration = engine.effective_duration(settings, engine.probe_duration(job.input_path))
+                regions = engine.extract_regions(settings, job.input_path, duration)
+                if regions:
+                    groups = engine.track_outputs(settings, job, len(regions))
+                    print(shlex.join(engine.track_command(settings, job.input_path, regions, groups)))
+                else:
+                    print(shlex.join(job.argv))
+            elif sheet:
+                regions = tracks.cue_regions(sheet, job.input_path, settings.trim_start or 0.0)
+                print(f"# {job.input_path}: {sheet.path}")
+                groups = engine.track_outputs(settings, job, len(regions))
+                print(shlex.join(engine.track_command(settings, job.input_path, regions, groups)))
+            elif settings.split_silence:
+                # the track commands depend on the analysis, only that is known up front
+                print(f"# {job.input_path}: トラックはこの解析の結果で決まります")
+                print(shlex.join(engine.silence_analysis_command(settings, job.input_path)))
+            else:
+                print(shlex.join(job.argv))
+        return 0
+
+    if not _check_ffmpeg(args):
+        return 2
+
+    import journal
+
+    progress = print_progress if args.progress else None
+    control = engine.BatchControl()
+    _install_signal_handlers(control)
+    try:
+        result = engine.run_batch(
+            settings,
+            files,
+            log=print,
+            progress=progress,
+            progress_interval=1.0,
+            metrics_log=metrics.MetricsLog(args.metrics),
+            batch_journal=None if args.no_journal else journal.Journal.create(),
+            control=control,
+        )
+    except KeyboardInterrupt:
+        print("中断しました。`resume` で残りを再開できます。", file=sys.stderr)
+        return 130
+    return 1 if result.failures or missing else 0
+
+
+def cmd_resume(args):
+    import journal
+
+    states = journal.pending()
+    if args.list:
+        for state in states:
+            remaining = len(state.remaining())
+            print(f"{state.batch_id}  {state.created}  残り {remaining} / {len(state.jobs)}")
+        return 0
+    if args.batch:
+        states = [state for state in states if state.batch_id == args.batch]
+    if not states:
+        print("再開できるバッチがありません", file=sys.stderr)
+        return 1
+    state = states[-1]
+    if args.discard:
+        state.discard()
+        print(f"破棄しました: {state.batch_id}")
+        return 0
+    if not _check_ffmpeg(args):
+        return 2
+    progress = print_progress if args.progress else None
+    control = engine.BatchControl()
+    _install_signal_handlers(control)
+    try:
+        result = engine.resume_batch(
+            state,
+            log=print,
+            progress=progress,
+            progress_interval=1.0,
+            metrics_log=metrics.MetricsLog(args.metrics),
+            control=control,
+        )
+    except KeyboardInterrupt:
+        print("中断しました。`resume` で残りを再開できます。", file=sys.stderr)
+        return 130
+    return 1 if result.failures else 0
+
+
+def cmd_watch(args):
+    import watch
+
+    settings = settings_from_args(args)
+    if settings.output_mode == "custom" and not os.path.isdir(settings.out_dir):
+        print(f"出力フォルダが存在しません: {settings.out_dir}", file=sys.stderr)
+        return 2
+    for path in args.dirs:
+        if not os.path.isdir(path):
+            print(f"フォルダが見つかりません: {path}", file=sys.stderr)
+            return 2
+    if not _check_regions(settings):
+        return 2
+    if not _check_ffmpeg(args):
+        return 2
+
+    progress = print_progress if args.progress else None
+    control = engine.BatchControl()
+    _install_signal_handlers(control)
+    service = watch.WatchService(
+        settings,
+        [os.path.abspath(path) for path in args.dirs],
+        log=print,
+        progress=progress,
+        recursive=args.recursive,
+        poll=args.poll,
+        metrics_log=metrics.MetricsLog(args.metrics),
+        control=control,
+    )
+    service.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop(cancel=True)
+    return 1 if "failed" in service.results else 0
+
+
+def cmd_serve(args):
+    import cluster
+    import journal
+
+    settings = settings_from_args(args)
+    if settings.output_mode == "custom":
+        if not os.path.isdir(settings.out_dir):
+            print(f"出力フォルダが存在しません: {settings.out_dir}", file=sys.stderr)
+            return 2
+        settings = replace(settings, out_dir=os.path.abspath(settings.out_dir))
+    if args.lease <= 0 or args.attempts < 1:
+        print("--lease と --attempts は正の値を指定してください", file=sys.stderr)
+        return 2
+    # workers on other hosts resolve these paths themselves
+    files = engine.unique_media_files([os.path.abspath(path) for path in args.files])
+    control = engine.BatchControl()
+    coordinator = cluster.Coordinator(
+        settings,
+        engine.plan_batch(settings, files),
+        log=print,
+        progress=print_progress if args.progress else None,
+        metrics_log=metrics.MetricsLog(args.metrics),
+        batch_journal=None if args.no_journal else journal.Journal.create(),
+        lease=args.lease,
+        attempts=args.attempts,
+        token=args.token or os.environ.get(cluster.TOKEN_ENV, ""),
+        control=control,
+    )
+    try:
+        coordinator.serve(*args.listen)
+    except OSError as exc:
+        print(f"待ち受けできませんでした ({args.listen[0]}:{args.listen[1]}): {exc}", file=sys.stderr)
+        return 2
+    _install_signal_handlers(control)
+    try:
+        result = coordinator.run()
+    except KeyboardInterrupt:
+        print("中断しました。`resume` で残りをこのホストで再開できます。", file=sys.stderr)
+        return 130
+    return 1 if result.failures else 0
+
+
+def cmd_worker(args):
+    import cluster
+
+    if not _check_ffmpeg(args):
+        return 2
+    control = engine.BatchControl()
+    _install_signal_handlers(control)
+    node = cluster.Worker(
+        args.url,
+        slots=args.slots,
+        log=print,
+        token=args.token or os.environ.get(cluster.TOKEN_ENV, ""),
+        name=args.name,
+        control=control,
+    )
+    try:
+        results = node.run()
+    except KeyboardInterrupt:
+        print("中断しました。実行中のジョブは他のワーカーに再割り当てされます。", file=sys.stderr)
+        return 130
+    except (ConnectionError, PermissionError, RuntimeError) as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    return 1 if "failed" in results else 0
+
+
+def cmd_service(args):
+    import cluster
+    import service
+
+    if args.queue < 0 or args.queue_timeout <= 0:
+        print("--queue と --queue-timeout には正の値を指定してください", file=sys.stderr)
+        return 2
+    if args.spill_dir and not os.path.isdir(args.spill_dir):
+        print(f"フォルダが見つかりません: {args.spill_dir}", file=sys.stderr)
+        return 2
+    if not _check_ffmpeg(args):
+        return 2
+    server = service.ConversionService(
+        jobs=args.jobs,
+        queue=args.queue,
+        queue_timeout=args.queue_timeout,
+        log=print,
+        token=args.token or os.environ.get(cluster.TOKEN_ENV, ""),
+        priority=None if args.priority == "normal" else args.priority,
+        metrics_log=metrics.MetricsLog(args.metrics),
+        spill_dir=args.spill_dir,
+    )
+    try:
+        host, port = server.serve(*args.listen)[:2]
+    except OSError as exc:
+        print(f"待ち受けできませんでした ({args.listen[0]}:{args.listen[1]}): {exc}", file=sys.stderr)
+        return 2
+    print(f"変換サービスを開始しました: http://{host}:{port}/convert (同時 {server.jobs} 件, 待ち {server.max_queue} 件)")
+    _install_signal_handlers(server.control)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    print("変換サービスを停止しました。")
+    return 0
+
+
+def cmd_report(args):
+    path = args.metrics or metrics.default_path()
+    records = metrics.load(path, since=args.since)
+    if args.batch:
+        records = [record for record in records if record.get("batch") == args.batch]
+    if not records:
+        print(f"計測記録がありません: {path}", file=sys.stderr)
+        return 1
+    rows = metrics.summarize(records, by=args.by)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print(metrics.format_table(rows))
+    return 0
+
+
+def cmd_bench(args):
+    import bench
+
+    if args.compare:
+        try:
+            base, other = (bench.load_result(path) for path in args.compare)
+        except (OSError, ValueError) as exc:
+            print(exc, file=sys.stderr)
+            return 2
+        print(bench.format_comparison(base, other))
+        return 0
+    if args.repeat < 1:
+        print("--repeat は 1 以上を指定してください", file=sys.stderr)
+        return 2
+    if not _check_ffmpeg(args):
+        return 2
+    out = args.out or time.strftime("bench-%Y%m%d-%H%M%S.json")
+    try:
+        document = bench.run(out, quick=args.quick, repeat=args.repeat, formats=args.format)
+    except RuntimeError as exc:
+        print(f"素材を生成できませんでした: {exc}", file=sys.stderr)
+        return 1
+    print(f"結果を保存しました: {out}")
+    return 1 if any(result["failures"] for result in document["results"]) else 0
+
+
+def print_progress(snapshot):
+    parts = [
+        f"{snapshot.fraction * 100:5.1f}% {snapshot.finished}/{snapshot.total}"
+        f" eta {engine.format_duration(snapshot.eta)}"
+    ]
+    for job in snapshot.running:
+        speed = f"{job.speed:.1f}x" if job.speed else "-"
+        parts.append(f"[{job.index}] {job.fraction * 100:.0f}% {speed}")
+    print("  ".join(parts), file=sys.stderr, flush=True)
+
+
+COMMANDS = {
+    "convert": cmd_convert,
+    "watch": cmd_watch,
+    "resume": cmd_resume,
+    "serve": cmd_serve,
+    "worker": cmd_worker,
+    "service": cmd_service,
+    "report": cmd_report,
+    "bench": cmd_bench,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
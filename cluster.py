@@ -0,0 +1,514 @@
+import hmac
+import json
+import os
+import platform
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import wait
+from dataclasses import replace
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cache
+import engine
+import journal
+import metrics
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 8765
+LEASE_SECONDS = 30.0
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2.0
+# the coordinator checks its leases once a second; a longer gap means it was
+# stopped itself (Ctrl+Z) and the workers could not renew meanwhile
+STALL_SECONDS = 5.0
+RECONNECT_TIMEOUT = 60.0
+TOKEN_HEADER = "X-AudioConverter-Token"
+TOKEN_ENV = "AUDIOCONVERTER_TOKEN"
+FORWARD_LOG_LINES = 50
+PROGRESS_FIELDS = ("state", "duration", "out_time", "speed")
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Coordinator:
+    # Holds the queue and the settings snapshot of one batch. Workers lease a
+    # job at a time over HTTP, renew the lease while ffmpeg runs and report
+    # the result with its metrics record. A lease that runs out (the worker
+    # died or lost the network) puts the job back for someone else, up to
+    # `attempts` tries; a failure the worker reports itself is final.
+    def __init__(
+        self,
+        settings,
+        jobs,
+        log=print,
+        progress=None,
+        progress_interval=1.0,
+        metrics_log=None,
+        batch_journal=None,
+        lease=LEASE_SECONDS,
+        attempts=MAX_ATTEMPTS,
+        token="",
+        control=None,
+    ):
+        self.settings = settings
+        self.jobs = {job.index: job for job in jobs}
+        self.log = log
+        self.lease_seconds = lease
+        self.max_attempts = attempts
+        self.token = token
+        self.journal = batch_journal
+        # paused: no new leases go out and running ones don't expire
+        self.control = control or engine.BatchControl()
+        self.metrics = metrics.MetricsLog() if metrics_log is None else metrics_log
+        self.progress = engine.ProgressTracker(jobs, progress, progress_interval)
+        self.batch_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        self.statuses = {}
+        self.leases = {}
+        self.attempts = {}
+        self.workers = {}
+        self._told_done = set()
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._checked = time.monotonic()
+        self._server = None
+
+    def serve(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.coordinator = self
+        threading.Thread(target=self._server.serve_forever, name="cluster-http", daemon=True).start()
+        return self._server.server_address
+
+    def run(self):
+        jobs = list(self.jobs.values())
+        if self.journal:
+            self.journal.begin(self.settings, jobs)
+        probes = engine.PROBE.prefetch(job.input_path for job in jobs if not job.skip)
+        self._queue.extend(job.index for job in self._schedule(jobs, probes))
+        if not self._queue:
+            self._done.set()
+        host, port = self._server.server_address[:2]
+        self.log(f"コーディネーターを開始しました: http://{host}:{port}/ ({len(jobs)} 件, リース {self.lease_seconds:g} 秒)")
+        try:
+            while not self._done.wait(1.0):
+                with self._lock:
+                    self._expire(time.monotonic())
+        except BaseException:
+            self.stop()
+            if self.journal:
+                self.journal.close()
+            raise
+        self._linger()
+        self.stop()
+        return self._result()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _schedule(self, jobs, probes=()):
+        # longest inputs first, as in BatchRunner._schedule
+        if probes:
+            wait(probes, timeout=engine.SCHEDULE_PROBE_WAIT)
+        durations = {}
+        for job in jobs:
+            info = engine.PROBE.peek(job.input_path)
+            durations[job.index] = (info.duration if info else None) or 0.0
+        return sorted(jobs, key=lambda job: -durations[job.index])
+
+    def _linger(self):
+        # let workers that are still polling hear that the batch is over
+        deadline = time.monotonic() + POLL_INTERVAL * 2
+        while time.monotonic() < deadline:
+            with self._lock:
+                recent = {name for name, seen in self.workers.items() if time.monotonic() - seen < self.lease_seconds}
+                if recent <= self._told_done:
+                    return
+            time.sleep(0.2)
+
+    def _result(self):
+        results = [self.statuses.get(index, "failed") for index in sorted(self.jobs)]
+        failures = results.count("failed")
+        hits = results.count("cached")
+        cancelled = results.count("cancelled")
+        skipped = results.count("skipped") + hits
+        misses = 0
+        if self.settings.cache:
+            misses = sum(
+                1 for index, job in self.jobs.items() if job.cache_key and self.statuses.get(index) != "cached"
+            )
+            self.log(f"キャッシュ: ヒット {hits} / ミス {misses}")
+        if failures:
+            self.log(engine.log_line(f"完了 (エラーあり)。失敗: {failures}", "error"))
+        else:
+            self.log("完了。")
+        if self.journal:
+            self.journal.finish()
+        return engine.BatchResult(len(results), failures, skipped, hits, misses, cancelled)
+
+    # -- protocol, called from the HTTP handler threads --
+
+    def batch_info(self):
+        return {
+            "v": PROTOCOL_VERSION,
+            "batch": self.batch_id,
+            "settings": self.settings.to_dict(),
+            "lease": self.lease_seconds,
+        }
+
+    def status(self):
+        with self._lock:
+            return {
+                "batch": self.batch_id,
+                "total": len(self.jobs),
+                "finished": len(self.statuses),
+                "queued": len(self._queue),
+                "leased": {lease: [index, worker] for lease, (index, worker, _) in self.leases.items()},
+                "workers": sorted(self.workers),
+            }
+
+    def lease(self, worker):
+        now = time.monotonic()
+        with self._lock:
+            self.workers[worker] = now
+            self._expire(now)
+            if self._done.is_set():
+                self._told_done.add(worker)
+                return {"done": True}
+            if not self._queue or self.control.paused:
+                return {"wait": POLL_INTERVAL}
+            index = self._queue.popleft()
+            lease = secrets.token_hex(8)
+            self.leases[lease] = (index, worker, now + self.lease_seconds)
+            self.attempts[index] = self.attempts.get(index, 0) + 1
+            attempt = self.attempts[index]
+        job = self.jobs[index]
+        if self.journal:
+            self.journal.job_state(index, "running")
+        self.progress.update(index, state="running")
+        retry = f" (再試行 {attempt - 1})" if attempt > 1 else ""
+        self.log(engine.log_line(f"{worker} に割り当て: {job.input_path}{retry}", "info", index))
+        return {"lease": lease, "expires": self.lease_seconds, "job": journal.encode_job(job)}
+
+    def renew(self, lease, progress=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self.leases.get(lease)
+            if entry is None:
+                raise LeaseLost(lease)
+            index, worker, _ = entry
+            self.leases[lease] = (index, worker, now + self.lease_seconds)
+            self.workers[worker] = now
+        values = {key: value for key, value in (progress or {}).items() if key in PROGRESS_FIELDS}
+        if values:
+            self.progress.update(index, **values)
+        return {"expires": self.lease_seconds}
+
+    def complete(self, lease, status, outputs=None, record=None, lines=()):
+        with self._lock:
+            entry = self.leases.pop(lease, None)
+            if entry is None:
+                # the lease ran out and the job went to someone else
+                raise LeaseLost(lease)
+            index, worker, _ = entry
+            self.workers[worker] = time.monotonic()
+            if status == "cancelled":
+                # the worker is shutting down; hand the job to another one
+                # without counting it as a failed attempt
+                self._queue.appendleft(index)
+                self.attempts[index] -= 1
+                requeued = True
+            else:
+                self.statuses[index] = status
+                requeued = False
+        for level, message in lines:
+            self.log(engine.log_line(f"[{worker}] {message}", level, index))
+        if requeued:
+            self.log(engine.log_line(f"{worker} が停止したため再割り当てします", "warning", index))
+            self.progress.update(index, state="queued", out_time=0.0)
+            return {}
+        if self.journal:
+            self.journal.job_state(index, status, outputs)
+        if self.metrics and record:
+            self.metrics.write({**record, "batch": self.batch_id, "worker": worker})
+        values = {"total_size": record.get("output_bytes") or 0} if record else {}
+        self.progress.update(index, force=True, state="skipped" if status == "cached" else status, **values)
+        self._check_done()
+        return {}
+
+    def _expire(self, now):
+        # caller holds the lock
+        stalled = now - self._checked > STALL_SECONDS
+        self._checked = now
+        if stalled or self.control.paused:
+            for lease, (index, worker, _) in self.leases.items():
+                self.leases[lease] = (index, worker, now + self.lease_seconds)
+            return
+        for lease, (index, worker, expires) in list(self.leases.items()):
+            if expires > now:
+                continue
+            del self.leases[lease]
+            job = self.jobs[index]
+            if self.attempts.get(index, 0) >= self.max_attempts:
+                self.statuses[index] = "failed"
+                self.log(engine.log_line(f"リース切れ ({worker}), 再試行の上限: {job.input_path}", "error", index))
+                if self.journal:
+                    self.journal.job_state(index, "failed")
+                self.progress.update(index, force=True, state="failed")
+            else:
+                self._queue.appendleft(index)
+                self.log(engine.log_line(f"リース切れ ({worker}), 再試行します: {job.input_path}", "warning", index))
+                self.progress.update(index, state="queued", out_time=0.0)
+        self._check_done_locked()
+
+    def _check_done(self):
+        with self._lock:
+            self._check_done_locked()
+
+    def _check_done_locked(self):
+        if len(self.statuses) >= len(self.jobs):
+            self._done.set()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = f"AudioConverter/{PROTOCOL_VERSION}"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _authorized(self):
+        token = self.server.coordinator.token
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), token)
+
+    def _reply(self, code, body=None):
+        data = json.dumps(body or {}, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._reply(403, {"error": "token"})
+        coordinator = self.server.coordinator
+        if self.path == "/batch":
+            return self._reply(200, coordinator.batch_info())
+        if self.path == "/status":
+            return self._reply(200, coordinator.status())
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._reply(403, {"error": "token"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._reply(400, {"error": "bad request"})
+        coordinator = self.server.coordinator
+        try:
+            if self.path == "/lease":
+                return self._reply(200, coordinator.lease(str(body.get("worker") or self.client_address[0])))
+            if self.path == "/renew":
+                return self._reply(200, coordinator.renew(body["lease"], body.get("progress")))
+            if self.path == "/complete":
+                reply = coordinator.complete(
+                    body["lease"], body["status"], body.get("outputs"), body.get("record"), body.get("log") or ()
+                )
+                return self._reply(200, reply)
+        except LeaseLost:
+            return self._reply(410, {"error": "lease lost"})
+        except (KeyError, TypeError, ValueError):
+            return self._reply(400, {"error": "bad request"})
+        self._reply(404, {"error": "not found"})
+
+
+class _JobRecords:
+    # stands in for MetricsLog on a worker: records go back to the
+    # coordinator with the result instead of into a local file
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._lines = {}
+
+    def write(self, record):
+        with self._lock:
+            self._records[record["index"]] = record
+
+    def log(self, index, message):
+        with self._lock:
+            lines = self._lines.setdefault(index, deque(maxlen=FORWARD_LOG_LINES))
+            lines.append([getattr(message, "level", "info"), str(message)])
+
+    def pop(self, index):
+        with self._lock:
+            return self._records.pop(index, None), list(self._lines.pop(index, ()))
+
+
+class Worker:
+    # Pulls jobs from a coordinator and runs them with the normal runner, so
+    # the argv, staging, verification and metrics are the same as a local
+    # batch. Inputs and outputs must be reachable at the same paths on every
+    # host (shared storage).
+    def __init__(self, url, slots=1, log=print, token="", name=None, control=None):
+        self.url = url.rstrip("/")
+        self.slots = slots
+        self.log = log
+        self.token = token
+        self.name = name or f"{platform.node()}-{os.getpid()}"
+        self.control = control or engine.BatchControl()
+        # replaced by the coordinator's lease once the batch is known
+        self.lease_seconds = LEASE_SECONDS
+        self.records = _JobRecords()
+        self.runner = None
+        self.results = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        info = self._call("/batch")
+        if info.get("v") != PROTOCOL_VERSION:
+            raise RuntimeError(f"プロトコルのバージョンが一致しません: {info.get('v')}")
+        self.settings = engine.Settings.from_dict(info["settings"])
+        self.lease_seconds = info.get("lease", LEASE_SECONDS)
+        self.runner = engine.BatchRunner(
+            replace(self.settings, parallel=self.slots), log=self._log, metrics_log=self.records, control=self.control
+        )
+        self.runner.begin(job_count=self.slots or os.cpu_count() or 1)
+        self.log(f"ワーカー {self.name}: {self.url} のバッチ {info['batch']} に参加しました")
+        self.log(self.runner.layout.describe())
+        # slots signal an Event rather than being joined: a Ctrl+C landing in
+        # Thread.join can leave the thread looking finished when it isn't
+        slots = [threading.Event() for _ in range(self.runner.layout.workers)]
+        for n, finished in enumerate(slots):
+            threading.Thread(target=self._slot, args=(finished,), name=f"cluster-slot-{n}", daemon=True).start()
+        try:
+            for finished in slots:
+                while not finished.wait(1.0):
+                    pass
+        except BaseException:
+            # cancelled jobs are reported back so they are re-queued at once
+            self.control.shutdown()
+            for finished in slots:
+                finished.wait(10.0)
+            raise
+        self.log(f"ワーカー {self.name}: 終了 ({len(self.results)} 件)")
+        return self.results
+
+    def _log(self, message):
+        index = getattr(message, "job", None)
+        if index is not None:
+            self.records.log(index, message)
+        self.log(message)
+
+    def _slot(self, finished):
+        try:
+            self._loop()
+        finally:
+            finished.set()
+
+    def _loop(self):
+        while not self.control.cancel_requested.is_set():
+            try:
+                reply = self._call("/lease", {"worker": self.name})
+            except ConnectionError as exc:
+                self.log(engine.log_line(f"コーディネーターに接続できません: {exc}", "error"))
+                return
+            if reply.get("done"):
+                return
+            if "job" not in reply:
+                self.control.cancel_requested.wait(reply.get("wait", POLL_INTERVAL))
+                continue
+            self._run_leased(reply)
+
+    def _run_leased(self, reply):
+        lease = reply["lease"]
+        job = journal.decode_job(self.settings, reply["job"])
+        self.runner.add(job)
+        lost = threading.Event()
+        finished = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(lease, job, reply["expires"] / 3.0, lost, finished), daemon=True
+        )
+        heartbeat.start()
+        try:
+            status = self.runner.run_job(job)
+        except Exception as exc:
+            self._log(engine.log_line(f"エラー: {job.input_path}: {exc}", "error", job.index))
+            status = "failed"
+        finally:
+            finished.set()
+            heartbeat.join()
+        record, lines = self.records.pop(job.index)
+        if lost.is_set():
+            # someone else owns the job now; our partial work was cancelled
+            self.control.restore([job.input_path])
+            return
+        outputs = None
+        paths = self.runner.written.pop(job.index, job.output_paths)
+        if status in ("done", "cached"):
+            try:
+                outputs = [cache.output_record(path) for path in paths]
+            except OSError:
+                status = "failed"
+        body = {"lease": lease, "status": status, "outputs": outputs, "record": record, "log": lines}
+        try:
+            self._call("/complete", body)
+        except LeaseLost:
+            self.log(engine.log_line("リースが失効していたため結果は破棄されました", "warning", job.index))
+        except ConnectionError as exc:
+            self.log(engine.log_line(f"結果を送信できませんでした: {exc}", "error", job.index))
+        with self._lock:
+            self.results.append(status)
+
+    def _heartbeat(self, lease, job, interval, lost, finished):
+        while not finished.wait(interval):
+            progress = self.runner.progress.jobs.get(job.index)
+            values = {key: getattr(progress, key) for key in PROGRESS_FIELDS} if progress else {}
+            try:
+                self._call("/renew", {"lease": lease, "progress": values}, retry=False)
+            except LeaseLost:
+                self.log(engine.log_line("リースを失ったため中止します", "warning", job.index))
+                lost.set()
+                self.control.cancel([job.input_path])
+                return
+            except ConnectionError:
+                # keep going; the lease outlives a few missed renewals
+                continue
+
+    def _call(self, path, body=None, retry=True):
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        deadline = time.monotonic() + (RECONNECT_TIMEOUT if retry else 0.0)
+        delay = 0.5
+        while True:
+            request = urllib.request.Request(self.url + path, data=data, headers=headers)
+            try:
+                with urllib.request.urlopen(request, timeout=self.lease_seconds) as response:
+                    return json.loads(response.read() or b"{}")
+            except urllib.error.HTTPError as exc:
+                if exc.code == 410:
+                    raise LeaseLost(path)
+                if exc.code == 403:
+                    raise PermissionError("トークンが一致しません")
+                error = exc
+            except (urllib.error.URLError, OSError, ValueError) as exc:
+                error = exc
+            if time.monotonic() >= deadline or self.control.cancel_requested.is_set():
+                raise ConnectionError(f"{self.url}{path}: {error}")
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
@@ -0,0 +1,2126 @@
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, fields, replace
+from datetime import datetime
+
+import cache
+import metrics
+import probe
+import scheduler
+import tracks
+
+# seekable_output: the muxer goes back to patch its header when it finishes
+# (RIFF sizes, the mp4 moov atom), so it can't write to a pipe
+# segment_join: how pieces encoded in parallel are put back together without
+# re-encoding ("pcm": plain concat, "adts": frame splice); other formats go
+# through a lossless intermediate
+FORMATS = {
+    "wav": {
+        "label": "WAV (pcm_s16le)",
+        "codec": "pcm_s16le",
+        "ext": "wav",
+        "copy_codecs": ("pcm_s16le",),
+        "bitrate": False,
+        "muxer": "wav",
+        "mime": "audio/wav",
+        "seekable_output": True,
+        "segment_join": "pcm",
+    },
+    "mp3": {
+        "label": "MP3 (libmp3lame)",
+        "codec": "libmp3lame",
+        "ext": "mp3",
+        "copy_codecs": ("mp3",),
+        "bitrate": True,
+        "cover_art": True,
+        "bitrate_default": "192k",
+        "muxer": "mp3",
+        "mime": "audio/mpeg",
+    },
+    "m4a": {
+        "label": "M4A (AAC)",
+        "codec": "aac",
+        "ext": "m4a",
+        "copy_codecs": ("aac",),
+        "bitrate": True,
+        "cover_art": True,
+        "bitrate_default": "192k",
+        "muxer": "ipod",
+        "mime": "audio/mp4",
+        "seekable_output": True,
+    },
+    "aac": {
+        "label": "AAC (raw)",
+        "codec": "aac",
+        "ext": "aac",
+        "copy_codecs": ("aac",),
+        "bitrate": True,
+        "bitrate_default": "192k",
+        "muxer": "adts",
+        "mime": "audio/aac",
+        "segment_join": "adts",
+    },
+    "flac": {
+        "label": "FLAC",
+        "codec": "flac",
+        "ext": "flac",
+        "copy_codecs": ("flac",),
+        "bitrate": False,
+        "cover_art": True,
+        "muxer": "flac",
+        "mime": "audio/flac",
+    },
+    "opus": {
+        "label": "Opus (libopus)",
+        "codec": "libopus",
+        "ext": "opus",
+        "copy_codecs": ("opus",),
+        "bitrate": True,
+        "bitrate_default": "128k",
+        "muxer": "opus",
+        "mime": "audio/ogg; codecs=opus",
+    },
+    "ogg": {
+        "label": "Ogg Vorbis (libvorbis)",
+        "codec": "libvorbis",
+        "ext": "ogg",
+        "copy_codecs": ("vorbis",),
+        "bitrate": True,
+        "bitrate_default": "160k",
+        "muxer": "ogg",
+        "mime": "audio/ogg",
+    },
+}
+
+INPUT_EXTENSIONS = {
+    "wav", "wave", "mp3", "m4a", "m4b", "aac", "flac", "opus", "ogg", "oga", "wma",
+    "aif", "aiff", "aifc", "caf", "ape", "wv", "tta", "ac3", "eac3", "dts", "amr",
+    "mka", "mp4", "m4v", "mov", "mkv", "webm", "avi", "3gp", "mpg", "mpeg", "ts",
+}
+
+SOURCE_VALUE = "ソース一致"
+FORCE_MISSING_FFMPEG = False
+FFMPEG_PATH = None
+FORCE_PLATFORM = None
+
+AAC_PROFILES = {"LC": "aac_low", "HE": "aac_he", "HEv2": "aac_he_v2"}
+# the values each enumerated Settings field understands (CLI choices and
+# service validation; anything else would reach codec_args as a KeyError)
+SETTING_CHOICES = {
+    "output_mode": ("sync", "subdir", "custom"),
+    "bitrate_mode": ("cbr", "vbr", "custom"),
+    "channels": ("1", "2"),
+    "bit_depth": ("16", "24", "32"),
+    "stereo_mode": ("joint", "stereo"),
+    "opus_bandwidth": ("narrow", "medium", "wide", "superwide", "full"),
+    "metadata": ("keep", "strip"),
+    "resample": ("soxr", "swr"),
+    "dither": ("none", "triangular", "shibata"),
+    "replaygain": ("track", "album"),
+    "aac_profile": tuple(AAC_PROFILES),
+    "opus_frame": ("2.5", "5", "10", "20", "40", "60"),
+    "opus_app": ("audio", "voip", "lowdelay"),
+    "overwrite": ("overwrite", "skip", "number"),
+    "post_action": ("none", "copy", "move"),
+    "album_art": ("keep", "strip"),
+    "priority": ("normal", "low", "idle"),
+}
+LOUDNORM_TP = "-1.5"
+LOUDNORM_LRA = "11"
+LOUDNORM_CACHE = "loudnorm.jsonl"
+SILENCE_CACHE = "silence.jsonl"
+SEEK_PREROLL = 0.5
+# how long the first jobs may wait for durations to order a cold batch by;
+# on a big batch the order of what's still unprobed hardly matters
+SCHEDULE_PROBE_WAIT = 5.0
+MANIFEST_CACHE = "manifest.jsonl"
+LOG_LEVELS = ("debug", "info", "warning", "error")
+# in-progress outputs: ".<stem>.acvtmp-<host>-<pid>.<ext>" next to the final
+# file; the host tells whose pid it is when workers share the storage
+TEMP_MARK = ".acvtmp-"
+TEMP_PATTERN = re.compile(r"^\..+\.acvtmp-(?:([A-Za-z0-9_-]+)-)?(\d+)\.[^.]+$")
+# temps of other hosts (or where pids can't be checked) untouched this long
+# are taken as left behind
+TEMP_MAX_AGE = 12 * 3600
+TEMP_HOST = re.sub(r"[^A-Za-z0-9-]", "_", socket.gethostname()) or "localhost"
+
+
+class LogLine(str):
+    # Prints like any message; GUI log panes read level/job to filter.
+    level = "info"
+    job = None
+
+
+def log_line(message, level="info", job=None):
+    line = LogLine(message)
+    line.level = level
+    line.job = job
+    return line
+
+
+def which_ffmpeg():
+    if FORCE_MISSING_FFMPEG:
+        return None
+    if FFMPEG_PATH and os.path.isfile(FFMPEG_PATH):
+        return FFMPEG_PATH
+    exe = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
+    return shutil.which(exe)
+
+
+def which_ffprobe():
+    if FFMPEG_PATH:
+        base_dir = os.path.dirname(FFMPEG_PATH)
+        exe = "ffprobe.exe" if os.name == "nt" else "ffprobe"
+        candidate = os.path.join(base_dir, exe)
+        if os.path.isfile(candidate):
+            return candidate
+    exe = "ffprobe.exe" if os.name == "nt" else "ffprobe"
+    return shutil.which(exe)
+
+
+PROBE = probe.ProbeService(which_ffprobe)
+
+
+def set_ffmpeg_path(path):
+    global FFMPEG_PATH
+    if path and os.path.isfile(path):
+        FFMPEG_PATH = path
+        dir_path = os.path.dirname(path)
+        os.environ["PATH"] = dir_path + os.pathsep + os.environ.get("PATH", "")
+        PROBE.reset_tool()
+        return True
+    return False
+
+
+def find_ffmpeg_in_common_paths():
+    candidates = []
+    platform = FORCE_PLATFORM or sys.platform
+    if platform.startswith("win"):
+        candidates += [
+            r"C:\ffmpeg\bin\ffmpeg.exe",
+            r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
+            r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe",
+        ]
+    elif platform == "darwin":
+        candidates += [
+            "/opt/homebrew/bin/ffmpeg",
+            "/usr/local/bin/ffmpeg",
+        ]
+    else:
+        candidates += [
+            "/usr/bin/ffmpeg",
+            "/usr/local/bin/ffmpeg",
+        ]
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def ensure_ffmpeg():
+    if which_ffmpeg():
+        return True
+    auto = find_ffmpeg_in_common_paths()
+    return bool(auto and set_ffmpeg_path(auto))
+
+
+def ffmpeg_download_url():
+    platform = FORCE_PLATFORM or sys.platform
+    if platform.startswith("win"):
+        return "https://www.gyan.dev/ffmpeg/builds/"
+    if platform == "darwin":
+        return "https://ffmpeg.org/download.html#build-mac"
+    return "https://ffmpeg.org/download.html#build-linux"
+
+
+def is_media_file(name, extensions=None):
+    base = os.path.basename(name)
+    if base.startswith("."):
+        return False
+    ext = os.path.splitext(base)[1][1:].lower()
+    return ext in (extensions or INPUT_EXTENSIONS)
+
+
+def iter_media_files(paths, extensions=None):
+    # Explicit files are taken as-is; directories are walked depth-first with
+    # os.scandir, keeping media files only and skipping hidden entries.
+    for path in paths:
+        if not os.path.isdir(path):
+            if path.lower().endswith(".cue"):
+                # a sheet given explicitly stands for its disc image
+                path = tracks.cue_audio(path)
+                if path:
+                    yield path
+            elif os.path.isfile(path):
+                yield path
+            continue
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and is_media_file(entry.name, extensions):
+                        yield entry.path
+                except OSError:
+                    continue
+            stack.extend(reversed(subdirs))
+
+
+class InputSet:
+    # O(1) duplicate check for input files: a path counts once per normalized
+    # real path and once per (device, inode), so symlinks and hardlinks to the
+    # same file are only added the first time.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._norms = set()
+        self._inodes = set()
+
+    @staticmethod
+    def _identity(path):
+        norm = os.path.normcase(os.path.realpath(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return norm, None
+        return norm, (st.st_dev, st.st_ino) if st.st_ino else None
+
+    def add(self, path):
+        norm, inode = self._identity(path)
+        with self._lock:
+            if path in self._paths or norm in self._norms or inode in self._inodes:
+                return False
+            self._paths[path] = (norm, inode)
+            self._norms.add(norm)
+            if inode is not None:
+                self._inodes.add(inode)
+            return True
+
+    def discard(self, path):
+        with self._lock:
+            identity = self._paths.pop(path, None)
+            if identity is None:
+                return
+            norm, inode = identity
+            self._norms.discard(norm)
+            self._inodes.discard(inode)
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+            self._norms.clear()
+            self._inodes.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._paths)
+
+
+def unique_media_files(paths, extensions=None):
+    seen = InputSet()
+    return [path for path in iter_media_files(paths, extensions) if seen.add(path)]
+
+
+def safe_stem(path):
+    base = os.path.basename(path)
+    if "." in base:
+        return ".".join(base.split(".")[:-1])
+    return base
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def ensure_dir(path):
+    if path and not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
+
+def temp_output_path(path):
+    folder, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(folder, f".{stem}{TEMP_MARK}{TEMP_HOST}-{os.getpid()}{ext}")
+
+
+def is_temp_output(path):
+    return bool(TEMP_PATTERN.match(os.path.basename(path)))
+
+
+def pid_alive(pid):
+    # None when it can't be told (Windows: os.kill would terminate the process)
+    if os.name == "nt":
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def sweep_temp_outputs(folder):
+    # Removes temp outputs left behind by runs that crashed or were killed.
+    removed = []
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return removed
+    for entry in entries:
+        match = TEMP_PATTERN.match(entry.name)
+        if not match:
+            continue
+        host, pid = match.group(1), int(match.group(2))
+        # temps from before the host was recorded are taken as local
+        local = host is None or host == TEMP_HOST
+        if local and pid == os.getpid():
+            continue
+        try:
+            alive = pid_alive(pid) if local else None
+            if alive is None:
+                alive = time.time() - entry.stat().st_mtime < TEMP_MAX_AGE
+            if not alive and entry.is_file():
+                os.remove(entry.path)
+                removed.append(entry.path)
+        except OSError:
+            continue
+    return removed
+
+
+def fsync_file(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def fsync_dir(path):
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def commit_output(temp, final, no_clobber=False):
+    # fsync + rename into place; with no_clobber an output that appeared in
+    # the meantime is kept and the temp discarded (returns False)
+    fsync_file(temp)
+    if no_clobber:
+        try:
+            os.link(temp, final)
+        except FileExistsError:
+            os.remove(temp)
+            return False
+        except OSError:
+            if os.path.exists(final):
+                os.remove(temp)
+                return False
+            os.replace(temp, final)
+        else:
+            os.remove(temp)
+    else:
+        os.replace(temp, final)
+    fsync_dir(os.path.dirname(final) or ".")
+    return True
+
+
+def remove_quietly(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(max(seconds, 0))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+# Settings are snapshotted once per batch (from the GUI widgets or from CLI
+# arguments) and never read again from Tk, so workers can run on any thread.
+# None means "ソース一致" (leave it to ffmpeg / keep the source value).
+@dataclass(frozen=True)
+class Settings:
+    # first entry is the primary format (the one the bitrate field refers to)
+    formats: tuple = ("wav",)
+    bitrate: str = ""
+    output_mode: str = "sync"
+    subdir_name: str = "converted"
+    out_dir: str = ""
+    sample_rate: str | None = None
+    bitrate_mode: str | None = None
+    bitrate_value: str = ""
+    quality: str | None = None
+    channels: str | None = None
+    volume_db: str | None = None
+    bit_depth: str | None = None
+    flac_level: str | None = None
+    stereo_mode: str | None = None
+    opus_bandwidth: str | None = None
+    codec_quality: str | None = None
+    trim_start: float | None = None
+    trim_end: float | None = None
+    metadata: str | None = None
+    suffix: str = ""
+    resample: str | None = None
+    dither: str | None = None
+    replaygain: str | None = None
+    silence_trim: bool = False
+    fade_in: float | None = None
+    fade_out_start: float | None = None
+    fade_out: float | None = None
+    loudnorm: bool = False
+    loudnorm_target: str = "-16"
+    loudnorm_two_pass: bool = False
+    aac_profile: str | None = None
+    mp3_vbr: str | None = None
+    opus_frame: str | None = None
+    opus_app: str | None = None
+    vorbis_quality: str | None = None
+    name_template: str = ""
+    overwrite: str | None = None
+    post_action: str | None = None
+    # 0 = auto (sized from usable cores by scheduler.plan_layout)
+    parallel: int = 1
+    audio_only: bool = False
+    album_art: str | None = None
+    info: bool = False
+    cache: bool = False
+    cache_hash: bool = False
+    force_reencode: bool = False
+    verify_output: bool = False
+    # background priority for the ffmpeg children ("low" / "idle")
+    priority: str | None = None
+    # percent of usable cores the batch may use; 0 = no cap
+    cpu_share: int = 0
+    # encode long inputs as time segments in parallel (segments.py)
+    segment_parallel: bool = False
+    # cut the input into tracks at silences of at least split_gap seconds,
+    # keeping every track at least split_min_length seconds long
+    split_silence: bool = False
+    split_gap: float = 2.0
+    split_min_length: float = 60.0
+    # cut disc images at the tracks of their .cue sheet
+    split_cue: bool = False
+    # clips to extract, typed ("0:10-0:25; 1:30-2:00") and/or from a CSV
+    # list (tracks.parse_clip_file); fade_in/fade_out then apply per clip
+    regions: str = ""
+    regions_file: str = ""
+
+    @property
+    def primary_format(self):
+        return self.formats[0] if self.formats else "wav"
+
+    def to_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    @classmethod
+    def from_dict(cls, data):
+        names = {f.name for f in fields(cls)}
+        values = {k: v for k, v in data.items() if k in names}
+        if "formats" in values:
+            values["formats"] = tuple(values["formats"])
+        return cls(**values)
+
+
+def parse_formats(value):
+    keys = []
+    for part in str(value).replace(" ", "").split(","):
+        if not part:
+            continue
+        if part not in FORMATS:
+            raise ValueError(f"unknown format: {part}")
+        if part not in keys:
+            keys.append(part)
+    if not keys:
+        raise ValueError("no format given")
+    return tuple(keys)
+
+
+@dataclass(frozen=True)
+class Output:
+    format: str
+    path: str
+
+
+@dataclass(frozen=True)
+class Job:
+    index: int
+    input_path: str
+    outputs: tuple
+    argv: tuple
+    skip: bool = False
+    cache_key: str = ""
+    copy_formats: tuple = ()
+
+    @property
+    def output_path(self):
+        return self.outputs[0].path if self.outputs else ""
+
+    @property
+    def output_paths(self):
+        return [output.path for output in self.outputs]
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    total: int
+    failures: int
+    skipped: int
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cancelled: int = 0
+
+
+@dataclass
+class JobProgress:
+    index: int
+    path: str
+    state: str = "queued"
+    duration: float | None = None
+    out_time: float = 0.0
+    speed: float | None = None
+    total_size: int = 0
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed", "skipped", "cancelled")
+
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        if not self.duration:
+            return 0.0
+        return min(self.out_time / self.duration, 1.0)
+
+    @property
+    def eta(self):
+        if self.finished:
+            return 0.0
+        if not self.duration or not self.speed:
+            return None
+        return max(self.duration - self.out_time, 0.0) / self.speed
+
+
+@dataclass(frozen=True)
+class BatchProgress:
+    total: int
+    finished: int
+    fraction: float
+    elapsed: float
+    eta: float | None
+    running: tuple
+
+
+class ProgressTracker:
+    def __init__(self, jobs=(), callback=None, interval=0.25, job_callback=None):
+        self.jobs = {job.index: JobProgress(job.index, job.input_path) for job in jobs}
+        self.callback = callback
+        self.job_callback = job_callback
+        self.interval = interval
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._last_emit = 0.0
+
+    def update(self, index, force=False, **values):
+        with self._lock:
+            progress = self.jobs[index]
+            for key, value in values.items():
+                setattr(progress, key, value)
+            # state transitions are reported per job, unthrottled
+            changed = replace(progress) if self.job_callback and "state" in values else None
+            now = time.monotonic()
+            snapshot = None
+            if self.callback and (force or now - self._last_emit >= self.interval):
+                self._last_emit = now
+                snapshot = self._snapshot(now)
+        if changed is not None:
+            self.job_callback(changed)
+        if snapshot is not None:
+            self.callback(snapshot)
+
+    def add(self, job):
+        with self._lock:
+            self.jobs[job.index] = JobProgress(job.index, job.input_path)
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(time.monotonic())
+
+    def _snapshot(self, now):
+        jobs = list(self.jobs.values())
+        known = [job.duration for job in jobs if job.duration]
+        fallback = sum(known) / len(known) if known else 1.0
+        weight_total = 0.0
+        weight_done = 0.0
+        for job in jobs:
+            weight = job.duration or fallback
+            weight_total += weight
+            weight_done += weight * job.fraction
+        fraction = weight_done / weight_total if weight_total else 1.0
+        elapsed = now - self.started
+        eta = None
+        if 0.0 < fraction < 1.0:
+            eta = elapsed * (1.0 - fraction) / fraction
+        elif fraction >= 1.0:
+            eta = 0.0
+        running = tuple(replace(job) for job in jobs if job.state in ("analyzing", "running", "joining"))
+        finished = sum(1 for job in jobs if job.finished)
+        return BatchProgress(len(jobs), finished, fraction, elapsed, eta, running)
+
+
+def resolve_output_dir(settings, path):
+    if settings.output_mode == "custom":
+        return settings.out_dir.strip()
+    base_dir = os.path.dirname(path) or os.curdir
+    if settings.output_mode == "sync":
+        return base_dir
+    subdir = settings.subdir_name.strip()
+    if not subdir:
+        return base_dir
+    return os.path.join(base_dir, subdir)
+
+
+def output_roots(settings, paths):
+    # the folders a batch over these inputs writes its outputs to
+    return {resolve_output_dir(settings, path) for path in paths}
+
+
+def output_name(settings, path, index, ext, track=None):
+    # for the tracks of a split input {n} is the track number
+    number = str(index) if track is None else f"{track:02d}"
+    name = safe_stem(path)
+    suffix = settings.suffix.strip()
+    if suffix:
+        name = f"{name}{suffix}"
+
+    template = settings.name_template.strip()
+    if template:
+        now = datetime.now().strftime("%Y%m%d")
+        name = template.replace("{name}", safe_stem(path))
+        name = name.replace("{ext}", ext)
+        name = name.replace("{date}", now)
+        name = name.replace("{n}", number)
+    if track is not None and "{n}" not in template:
+        name = f"{name}_{number}"
+    return name
+
+
+def same_file(a, b):
+    if os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b)):
+        return True
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def resolve_overwrite(settings, out_path, claimed=(), source=None):
+    policy = settings.overwrite
+    taken = os.path.exists(out_path) or out_path in claimed
+    if source and same_file(out_path, source):
+        # the output is renamed over its target once written, which would
+        # replace the input itself (ffmpeg never sees the same path twice),
+        # so it gets a numbered name whatever the policy
+        policy = "number"
+    if policy is None or policy == "overwrite":
+        return out_path
+    if not taken:
+        return out_path
+    if policy == "skip":
+        return ""
+    if policy == "number":
+        base, ext = os.path.splitext(out_path)
+        idx = 1
+        while True:
+            candidate = f"{base}_{idx}{ext}"
+            if not os.path.exists(candidate) and candidate not in claimed:
+                return candidate
+            idx += 1
+    return out_path
+
+
+def format_bitrate(settings, key):
+    fmt = FORMATS[key]
+    if not fmt.get("bitrate"):
+        return ""
+    if key == settings.primary_format:
+        return settings.bitrate.strip()
+    return fmt.get("bitrate_default", "")
+
+
+# Settings that change the encoded audio; any of them rules out -c:a copy.
+REENCODE_SETTINGS = (
+    "sample_rate",
+    "bitrate_mode",
+    "quality",
+    "channels",
+    "flac_level",
+    "stereo_mode",
+    "opus_bandwidth",
+    "codec_quality",
+    "trim_start",
+    "trim_end",
+    "aac_profile",
+    "mp3_vbr",
+    "opus_frame",
+    "opus_app",
+    "vorbis_quality",
+)
+
+
+def target_codec(settings, key):
+    fmt = FORMATS[key]
+    if fmt["ext"] == "wav" and settings.bit_depth in ("24", "32"):
+        return f"pcm_s{settings.bit_depth}le"
+    return fmt["codec"]
+
+
+def extracts_regions(settings):
+    return bool(settings.regions.strip() or settings.regions_file)
+
+
+def splits_tracks(settings):
+    return settings.split_silence or settings.split_cue or extracts_regions(settings)
+
+
+def extract_regions(settings, path, duration=None):
+    # the clips of the region list that belong to this input
+    clips = tracks.parse_clip_list(settings.regions)
+    if settings.regions_file:
+        clips += tracks.parse_clip_file(settings.regions_file)
+    return tracks.clip_regions(clips, path, settings.trim_start or 0.0, duration, settings.fade_in, settings.fade_out)
+
+
+def stream_copy_formats(settings, info):
+    # Formats whose output can be a plain remux of the source audio stream.
+    if settings.force_reencode or info is None or info.audio is None:
+        return ()
+    if splits_tracks(settings):
+        # every track is cut at its exact boundaries
+        return ()
+    if build_filters(settings):
+        return ()
+    if any(getattr(settings, name) is not None for name in REENCODE_SETTINGS):
+        return ()
+    if len(info.audio_streams) != 1:
+        return ()
+    source = info.codec_name
+    copyable = []
+    for key in settings.formats:
+        fmt = FORMATS[key]
+        if key == settings.primary_format and fmt.get("bitrate"):
+            bitrate = settings.bitrate.strip()
+            if bitrate and bitrate != fmt.get("bitrate_default"):
+                continue
+        if fmt["ext"] == "wav":
+            if source == target_codec(settings, key):
+                copyable.append(key)
+        elif source in fmt["copy_codecs"]:
+            copyable.append(key)
+    return tuple(copyable)
+
+
+def codec_args(settings, key, copy=False):
+    if copy:
+        return ["-c:a", "copy"]
+    fmt = FORMATS[key]
+    ext = fmt["ext"]
+    codec = fmt["codec"]
+    args = []
+    if ext == "wav":
+        if settings.bit_depth == "24":
+            codec = "pcm_s24le"
+        elif settings.bit_depth == "32":
+            codec = "pcm_s32le"
+
+    args += ["-c:a", codec]
+
+    if ext == "flac" and settings.flac_level is not None:
+        args += ["-compression_level", settings.flac_level]
+
+    if ext in ("m4a", "aac") and settings.aac_profile is not None:
+        args += ["-profile:a", AAC_PROFILES[settings.aac_profile]]
+
+    if ext == "mp3" and settings.stereo_mode is not None:
+        joint = "1" if settings.stereo_mode == "joint" else "0"
+        args += ["-joint_stereo", joint]
+
+    q_value = None
+    bitrate_mode = settings.bitrate_mode
+    bitrate_value = settings.bitrate_value.strip()
+
+    if ext == "mp3" and settings.mp3_vbr is not None:
+        q_value = settings.mp3_vbr
+    elif ext == "ogg" and settings.vorbis_quality is not None:
+        q_value = settings.vorbis_quality
+    elif ext in ("ogg", "opus") and settings.codec_quality is not None:
+        q_value = settings.codec_quality
+    elif bitrate_mode == "vbr" and bitrate_value:
+        q_value = bitrate_value
+    elif settings.quality is not None:
+        q_value = settings.quality
+
+    bitrate = format_bitrate(settings, key)
+    if q_value:
+        args += ["-q:a", q_value]
+    elif bitrate_mode in ("cbr", "custom") and bitrate_value:
+        args += ["-b:a", bitrate_value]
+    elif bitrate and bitrate_mode is None:
+        args += ["-b:a", bitrate]
+
+    if ext == "opus":
+        if settings.opus_bandwidth is not None:
+            args += ["-bandwidth", settings.opus_bandwidth]
+        if settings.opus_frame is not None:
+            args += ["-frame_duration", settings.opus_frame]
+        if settings.opus_app is not None:
+            args += ["-application", settings.opus_app]
+
+    if settings.sample_rate:
+        args += ["-ar", settings.sample_rate]
+
+    if settings.channels is not None:
+        args += ["-ac", settings.channels]
+    return args
+
+
+def format_seconds(value):
+    return f"{value:.6f}".rstrip("0").rstrip(".") or "0"
+
+
+def _seek_point(settings):
+    # The input seek lands a little before the cut: decoders need some audio
+    # to settle (mp3 bit reservoir, aac/opus priming) and atrim then makes
+    # the sample-accurate cut from there.
+    if not settings.trim_start:
+        return 0.0
+    return max(settings.trim_start - SEEK_PREROLL, 0.0)
+
+
+def _input_trim_args(settings):
+    # Seeking on the input side means a short excerpt from a long file only
+    # decodes the excerpt, instead of everything before the start.
+    args = []
+    seek = _seek_point(settings)
+    if seek:
+        args += ["-ss", format_seconds(seek)]
+    if settings.trim_end is not None:
+        args += ["-t", format_seconds(max(settings.trim_end - seek, 0.0))]
+    return args
+
+
+def _trim_filters(settings):
+    # timestamps restart at the seek point, so the cut is relative to it
+    seek = _seek_point(settings)
+    params = []
+    if settings.trim_start:
+        params.append(f"start={format_seconds(settings.trim_start - seek)}")
+    if settings.trim_end is not None:
+        params.append(f"end={format_seconds(max(settings.trim_end - seek, 0.0))}")
+    if not params:
+        return []
+    return ["atrim=" + ":".join(params), "asetpts=PTS-STARTPTS"]
+
+
+def pre_loudnorm_filters(settings):
+    filters = _trim_filters(settings)
+
+    if settings.resample is not None or settings.dither is not None:
+        params = []
+        if settings.resample is not None:
+            params.append(f"resampler={settings.resample}")
+        if settings.sample_rate:
+            params.append(f"sample_rate={settings.sample_rate}")
+        if settings.dither is not None:
+            params.append(f"dither_method={settings.dither}")
+        filters.append("aresample=" + ":".join(params))
+
+    if settings.volume_db:
+        filters.append(f"volume={settings.volume_db}dB")
+    return filters
+
+
+def loudnorm_filter(settings, measured=None):
+    lufs = settings.loudnorm_target.strip() or "-16"
+    spec = f"loudnorm=I={lufs}:TP={LOUDNORM_TP}:LRA={LOUDNORM_LRA}"
+    if measured:
+        spec += (
+            f":measured_I={measured['input_i']}"
+            f":measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}"
+            f":measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}"
+            ":linear=true:print_format=none"
+        )
+    return spec
+
+
+def build_filters(settings, loudnorm_measured=None):
+    filters = pre_loudnorm_filters(settings)
+
+    if settings.loudnorm:
+        filters.append(loudnorm_filter(settings, loudnorm_measured))
+
+    if settings.replaygain is not None:
+        filters.append(f"replaygain={settings.replaygain}")
+
+    if settings.silence_trim:
+        filters.append("silenceremove=start_periods=1:start_threshold=-50dB:stop_periods=1:stop_threshold=-50dB")
+
+    fade_in = settings.fade_in
+    fade_out_start = settings.fade_out_start
+    fade_out = settings.fade_out
+    if fade_in is not None and fade_in > 0:
+        filters.append(f"afade=t=in:st=0:d={fade_in}")
+    if fade_out is not None and fade_out_start is not None:
+        # the fade-out start is a time in the source; the trimmed audio starts at 0
+        start = max(fade_out_start - (settings.trim_start or 0.0), 0.0)
+        filters.append(f"afade=t=out:st={format_seconds(start)}:d={fade_out}")
+
+    return filters
+
+
+def _stream_args(settings, key, mapped):
+    args = []
+    if mapped:
+        # explicit -map disables default stream selection, so carry cover
+        # art over by hand where the container can hold it
+        args += ["-map", mapped]
+        if not settings.audio_only and settings.album_art != "strip" and FORMATS[key].get("cover_art"):
+            args += ["-map", "0:v?", "-c:v", "copy"]
+    if settings.audio_only:
+        args.append("-vn")
+    if not mapped and settings.album_art == "strip":
+        args += ["-map", "0:a"]
+    if settings.metadata == "strip":
+        args += ["-map_metadata", "-1"]
+    return args
+
+
+def build_command(settings, path, outputs, loudnorm_measured=None, copy=()):
+    if isinstance(outputs, str):
+        outputs = (Output(settings.primary_format, outputs),)
+    cmd = ["ffmpeg"]
+    if settings.overwrite == "skip":
+        cmd.append("-n")
+    else:
+        cmd.append("-y")
+
+    cmd += _input_trim_args(settings)
+    cmd += ["-i", path]
+
+    filters = build_filters(settings, loudnorm_measured)
+
+    if len(outputs) == 1:
+        output = outputs[0]
+        cmd += _stream_args(settings, output.format, None)
+        cmd += codec_args(settings, output.format, output.format in copy)
+        if filters:
+            cmd += ["-af", ",".join(filters)]
+        cmd.append(output.path)
+        return cmd
+
+    # Several targets: decode once and, when there are filters, run the
+    # chain once and asplit it to every encoder.
+    labels = [None] * len(outputs)
+    if filters:
+        labels = [f"[out{i}]" for i in range(len(outputs))]
+        graph = "[0:a:0]" + ",".join(filters) + f",asplit={len(outputs)}" + "".join(labels)
+        cmd += ["-filter_complex", graph]
+    for output, label in zip(outputs, labels):
+        cmd += _stream_args(settings, output.format, label)
+        cmd += codec_args(settings, output.format, output.format in copy)
+        cmd.append(output.path)
+    return cmd
+
+
+def track_outputs(settings, job, count):
+    # the outputs of each track, next to where the whole file would have gone
+    out_dir = os.path.dirname(job.output_path)
+    claimed = set()
+    groups = []
+    for number in range(1, count + 1):
+        group = []
+        for key in settings.formats:
+            ext = FORMATS[key]["ext"]
+            name = output_name(settings, job.input_path, job.index, ext, track=number)
+            out_path = resolve_overwrite(
+                settings, os.path.join(out_dir, f"{name}.{ext}"), claimed, source=job.input_path
+            )
+            if out_path:
+                claimed.add(out_path)
+                group.append(Output(key, out_path))
+        groups.append(tuple(group))
+    return tuple(groups)
+
+
+def whole_outputs(settings, job):
+    # the overwrite policy for a split job that ends up converted whole
+    claimed = set()
+    outputs = []
+    for output in job.outputs:
+        out_path = resolve_overwrite(settings, output.path, claimed, source=job.input_path)
+        if out_path:
+            claimed.add(out_path)
+            outputs.append(replace(output, path=out_path))
+    return tuple(outputs)
+
+
+def _track_window(settings, regions):
+    # Only the stretch the wanted tracks cover has to be decoded: the input
+    # seek moves up to the first and -t stops after the last. Not when a
+    # filter's output depends on everything before it (loudnorm, silence
+    # removal, a fade over the whole input).
+    fades = settings.fade_in or (settings.fade_out is not None and settings.fade_out_start is not None)
+    if settings.loudnorm or settings.silence_trim or fades:
+        return settings, 0.0
+    first = min(region.start for region in regions)
+    origin = settings.trim_start or 0.0
+    trim_end = settings.trim_end
+    if all(region.end is not None for region in regions):
+        last = origin + max(region.end for region in regions)
+        trim_end = last if trim_end is None else min(trim_end, last)
+    return replace(settings, trim_start=origin + first or None, trim_end=trim_end), first
+
+
+def track_command(settings, path, regions, groups, loudnorm_measured=None):
+    # One decode for the whole input: the filter chain runs once, asplit
+    # hands it to one atrim per track and each track goes to its own
+    # outputs (groups[i] are the outputs of regions[i]; empty = skipped).
+    wanted = [(number, region, group) for number, (region, group) in enumerate(zip(regions, groups), 1) if group]
+    chain_settings = settings
+    if extracts_regions(settings):
+        # the fades belong to each clip, not to the whole input
+        chain_settings = replace(settings, fade_in=None, fade_out_start=None, fade_out=None)
+    chain_settings, shift = _track_window(chain_settings, [region for _, region, _ in wanted])
+    cmd = ["ffmpeg", "-n" if settings.overwrite == "skip" else "-y"]
+    cmd += _input_trim_args(chain_settings)
+    cmd += ["-i", path]
+    filters = build_filters(chain_settings, loudnorm_measured)
+    graph = ["[0:a:0]" + ",".join(filters + [f"asplit={len(wanted)}"]) + "".join(f"[s{n}]" for n, _, _ in wanted)]
+    for number, region, group in wanted:
+        params = [f"start={format_seconds(region.start - shift)}"]
+        if region.end is not None:
+            params.append(f"end={format_seconds(region.end - shift)}")
+        chain = ["atrim=" + ":".join(params), "asetpts=PTS-STARTPTS"]
+        if region.fade_in:
+            chain.append(f"afade=t=in:st=0:d={format_seconds(region.fade_in)}")
+        if region.fade_out and region.end is not None:
+            start = max(region.end - region.start - region.fade_out, 0.0)
+            chain.append(f"afade=t=out:st={format_seconds(start)}:d={format_seconds(region.fade_out)}")
+        if len(group) > 1:
+            chain.append(f"asplit={len(group)}")
+        graph.append(f"[s{number}]" + ",".join(chain) + "".join(f"[t{number}_{i}]" for i in range(len(group))))
+    cmd += ["-filter_complex", ";".join(graph)]
+    for number, region, group in wanted:
+        for i, output in enumerate(group):
+            cmd += _stream_args(settings, output.format, f"[t{number}_{i}]")
+            if settings.metadata != "strip":
+                cmd += ["-metadata", f"track={number}/{len(regions)}"]
+                for key, value in region.tags:
+                    cmd += ["-metadata", f"{key}={value}"]
+            cmd += codec_args(settings, output.format)
+            cmd.append(output.path)
+    return cmd
+
+
+def plan_batch(settings, files, start=1):
+    claimed = set()
+    jobs = []
+    for index, path in enumerate(files, start=start):
+        out_dir = resolve_output_dir(settings, path)
+        if not out_dir:
+            jobs.append(Job(index, path, (), ()))
+            continue
+        outputs = []
+        for key in settings.formats:
+            ext = FORMATS[key]["ext"]
+            name = output_name(settings, path, index, ext)
+            out_path = os.path.join(out_dir, f"{name}.{ext}")
+            # a split input never writes the whole-file name; its tracks are
+            # resolved in track_outputs (or whole_outputs if it isn't split)
+            if not splits_tracks(settings):
+                out_path = resolve_overwrite(settings, out_path, claimed, source=path)
+            if out_path:
+                claimed.add(out_path)
+                outputs.append(Output(key, out_path))
+        if not outputs:
+            jobs.append(Job(index, path, (), (), skip=True))
+            continue
+        outputs = tuple(outputs)
+        key = job_cache_key(settings, path, out_dir, index) if settings.cache else ""
+        jobs.append(Job(index, path, outputs, tuple(build_command(settings, path, outputs)), cache_key=key))
+    return tuple(jobs)
+
+
+def job_cache_key(settings, path, out_dir, index):
+    # Keyed on the argv for the un-numbered output names, so the "連番"
+    # policy (which renames around existing outputs) still finds its entry.
+    outputs = tuple(
+        Output(key, os.path.join(out_dir, f"{output_name(settings, path, index, FORMATS[key]['ext'])}.{FORMATS[key]['ext']}"))
+        for key in settings.formats
+    )
+    argv = build_command(settings, path, outputs)
+    parts = ["convert", argv, settings.loudnorm_two_pass]
+    if settings.split_silence:
+        parts.append(["split", settings.split_gap, settings.split_min_length])
+    if settings.split_cue:
+        # an edited sheet means different tracks
+        sheet = tracks.find_cue(path)
+        parts.append(["cue", cache.content_key(sheet.path) if sheet else None])
+    if extracts_regions(settings):
+        # an edited list means different clips; a missing one fails at run time
+        listed = None
+        if settings.regions_file:
+            try:
+                listed = cache.content_key(settings.regions_file)
+            except OSError:
+                pass
+        parts.append(["regions", settings.regions, listed])
+    return cache.make_key(*parts)
+
+
+def loudnorm_analysis_command(settings, path):
+    filters = pre_loudnorm_filters(settings) + [loudnorm_filter(settings) + ":print_format=json"]
+    cmd = ["ffmpeg", "-hide_banner", *_input_trim_args(settings), "-i", path, "-map", "0:a:0", "-vn"]
+    cmd += ["-af", ",".join(filters), "-f", "null", "-"]
+    return cmd
+
+
+def silence_analysis_command(settings, path, loudnorm_measured=None):
+    # runs on the same chain the tracks are cut from, so the times line up
+    filters = build_filters(settings, loudnorm_measured)
+    filters.append(f"silencedetect=n={tracks.SILENCE_NOISE}:d={format_seconds(settings.split_gap)}")
+    cmd = ["ffmpeg", "-hide_banner", *_input_trim_args(settings), "-i", path, "-map", "0:a:0", "-vn"]
+    cmd += ["-af", ",".join(filters), "-f", "null", "-"]
+    return cmd
+
+
+def silence_cache_key(settings, path, loudnorm_measured=None):
+    return cache.make_key(
+        cache.content_key(path),
+        settings.trim_start,
+        settings.trim_end,
+        build_filters(settings, loudnorm_measured),
+        settings.split_gap,
+    )
+
+
+def loudnorm_cache_key(settings, path):
+    # Only what influences the measurement: the input content, the trim
+    # window, the filters that run before loudnorm and the target itself.
+    return cache.make_key(
+        cache.content_key(path),
+        settings.trim_start,
+        settings.trim_end,
+        pre_loudnorm_filters(settings),
+        loudnorm_filter(settings),
+    )
+
+
+def parse_loudnorm_json(lines):
+    text = "\n".join(lines)
+    start = text.rfind("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start : end + 1])
+    except ValueError:
+        return None
+    keys = ("input_i", "input_tp", "input_lra", "input_thresh", "target_offset")
+    measured = {}
+    for key in keys:
+        value = parse_float(data.get(key))
+        if value is None or value in (float("inf"), float("-inf")):
+            return None
+        measured[key] = f"{value:.2f}"
+    return measured
+
+
+def probe_duration(path):
+    info = PROBE.get(path)
+    return info.duration if info else None
+
+
+def effective_duration(settings, duration):
+    if duration is None:
+        return None
+    end = duration
+    if settings.trim_end is not None:
+        end = min(end, settings.trim_end)
+    start = settings.trim_start or 0.0
+    return max(end - start, 0.0)
+
+
+def runtime_argv(argv, threads=None):
+    extra = ["-progress", "pipe:1", "-nostats"]
+    if threads:
+        extra += ["-threads", str(threads), "-filter_threads", str(threads)]
+    return [argv[0], *extra, *argv[1:]]
+
+
+def batch_layout(settings, job_count):
+    codecs = [FORMATS[key]["codec"] for key in settings.formats]
+    cost = scheduler.estimate_cost(codecs, build_filters(settings), settings.resample)
+    return scheduler.plan_layout(job_count, cost, settings.parallel, scheduler.share_cores(settings.cpu_share))
+
+
+def iter_progress(stream):
+    block = {}
+    for line in stream:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value.strip()
+        if key != "progress":
+            continue
+        update = {}
+        out_time = block.get("out_time_us") or block.get("out_time_ms")
+        if out_time and out_time != "N/A":
+            seconds = parse_float(out_time)
+            if seconds is not None:
+                update["out_time"] = max(seconds / 1_000_000, 0.0)
+        speed = block.get("speed", "").rstrip("x")
+        if speed and speed != "N/A":
+            update["speed"] = parse_float(speed)
+        size = block.get("total_size")
+        if size and size.isdigit():
+            update["total_size"] = int(size)
+        block = {}
+        yield update
+
+
+def log_media_info(path, log):
+    info = PROBE.get(path)
+    if info is None:
+        return
+    for line in info.summary_lines():
+        log(f"info: {line}")
+
+
+def popen_group_kwargs(settings=None):
+    # ffmpeg gets its own process group so pause/cancel reach any helpers it
+    # spawns, and a terminal Ctrl+C is handled by us rather than by ffmpeg
+    kwargs = {}
+    if settings is not None:
+        kwargs = scheduler.priority_kwargs(settings.priority, settings.cpu_share)
+    if os.name == "nt":
+        kwargs["creationflags"] = kwargs.get("creationflags", 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    return kwargs
+
+
+def lower_priority(proc, settings):
+    # the background priority / CPU cap of popen_group_kwargs' settings
+    scheduler.apply_priority(proc.pid, settings.priority, settings.cpu_share)
+
+
+def _signal_group(proc, sig):
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _nt_suspend(proc, resume=False):
+    import ctypes
+
+    try:
+        ntdll = ctypes.windll.ntdll
+        func = ntdll.NtResumeProcess if resume else ntdll.NtSuspendProcess
+        func(int(proc._handle))
+    except (AttributeError, OSError):
+        pass
+
+
+def suspend_process(proc):
+    if os.name == "nt":
+        _nt_suspend(proc)
+    else:
+        _signal_group(proc, signal.SIGSTOP)
+
+
+def continue_process(proc):
+    if os.name == "nt":
+        _nt_suspend(proc, resume=True)
+    else:
+        _signal_group(proc, signal.SIGCONT)
+
+
+def terminate_process(proc, grace=5.0):
+    # SIGTERM lets ffmpeg close its outputs; SIGKILL follows if it hangs
+    if proc.returncode is not None:
+        return
+    continue_process(proc)
+    if os.name == "nt":
+        proc.terminate()
+    else:
+        _signal_group(proc, signal.SIGTERM)
+
+    def kill():
+        if proc.returncode is None:
+            if os.name == "nt":
+                proc.kill()
+            else:
+                _signal_group(proc, signal.SIGKILL)
+
+    timer = threading.Timer(grace, kill)
+    timer.daemon = True
+    timer.start()
+
+
+class BatchControl:
+    # Shared between the UI thread and the workers of a batch (or a watch
+    # service): cancel everything or single inputs, pause/resume. Paused
+    # ffmpeg process groups are stopped outright, so they use no CPU.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = {}
+        self._cancelled = set()
+        self._running = threading.Event()
+        self._running.set()
+        self.cancel_requested = threading.Event()
+        self.keep_journal = False
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def is_cancelled(self, path):
+        return self.cancel_requested.is_set() or path in self._cancelled
+
+    def wait_if_paused(self):
+        self._running.wait()
+
+    def register(self, path, proc):
+        with self._lock:
+            self._procs[proc.pid] = (path, proc)
+            paused = self.paused
+        if self.is_cancelled(path):
+            terminate_process(proc)
+        elif paused:
+            suspend_process(proc)
+
+    def unregister(self, proc):
+        with self._lock:
+            self._procs.pop(proc.pid, None)
+
+    def _targets(self, paths=None):
+        with self._lock:
+            return [proc for path, proc in self._procs.values() if paths is None or path in paths]
+
+    def cancel(self, paths=None, keep_journal=False):
+        if paths is None:
+            self.keep_journal = keep_journal
+            self.cancel_requested.set()
+            self._running.set()
+        else:
+            paths = set(paths)
+            with self._lock:
+                self._cancelled |= paths
+        for proc in self._targets(paths):
+            terminate_process(proc)
+
+    def restore(self, paths):
+        # a cancelled input may be queued again (distributed lease handed back)
+        with self._lock:
+            self._cancelled -= set(paths)
+
+    def pause(self):
+        self._running.clear()
+        for proc in self._targets():
+            suspend_process(proc)
+
+    def resume(self):
+        self._running.set()
+        for proc in self._targets():
+            continue_process(proc)
+
+    def shutdown(self):
+        # app exit: stop everything but keep the journal so the batch can be
+        # resumed next time
+        self.cancel(keep_journal=True)
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        settings,
+        log=print,
+        progress=None,
+        progress_interval=0.25,
+        job_progress=None,
+        metrics_log=None,
+        batch_journal=None,
+        control=None,
+    ):
+        self.settings = settings
+        self.journal = batch_journal
+        self.control = control or BatchControl()
+        self.log = log
+        self.progress_callback = progress
+        self.job_progress_callback = job_progress
+        # False disables the per-job metrics trace
+        self.metrics = metrics.MetricsLog() if metrics_log is None else metrics_log
+        self._swept = set()
+        self._sweep_lock = threading.Lock()
+        self.progress_interval = progress_interval
+        self.progress = None
+        self.layout = None
+        # jobs that wrote other files than planned (split into tracks), by index
+        self.written = {}
+
+    def begin(self, jobs=(), job_count=None):
+        if job_count is None:
+            job_count = sum(1 for job in jobs if not job.skip)
+        self.progress = ProgressTracker(
+            jobs, self.progress_callback, self.progress_interval, self.job_progress_callback
+        )
+        self.layout = batch_layout(self.settings, job_count)
+        self.batch_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        self._metrics_base = {
+            "batch": self.batch_id,
+            "options": metrics.options_key(self.settings),
+            "workers": self.layout.workers,
+            "threads": self.layout.threads,
+            "priority": self.settings.priority or "normal",
+            "cpu_share": self.settings.cpu_share or None,
+            **metrics.host_info(),
+        }
+        now = time.monotonic()
+        self._queued = {job.index: now for job in jobs}
+
+    def add(self, job):
+        # a watch service keeps one control for all its batches: cancelling
+        # an earlier copy of this input must not cancel the new one
+        self.control.restore([job.input_path])
+        self.progress.add(job)
+        self._queued[job.index] = time.monotonic()
+        PROBE.prefetch([job.input_path])
+
+    def run(self, jobs):
+        self.begin(jobs)
+        self.control.restore(job.input_path for job in jobs)
+        self.sweep(output_roots(self.settings, [job.input_path for job in jobs]))
+        if self.journal:
+            self.journal.begin(self.settings, jobs)
+        self.log("変換を開始します...")
+        self.log(self.layout.describe())
+        if self.settings.priority or self.settings.cpu_share:
+            self.log(scheduler.describe_priority(self.settings.priority, self.settings.cpu_share))
+        probes = PROBE.prefetch(job.input_path for job in jobs if not job.skip)
+        ordered = self._schedule(jobs, probes)
+        try:
+            if self.layout.workers <= 1:
+                statuses = {job.index: self.run_job(job) for job in ordered}
+            else:
+                with ThreadPoolExecutor(max_workers=self.layout.workers) as exe:
+                    try:
+                        statuses = dict(zip((job.index for job in ordered), exe.map(self.run_job, ordered)))
+                    except BaseException:
+                        self.control.cancel(keep_journal=True)
+                        raise
+        except BaseException:
+            if self.journal:
+                self.journal.close()
+            raise
+        results = [statuses[job.index] for job in jobs]
+
+        failures = results.count("failed")
+        hits = results.count("cached")
+        cancelled = results.count("cancelled")
+        skipped = results.count("skipped") + hits
+        misses = 0
+        if self.settings.cache:
+            misses = sum(1 for job, status in zip(jobs, results) if job.cache_key and status != "cached")
+            self.log(f"キャッシュ: ヒット {hits} / ミス {misses}")
+        if cancelled:
+            self.log(log_line(f"中止しました。キャンセル: {cancelled} / 失敗: {failures}", "warning"))
+        elif failures:
+            self.log(log_line(f"完了 (エラーあり)。失敗: {failures}", "error"))
+        else:
+            self.log("完了。")
+        if self.journal:
+            if self.control.keep_journal:
+                self.journal.close()
+            else:
+                self.journal.finish()
+        return BatchResult(len(jobs), failures, skipped, hits, misses, cancelled)
+
+    def _schedule(self, jobs, probes=()):
+        # Longest inputs first so one long file doesn't start last and leave
+        # the other workers idle. The durations come from the prefetch just
+        # started (persisted probes return at once, a cold run runs ffprobe);
+        # whatever isn't known after SCHEDULE_PROBE_WAIT keeps its order.
+        if self.layout.workers <= 1:
+            return list(jobs)
+        if probes:
+            wait(probes, timeout=SCHEDULE_PROBE_WAIT)
+        durations = {}
+        for job in jobs:
+            info = PROBE.peek(job.input_path)
+            durations[job.index] = (info.duration if info else None) or 0.0
+        return sorted(jobs, key=lambda job: -durations[job.index])
+
+    def run_job(self, job):
+        self.control.wait_if_paused()
+        started = time.monotonic()
+        stats = metrics.JobStats()
+        if self.control.is_cancelled(job.input_path):
+            status = "cancelled"
+        else:
+            if self.journal:
+                self.journal.job_state(job.index, "running")
+            status = self._run_job(job, stats)
+        wall = time.monotonic() - started
+        state = "skipped" if status == "cached" else status
+        paths = stats.outputs or job.output_paths
+        if stats.outputs:
+            self.written[job.index] = paths
+        values = {}
+        if status in ("done", "cached"):
+            values["total_size"] = sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+        self.progress.update(job.index, force=True, state=state, **values)
+        if self.journal:
+            outputs = None
+            if status in ("done", "cached"):
+                try:
+                    outputs = [cache.output_record(path) for path in paths]
+                except OSError:
+                    status = "failed"
+            self.journal.job_state(job.index, status, outputs)
+        if self.metrics:
+            self._record_metrics(job, status, stats, started, wall, values.get("total_size"))
+        return status
+
+    def _record_metrics(self, job, status, stats, started, wall, output_bytes):
+        try:
+            input_bytes = os.path.getsize(job.input_path)
+        except OSError:
+            input_bytes = None
+        realtime = None
+        if status == "done" and stats.duration and wall > 0:
+            realtime = stats.duration / wall
+        cache_decision = None
+        if status == "cached":
+            cache_decision = "hit"
+        elif job.cache_key:
+            cache_decision = "miss"
+        record = {
+            "v": metrics.METRICS_VERSION,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            **self._metrics_base,
+            "index": job.index,
+            "input": job.input_path,
+            "formats": [output.format for output in job.outputs],
+            "status": status,
+            "exit_code": stats.exit_code,
+            "input_bytes": input_bytes,
+            "output_bytes": output_bytes,
+            "duration": stats.duration,
+            "wall": wall,
+            "exec_time": stats.exec_time,
+            "cpu_user": stats.cpu_user,
+            "cpu_system": stats.cpu_system,
+            "max_rss": stats.max_rss,
+            "realtime": realtime,
+            "queue_wait": max(started - self._queued.get(job.index, started), 0.0),
+            "argv": list(stats.argv or job.argv),
+            "cache": cache_decision,
+            "copy": list(stats.copy),
+            "loudnorm_pass": stats.loudnorm_pass,
+        }
+        self.metrics.write(record)
+
+    def _cache_lookup(self, job):
+        # the matching entry, whose outputs are all still as written
+        entry = cache.store(MANIFEST_CACHE).get(job.cache_key)
+        if not entry:
+            return None
+        if not cache.fingerprint_matches(entry.get("input"), job.input_path, self.settings.cache_hash):
+            return None
+        if not entry.get("outputs") or not all(cache.output_intact(out) for out in entry["outputs"]):
+            return None
+        return entry
+
+    def _cache_record(self, job):
+        try:
+            entry = {
+                "input": cache.file_fingerprint(job.input_path, self.settings.cache_hash),
+                "outputs": [cache.output_record(path) for path in job.output_paths],
+                "time": datetime.now().isoformat(timespec="seconds"),
+            }
+        except OSError:
+            return
+        cache.store(MANIFEST_CACHE).set(job.cache_key, entry)
+
+    def _log(self, job, message, level="info"):
+        self.log(log_line(message, level, job.index))
+
+    def _run_job(self, job, stats):
+        if job.skip:
+            self._log(job, f"スキップ: {job.input_path}")
+            return "skipped"
+        if not job.output_path:
+            self._log(job, f"出力先を決定できません: {job.input_path}", "error")
+            return "failed"
+        if job.cache_key:
+            entry = self._cache_lookup(job)
+            if entry:
+                self._log(job, f"スキップ (キャッシュ一致): {job.input_path}")
+                stats.outputs = tuple(out["path"] for out in entry["outputs"])
+                return "cached"
+        out_dir = os.path.dirname(job.output_path)
+        ensure_dir(out_dir)
+        self._sweep_outputs(job.outputs)
+
+        if not splits_tracks(self.settings):
+            self._log(job, f"{job.input_path} -> {', '.join(job.output_paths)}")
+
+        info = self.settings.info and PROBE.available()
+
+        def info_log(message):
+            self._log(job, message, "debug")
+
+        if info:
+            log_media_info(job.input_path, info_log)
+
+        media = PROBE.get(job.input_path)
+        duration = effective_duration(self.settings, media.duration if media else None)
+        copy = stream_copy_formats(self.settings, media)
+        measured = None
+        stats.duration = duration
+        stats.copy = copy
+        if copy:
+            self._log(job, f"ストリームコピー ({media.codec_name}): {', '.join(copy)}")
+            argv = build_command(self.settings, job.input_path, job.outputs, copy=copy)
+            job = replace(job, argv=tuple(argv), copy_formats=copy)
+        if self.settings.loudnorm and self.settings.loudnorm_two_pass:
+            self.progress.update(job.index, force=True, state="analyzing", duration=duration)
+            measured = self._measure_loudness(job, stats)
+            if self.control.is_cancelled(job.input_path):
+                self._log(job, f"キャンセルしました: {job.input_path}", "warning")
+                return "cancelled"
+            if measured:
+                argv = build_command(self.settings, job.input_path, job.outputs, measured)
+                job = replace(job, argv=tuple(argv))
+            else:
+                self._log(job, f"ラウドネス解析に失敗したため 1 パスで処理します: {job.input_path}", "warning")
+        regions = None
+        if splits_tracks(self.settings):
+            regions = self._track_regions(job, stats, duration, measured)
+            if self.control.is_cancelled(job.input_path):
+                self._log(job, f"キャンセルしました: {job.input_path}", "warning")
+                return "cancelled"
+            if regions is None:
+                return "failed"
+        if regions:
+            groups = track_outputs(self.settings, job, len(regions))
+            if not any(groups):
+                self._log(job, f"スキップ (既存): {job.input_path}")
+                return "skipped"
+            argv = track_command(self.settings, job.input_path, regions, groups, measured)
+            job = replace(job, outputs=tuple(output for group in groups for output in group), argv=tuple(argv))
+            stats.outputs = job.output_paths
+        elif splits_tracks(self.settings):
+            outputs = whole_outputs(self.settings, job)
+            if not outputs:
+                self._log(job, f"スキップ (既存): {job.input_path}")
+                return "skipped"
+            argv = build_command(self.settings, job.input_path, outputs, measured)
+            job = replace(job, outputs=outputs, argv=tuple(argv))
+            stats.outputs = job.output_paths
+        if splits_tracks(self.settings):
+            paths = job.output_paths
+            shown = paths if len(paths) <= 3 else [paths[0], "...", paths[-1]]
+            self._log(job, f"{job.input_path} -> {', '.join(shown)} ({len(paths)} ファイル)")
+        self.progress.update(
+            job.index, force=True, state="running", duration=duration, out_time=0.0
+        )
+
+        # ffmpeg writes next to the final name and the result is renamed into
+        # place only once complete, so a killed job never leaves a truncated
+        # file under the real name
+        staged = tuple(replace(output, path=temp_output_path(output.path)) for output in job.outputs)
+        temps = [output.path for output in staged]
+        if regions:
+            staged_groups = tuple(
+                tuple(replace(output, path=temp_output_path(output.path)) for output in group) for group in groups
+            )
+            argv = track_command(self.settings, job.input_path, regions, staged_groups, measured)
+        else:
+            argv = build_command(self.settings, job.input_path, staged, measured, copy=job.copy_formats)
+        stats.argv = job.argv
+        plan = None
+        if self.settings.segment_parallel and not job.copy_formats and not regions:
+            plan = self._segment_plan(job, media)
+        try:
+            if plan:
+                returncode, tail = self._run_segments(job, plan, staged, stats)
+            else:
+                returncode, tail = self._execute(job.index, argv, stats=stats, path=job.input_path)
+            stats.exit_code = returncode
+            if self.control.is_cancelled(job.input_path):
+                self._log(job, f"キャンセルしました: {job.input_path}", "warning")
+                return "cancelled"
+            if returncode != 0:
+                for line in tail:
+                    self._log(job, line, "error")
+                return "failed"
+            problem = self._verify_outputs(temps)
+            if problem:
+                self._log(job, f"出力の検証に失敗しました: {problem}", "error")
+                return "failed"
+            committed = 0
+            for temp, final in zip(temps, job.output_paths):
+                if commit_output(temp, final, no_clobber=self.settings.overwrite == "skip"):
+                    committed += 1
+                else:
+                    self._log(job, f"スキップ (既存): {final}")
+        except OSError as exc:
+            self._log(job, f"出力を確定できません: {exc}", "error")
+            return "failed"
+        finally:
+            remove_quietly(path for path in temps if os.path.exists(path))
+        if not committed:
+            return "skipped"
+
+        if job.cache_key:
+            self._cache_record(job)
+
+        post = self.settings.post_action
+        if post == "copy":
+            try:
+                shutil.copy2(job.input_path, out_dir)
+            except Exception as exc:
+                self._log(job, f"コピー失敗: {exc}", "error")
+        elif post == "move":
+            try:
+                shutil.move(job.input_path, out_dir)
+            except Exception as exc:
+                self._log(job, f"移動失敗: {exc}", "error")
+
+        if info:
+            for out_path in job.output_paths:
+                log_media_info(out_path, info_log)
+
+        return "done"
+
+    def _track_regions(self, job, stats, duration, measured):
+        # None = failed, () = nothing to split on (the input is converted whole)
+        if extracts_regions(self.settings):
+            try:
+                regions = extract_regions(self.settings, job.input_path, duration)
+            except (OSError, ValueError) as exc:
+                self._log(job, f"区間リストを読めません: {exc}", "error")
+                return None
+            if not regions:
+                self._log(job, f"切り出す区間がないため分割せずに変換します: {job.input_path}")
+            else:
+                self._log(job, f"区間 {len(regions)} 個を切り出します")
+            return regions
+        if self.settings.split_cue:
+            sheet = tracks.find_cue(job.input_path)
+            if sheet:
+                regions = tracks.cue_regions(sheet, job.input_path, self.settings.trim_start or 0.0, duration)
+                self._log(job, f"CUE シート: {sheet.path} ({len(regions)} トラック)")
+                return regions
+            if not self.settings.split_silence:
+                self._log(job, f"CUE シートがないため分割せずに変換します: {job.input_path}")
+                return ()
+        self.progress.update(job.index, force=True, state="analyzing", duration=duration)
+        store = cache.store(SILENCE_CACHE)
+        try:
+            key = silence_cache_key(self.settings, job.input_path, measured)
+        except OSError:
+            key = None
+        silences = store.get(key) if key else None
+        if silences is not None:
+            self._log(job, f"無音検出 (キャッシュ): {job.input_path}")
+        else:
+            self._log(job, f"無音検出: {job.input_path}")
+            found = tracks.SilenceLog()
+            argv = silence_analysis_command(self.settings, job.input_path, measured)
+            returncode, tail = self._execute(job.index, argv, stats=stats, path=job.input_path, on_line=found.feed)
+            if returncode != 0:
+                if not self.control.is_cancelled(job.input_path):
+                    for line in tail:
+                        self._log(job, line, "error")
+                return None
+            silences = found.silences
+            if key:
+                store.set(key, silences)
+        cuts = tracks.silence_cuts(silences, duration, self.settings.split_min_length)
+        self._log(job, f"無音 {len(silences)} 箇所 -> {len(cuts) + 1} トラックに分割します")
+        return tracks.regions_from_cuts(cuts)
+
+    def _segment_plan(self, job, media):
+        import segments
+
+        reason = segments.refusal(self.settings, media)
+        if reason:
+            self._log(job, f"分割エンコードせずに処理します: {reason}", "warning")
+            return None
+        # the cores this job's worker slot would get
+        count = self.layout.cores // self.layout.workers
+        if count < 2:
+            self._log(job, "分割エンコード: 空いているコアがないため 1 プロセスで処理します", "debug")
+            return None
+        plan = segments.plan_segments(self.settings, media, count)
+        if plan is None:
+            self._log(job, "分割エンコード: 短いため 1 プロセスで処理します", "debug")
+            return None
+        if not segments.fades_fit(self.settings, plan):
+            self._log(job, "分割エンコードせずに処理します: フェードが区間をまたぎます", "warning")
+            return None
+        self._log(job, f"分割エンコード: {len(plan.segments)} 区間を並列に処理します ({plan.mode})")
+        return plan
+
+    def _run_segments(self, job, plan, staged, stats):
+        import segments
+
+        folder = os.path.dirname(staged[0].path)
+        stem = safe_stem(job.input_path)
+        ext = segments.part_extension(plan, self.settings)
+        parts = [
+            temp_output_path(os.path.join(folder, f"{stem}.part{segment.index:03d}{ext}"))
+            for segment in plan.segments
+        ]
+        listing = temp_output_path(os.path.join(folder, f"{stem}.parts.txt"))
+        progress = segments.SegmentProgress(self.progress, job.index, plan)
+        part_stats = [metrics.JobStats() for _ in parts]
+
+        def encode(segment, part, part_stat):
+            argv = segments.segment_command(self.settings, job.input_path, plan, segment, part)
+            return self._execute(
+                job.index,
+                argv,
+                stats=part_stat,
+                path=job.input_path,
+                threads=1,
+                on_progress=lambda update: progress.update(segment, update),
+            )
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts)) as exe:
+                try:
+                    results = list(exe.map(encode, plan.segments, parts, part_stats))
+                except BaseException:
+                    # stop the other pieces before the pool waits for them
+                    self.control.cancel([job.input_path])
+                    raise
+            stats.add_parallel(part_stats)
+            for returncode, tail in results:
+                if returncode != 0:
+                    return returncode, tail
+            if self.control.is_cancelled(job.input_path):
+                return 0, []
+            self.progress.update(job.index, force=True, state="joining", out_time=0.0)
+            if plan.mode == "adts":
+                try:
+                    segments.splice_adts(plan, parts, staged[0].path)
+                except ValueError as exc:
+                    return 1, [str(exc)]
+                return 0, []
+            segments.write_concat_list(listing, parts)
+            argv = segments.join_command(self.settings, job.input_path, plan, listing, staged)
+            return self._execute(job.index, argv, stats=stats, path=job.input_path)
+        finally:
+            remove_quietly(path for path in [*parts, listing] if os.path.exists(path))
+
+    def sweep(self, folders):
+        folders = set(folders)
+        with self._sweep_lock:
+            folders -= self._swept
+            self._swept |= folders
+        for folder in folders:
+            for path in sweep_temp_outputs(folder):
+                self.log(log_line(f"前回の一時ファイルを削除しました: {path}", "warning"))
+
+    def _sweep_outputs(self, outputs):
+        # folders below the output roots (sync mode, tracks) are only known
+        # once a job writes there
+        self.sweep(os.path.dirname(output.path) for output in outputs)
+
+    def _verify_outputs(self, paths):
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return f"{os.path.basename(path)} がありません"
+            if not size:
+                return f"{os.path.basename(path)} が空です"
+            if self.settings.verify_output and PROBE.available():
+                info = PROBE.inspect(path)
+                if info is None or info.audio is None:
+                    return f"{os.path.basename(path)} を読み取れません"
+                if info.duration is not None and info.duration <= 0:
+                    return f"{os.path.basename(path)} の長さが 0 です"
+        return None
+
+    def _measure_loudness(self, job, stats):
+        store = cache.store(LOUDNORM_CACHE)
+        try:
+            key = loudnorm_cache_key(self.settings, job.input_path)
+        except OSError as exc:
+            self._log(job, f"ラウドネス解析: {exc}", "warning")
+            return None
+        measured = store.get(key)
+        if measured:
+            self._log(job, f"ラウドネス解析 (キャッシュ): {job.input_path}")
+            stats.loudnorm_pass = "cached"
+            return measured
+        self._log(job, f"ラウドネス解析: {job.input_path}")
+        argv = loudnorm_analysis_command(self.settings, job.input_path)
+        returncode, lines = self._execute(job.index, argv, keep=None, stats=stats, path=job.input_path)
+        stats.loudnorm_pass = "measured" if returncode == 0 else "failed"
+        if returncode != 0:
+            for line in lines[-6:]:
+                self._log(job, line, "warning")
+            return None
+        measured = parse_loudnorm_json(lines)
+        if measured:
+            store.set(key, measured)
+        return measured
+
+    def _execute(self, index, argv, keep=6, stats=None, path=None, threads=None, on_progress=None, on_line=None):
+        started = time.monotonic()
+        proc = subprocess.Popen(
+            runtime_argv(argv, threads or self.layout.threads),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            **popen_group_kwargs(self.settings),
+        )
+        lower_priority(proc, self.settings)
+        self.control.register(path, proc)
+        try:
+            return self._communicate(index, proc, keep, stats, started, on_progress, on_line)
+        except BaseException:
+            # interrupted (Ctrl+C, app exit): don't leave ffmpeg behind
+            terminate_process(proc, grace=2.0)
+            metrics.wait_child(proc)
+            raise
+        finally:
+            self.control.unregister(proc)
+
+    def _communicate(self, index, proc, keep, stats, started, on_progress=None, on_line=None):
+        tail = deque(maxlen=keep)
+
+        def drain_stderr():
+            for line in proc.stderr:
+                line = line.strip()
+                if line:
+                    tail.append(line)
+                    if on_line:
+                        on_line(line)
+
+        reader = threading.Thread(target=drain_stderr, daemon=True)
+        reader.start()
+        for update in iter_progress(proc.stdout):
+            if not update:
+                continue
+            if on_progress:
+                on_progress(update)
+            else:
+                self.progress.update(index, **update)
+        returncode, usage = metrics.wait_child(proc)
+        reader.join()
+        if stats is not None:
+            stats.add_usage(usage, time.monotonic() - started)
+        return returncode, list(tail)
+
+
+def run_batch(
+    settings,
+    files,
+    log=print,
+    progress=None,
+    progress_interval=0.25,
+    job_progress=None,
+    metrics_log=None,
+    batch_journal=None,
+    control=None,
+):
+    jobs = plan_batch(settings, files)
+    runner = BatchRunner(
+        settings,
+        log=log,
+        progress=progress,
+        progress_interval=progress_interval,
+        job_progress=job_progress,
+        metrics_log=metrics_log,
+        batch_journal=batch_journal,
+        control=control,
+    )
+    return runner.run(jobs)
+
+
+def resume_batch(
+    state,
+    log=print,
+    progress=None,
+    progress_interval=0.25,
+    job_progress=None,
+    metrics_log=None,
+    control=None,
+):
+    # state is a journal.JournalState; finished jobs keep their indices and
+    # output names, only the ones without a verified completion are rerun
+    jobs = state.remaining()
+    log(f"中断したバッチを再開します ({state.created}): 残り {len(jobs)} / {len(state.jobs)} 件")
+    runner = BatchRunner(
+        state.settings,
+        log=log,
+        progress=progress,
+        progress_interval=progress_interval,
+        job_progress=job_progress,
+        metrics_log=metrics_log,
+        batch_journal=state.open(),
+        control=control,
+    )
+    return runner.run(jobs)
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import cache
+import engine
+
+JOURNAL_DIR = "journals"
+JOURNAL_VERSION = 1
+FSYNC_INTERVAL = 2.0
+FSYNC_RECORDS = 200
+COMPLETE_STATES = ("done", "cached")
+
+
+def journal_dir():
+    path = os.path.join(cache.cache_dir(), JOURNAL_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def encode_job(job):
+    return [job.index, job.input_path, [[output.format, output.path] for output in job.outputs], job.skip]
+
+
+def decode_job(settings, data):
+    index, path, outputs, skip = data
+    outputs = tuple(engine.Output(key, out_path) for key, out_path in outputs)
+    if skip or not outputs:
+        return engine.Job(index, path, outputs, (), skip=skip)
+    key = ""
+    if settings.cache:
+        key = engine.job_cache_key(settings, path, engine.resolve_output_dir(settings, path), index)
+    return engine.Job(index, path, outputs, tuple(engine.build_command(settings, path, outputs)), cache_key=key)
+
+
+class Journal:
+    # Write-ahead record of one batch: a header with the settings snapshot
+    # and the planned jobs, then one line per state transition. Lines are
+    # flushed as written and fsynced every FSYNC_INTERVAL seconds, so a crash
+    # loses at most a few completions (which are then simply redone).
+    def __init__(self, path):
+        self.path = path
+        self.batch_id = os.path.splitext(os.path.basename(path))[0]
+        self._lock = threading.Lock()
+        self._file = None
+        self._resumed = os.path.exists(path)
+        self._last_sync = time.monotonic()
+        self._unsynced = 0
+
+    @classmethod
+    def create(cls):
+        batch_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        return cls(os.path.join(journal_dir(), f"{batch_id}.jsonl"))
+
+    def begin(self, settings, jobs):
+        now = datetime.now().isoformat(timespec="seconds")
+        if self._resumed:
+            self._write({"t": "resume", "time": now, "pid": os.getpid()}, sync=True)
+            return
+        header = {
+            "t": "begin",
+            "v": JOURNAL_VERSION,
+            "time": now,
+            "pid": os.getpid(),
+            "settings": settings.to_dict(),
+            "jobs": [encode_job(job) for job in jobs],
+        }
+        self._write(header, sync=True)
+        engine.fsync_dir(os.path.dirname(self.path))
+
+    def job_state(self, index, state, outputs=None):
+        record = {"t": "state", "i": index, "s": state}
+        if outputs:
+            record["out"] = outputs
+        self._write(record)
+
+    def finish(self):
+        self._write({"t": "end", "time": datetime.now().isoformat(timespec="seconds")}, sync=True)
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, record, sync=False):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            now = time.monotonic()
+            if sync or self._unsynced >= FSYNC_RECORDS or now - self._last_sync >= FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+                self._unsynced = 0
+
+
+class JournalState:
+    def __init__(self, path, created, settings, jobs, states, ended, owner=None):
+        self.path = path
+        self.owner = owner
+        self.batch_id = os.path.splitext(os.path.basename(path))[0]
+        self.created = created
+        self.settings = settings
+        self.jobs = jobs
+        self.states = states
+        self.ended = ended
+
+    def completed(self, job):
+        if job.skip:
+            return True
+        record = self.states.get(job.index)
+        if not record:
+            return False
+        if record["s"] == "skipped":
+            return True
+        # only a completion whose outputs are still exactly as written counts
+        outputs = record.get("out")
+        return record["s"] in COMPLETE_STATES and bool(outputs) and all(cache.output_intact(o) for o in outputs)
+
+    def remaining(self):
+        return [job for job in self.jobs if not self.completed(job)]
+
+    def open(self):
+        return Journal(self.path)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def load(path):
+    header = None
+    states = {}
+    ended = False
+    owner = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # torn last line from a crash
+                continue
+            kind = record.get("t")
+            if kind in ("begin", "resume"):
+                owner = record.get("pid", owner)
+            if kind == "begin":
+                header = record
+            elif kind == "state":
+                states[record["i"]] = record
+            elif kind == "end":
+                ended = True
+    if header is None or header.get("v") != JOURNAL_VERSION:
+        return None
+    settings = engine.Settings.from_dict(header["settings"])
+    jobs = tuple(decode_job(settings, data) for data in header["jobs"])
+    return JournalState(path, header.get("time", ""), settings, jobs, states, ended, owner)
+
+
+def _owner_alive(pid):
+    # another process may still be running that batch
+    if not pid or pid == os.getpid():
+        return False
+    return bool(engine.pid_alive(pid))
+
+
+def pending():
+    states = []
+    folder = journal_dir()
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(".jsonl"):
+            continue
+        try:
+            state = load(os.path.join(folder, name))
+        except (OSError, KeyError, TypeError, ValueError):
+            continue
+        if state is not None and not state.ended and not _owner_alive(state.owner):
+            states.append(state)
+    return states
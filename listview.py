@@ -0,0 +1,406 @@
+import os
+import tkinter as tk
+import tkinter.font as tkfont
+from tkinter import ttk
+
+from engine import format_duration
+
+STATUS_LABELS = {
+    "": "",
+    "queued": "待機",
+    "analyzing": "解析中",
+    "running": "変換中",
+    "joining": "結合中",
+    "done": "完了",
+    "failed": "失敗",
+    "skipped": "スキップ",
+    "cancelled": "中止",
+}
+STATUS_COLORS = {
+    "analyzing": "#1565c0",
+    "running": "#1565c0",
+    "joining": "#1565c0",
+    "done": "#2e7d32",
+    "failed": "#c0392b",
+    "skipped": "#777777",
+    "cancelled": "#b36b00",
+}
+SELECT_BG = "#cce0ff"
+
+
+def format_size(size):
+    if size is None:
+        return ""
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    if size < 1024 * 1024 * 1024:
+        return f"{size / 1048576:.1f} MB"
+    return f"{size / 1073741824:.2f} GB"
+
+
+class FileEntry:
+    __slots__ = ("id", "path", "name", "status", "duration", "size")
+
+    def __init__(self, entry_id, path):
+        self.id = entry_id
+        self.path = path
+        self.name = os.path.basename(path)
+        self.status = ""
+        self.duration = None
+        self.size = None
+
+
+SORT_KEYS = {
+    "name": lambda entry: entry.name.lower(),
+    "status": lambda entry: entry.status,
+    "duration": lambda entry: entry.duration or 0.0,
+    "size": lambda entry: entry.size or 0,
+}
+
+
+class FileListModel:
+    # Insertion-ordered entries addressed by id and by path. Removal, filter
+    # and sort rebuild the id lists in one pass instead of deleting rows one
+    # at a time; the view only ever reads the slice it is drawing.
+    def __init__(self):
+        self.entries = {}
+        self.by_path = {}
+        self.order = []
+        self.view = []
+        self.filter_text = ""
+        self.sort_key = None
+        self.sort_reverse = False
+        self.version = 0
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self.order)
+
+    def paths(self):
+        return [self.entries[entry_id].path for entry_id in self.order]
+
+    def first_path(self):
+        return self.entries[self.order[0]].path if self.order else ""
+
+    def add_many(self, paths):
+        added = []
+        for path in paths:
+            if path in self.by_path:
+                continue
+            entry = FileEntry(self._next_id, path)
+            self._next_id += 1
+            self.entries[entry.id] = entry
+            self.by_path[path] = entry
+            added.append(entry.id)
+        if not added:
+            return added
+        self.order.extend(added)
+        if self.filter_text or self.sort_key:
+            self._rebuild()
+        else:
+            self.view.extend(added)
+        self.version += 1
+        return added
+
+    def remove(self, ids):
+        ids = set(ids)
+        removed = []
+        for entry_id in ids:
+            entry = self.entries.pop(entry_id, None)
+            if entry is not None:
+                self.by_path.pop(entry.path, None)
+                removed.append(entry.path)
+        if removed:
+            self.order = [entry_id for entry_id in self.order if entry_id not in ids]
+            self.view = [entry_id for entry_id in self.view if entry_id not in ids]
+            self.version += 1
+        return removed
+
+    def clear(self):
+        self.entries.clear()
+        self.by_path.clear()
+        self.order = []
+        self.view = []
+        self.version += 1
+
+    def update(self, path, **values):
+        entry = self.by_path.get(path)
+        if entry is None:
+            return
+        for key, value in values.items():
+            setattr(entry, key, value)
+        self.version += 1
+
+    def set_status_all(self, status):
+        for entry in self.entries.values():
+            entry.status = status
+        self.version += 1
+
+    def set_filter(self, text):
+        self.filter_text = text.strip().lower()
+        self._rebuild()
+
+    def set_sort(self, key):
+        if self.sort_key == key:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_key = key
+            self.sort_reverse = False
+        self._rebuild()
+
+    def _rebuild(self):
+        ids = self.order
+        if self.filter_text:
+            needle = self.filter_text
+            ids = [entry_id for entry_id in ids if needle in self.entries[entry_id].path.lower()]
+        else:
+            ids = list(ids)
+        if self.sort_key:
+            key = SORT_KEYS[self.sort_key]
+            ids.sort(key=lambda entry_id: key(self.entries[entry_id]), reverse=self.sort_reverse)
+        self.view = ids
+        self.version += 1
+
+
+class VirtualListView(ttk.Frame):
+    # Draws only the rows that fit in the canvas, so scrolling and redraws
+    # cost the same with 100 or 100k entries.
+    COLUMNS = (
+        ("name", "ファイル", 0),
+        ("status", "状態", 80),
+        ("duration", "長さ", 80),
+        ("size", "サイズ", 90),
+    )
+
+    def __init__(self, parent, model, on_delete=None):
+        super().__init__(parent)
+        self.model = model
+        self.on_delete = on_delete
+        self.font = tkfont.nametofont("TkDefaultFont")
+        self.row_height = self.font.metrics("linespace") + 6
+        self.top = 0
+        self.selected = set()
+        self.anchor = None
+        self._drawn = None
+        self._fit_cache = {}
+
+        filter_row = ttk.Frame(self)
+        filter_row.pack(fill=tk.X, pady=(0, 4))
+        ttk.Label(filter_row, text="絞り込み").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar(value="")
+        self.filter_var.trace_add("write", lambda *_: self._on_filter())
+        ttk.Entry(filter_row, textvariable=self.filter_var, width=24).pack(side=tk.LEFT, padx=(6, 0))
+        self.count_var = tk.StringVar(value="")
+        ttk.Label(filter_row, textvariable=self.count_var, foreground="#555555").pack(side=tk.RIGHT)
+
+        body = ttk.Frame(self)
+        body.pack(fill=tk.BOTH, expand=True)
+        body.columnconfigure(0, weight=1)
+        body.rowconfigure(1, weight=1)
+        self.header = tk.Canvas(body, height=self.row_height, highlightthickness=0, background="#eeeeee")
+        self.header.grid(row=0, column=0, sticky="ew")
+        self.canvas = tk.Canvas(body, height=8 * self.row_height, highlightthickness=1, background="white", takefocus=1)
+        self.canvas.grid(row=1, column=0, sticky="nsew")
+        self.scrollbar = ttk.Scrollbar(body, orient="vertical", command=self.yview)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh(force=True))
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Control-Button-1>", lambda e: self._on_click(e, toggle=True))
+        self.canvas.bind("<Shift-Button-1>", lambda e: self._on_click(e, extend=True))
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", lambda e: self.yview("scroll", -3, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.yview("scroll", 3, "units"))
+        self.canvas.bind("<Delete>", lambda e: self._delete())
+        self.canvas.bind("<BackSpace>", lambda e: self._delete())
+        self.canvas.bind("<Control-a>", lambda e: self.select_all())
+        self.canvas.bind("<Prior>", lambda e: self.yview("scroll", -1, "pages"))
+        self.canvas.bind("<Next>", lambda e: self.yview("scroll", 1, "pages"))
+        self.header.bind("<Button-1>", self._on_header_click)
+
+    # geometry
+
+    def _visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def _columns(self):
+        width = max(self.canvas.winfo_width(), 200)
+        fixed = sum(column[2] for column in self.COLUMNS[1:])
+        xs = []
+        x = 0
+        for key, title, col_width in self.COLUMNS:
+            col_width = col_width or max(width - fixed, 80)
+            xs.append((key, title, x, col_width))
+            x += col_width
+        return xs
+
+    def _clamp(self):
+        max_top = max(len(self.model.view) - self._visible_rows(), 0)
+        self.top = min(max(self.top, 0), max_top)
+
+    def yview(self, *args):
+        total = len(self.model.view)
+        if not args:
+            return self._fractions()
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= max(self._visible_rows() - 1, 1)
+            self.top += amount
+        self.refresh(force=True)
+
+    def _fractions(self):
+        total = len(self.model.view)
+        if not total:
+            return 0.0, 1.0
+        first = self.top / total
+        last = min((self.top + self._visible_rows()) / total, 1.0)
+        return first, last
+
+    def _on_wheel(self, event):
+        step = -1 if event.delta > 0 else 1
+        if abs(event.delta) >= 120:
+            step *= abs(event.delta) // 120
+        self.yview("scroll", step * 3, "units")
+
+    # drawing
+
+    def _fit(self, text, width):
+        key = (text, width)
+        cached = self._fit_cache.get(key)
+        if cached is not None:
+            return cached
+        if len(self._fit_cache) > 4096:
+            self._fit_cache.clear()
+        fitted = text
+        if self.font.measure(text) > width:
+            lo, hi = 0, len(text)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.font.measure("…" + text[mid:]) > width:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            fitted = "…" + text[lo:]
+        self._fit_cache[key] = fitted
+        return fitted
+
+    def refresh(self, force=False):
+        self._clamp()
+        state = (
+            self.model.version,
+            self.top,
+            self.canvas.winfo_width(),
+            self.canvas.winfo_height(),
+            len(self.selected),
+        )
+        if not force and state == self._drawn:
+            return
+        self._drawn = state
+        self._draw_header()
+        self._draw_rows()
+        self.scrollbar.set(*self._fractions())
+        shown = len(self.model.view)
+        total = len(self.model)
+        self.count_var.set(f"{total} 件" if shown == total else f"{shown} / {total} 件")
+
+    def _draw_header(self):
+        self.header.delete("all")
+        for key, title, x, width in self._columns():
+            if key == self.model.sort_key:
+                title += " ▼" if self.model.sort_reverse else " ▲"
+            self.header.create_text(x + 6, self.row_height // 2, text=title, anchor="w", font=self.font)
+
+    def _draw_rows(self):
+        canvas = self.canvas
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), 200)
+        columns = self._columns()
+        view = self.model.view
+        entries = self.model.entries
+        end = min(self.top + self._visible_rows() + 1, len(view))
+        for slot, pos in enumerate(range(self.top, end)):
+            entry = entries[view[pos]]
+            y = slot * self.row_height
+            if entry.id in self.selected:
+                canvas.create_rectangle(0, y, width, y + self.row_height, fill=SELECT_BG, outline="")
+            values = {
+                "name": entry.path,
+                "status": STATUS_LABELS.get(entry.status, entry.status),
+                "duration": format_duration(entry.duration) if entry.duration is not None else "",
+                "size": format_size(entry.size),
+            }
+            color = STATUS_COLORS.get(entry.status, "black")
+            for key, _, x, col_width in columns:
+                text = self._fit(values[key], col_width - 12)
+                canvas.create_text(
+                    x + 6,
+                    y + self.row_height // 2,
+                    text=text,
+                    anchor="w",
+                    font=self.font,
+                    fill=color if key == "status" else "black",
+                )
+
+    # selection
+
+    def _row_at(self, y):
+        pos = self.top + int(y // self.row_height)
+        return pos if 0 <= pos < len(self.model.view) else None
+
+    def _on_click(self, event, toggle=False, extend=False):
+        self.canvas.focus_set()
+        pos = self._row_at(event.y)
+        if pos is None:
+            if not toggle and not extend:
+                self.selected.clear()
+            self.refresh(force=True)
+            return "break"
+        entry_id = self.model.view[pos]
+        if extend and self.anchor is not None:
+            lo, hi = sorted((self.anchor, pos))
+            self.selected = set(self.model.view[lo : hi + 1])
+        elif toggle:
+            self.selected ^= {entry_id}
+            self.anchor = pos
+        else:
+            self.selected = {entry_id}
+            self.anchor = pos
+        self.refresh(force=True)
+        return "break"
+
+    def _on_header_click(self, event):
+        for key, _, x, width in self._columns():
+            if x <= event.x < x + width:
+                self.model.set_sort(key)
+                self.anchor = None
+                self.refresh(force=True)
+                return
+
+    def _on_filter(self):
+        self.model.set_filter(self.filter_var.get())
+        self.anchor = None
+        self.top = 0
+        self.refresh(force=True)
+
+    def _delete(self):
+        if self.on_delete:
+            self.on_delete()
+        return "break"
+
+    def select_all(self):
+        self.selected = set(self.model.view)
+        self.refresh(force=True)
+        return "break"
+
+    def selection(self):
+        return set(self.selected)
+
+    def clear_selection(self):
+        self.selected.clear()
+        self.anchor = None
+        self.refresh(force=True)
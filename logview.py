@@ -0,0 +1,141 @@
+import os
+import time
+import tkinter as tk
+from collections import deque
+from datetime import datetime
+from tkinter import ttk
+
+import cache
+
+LOG_CAPACITY = 5000
+LOG_DIR = "logs"
+LEVEL_RANK = {"debug": 0, "info": 1, "warning": 2, "error": 3}
+LEVEL_FILTERS = {"すべて": 0, "情報以上": 1, "警告以上": 2, "エラーのみ": 3}
+LEVEL_COLORS = {"debug": "#777777", "warning": "#b36b00", "error": "#c0392b"}
+
+
+class LogRecord:
+    __slots__ = ("time", "level", "job", "message")
+
+    def __init__(self, message, created=None):
+        self.time = created or time.time()
+        self.level = getattr(message, "level", "info")
+        self.job = getattr(message, "job", None)
+        self.message = str(message)
+
+    def format(self):
+        stamp = datetime.fromtimestamp(self.time).strftime("%Y-%m-%d %H:%M:%S")
+        job = f"[{self.job}] " if self.job is not None else ""
+        return f"{stamp} {self.level.upper():7} {job}{self.message}"
+
+
+class LogBuffer:
+    # Keeps the newest records in memory; older ones are appended to a log
+    # file in the cache directory instead of being dropped.
+    def __init__(self, capacity=LOG_CAPACITY):
+        self.capacity = capacity
+        self.records = deque()
+        self.spill_path = None
+        self.spilled = 0
+
+    def extend(self, records):
+        self.records.extend(records)
+        overflow = len(self.records) - self.capacity
+        if overflow > 0:
+            self._spill([self.records.popleft() for _ in range(overflow)])
+
+    def clear(self):
+        self.records.clear()
+
+    def _spill(self, records):
+        if self.spill_path is None:
+            folder = os.path.join(cache.cache_dir(), LOG_DIR)
+            os.makedirs(folder, exist_ok=True)
+            name = datetime.now().strftime("gui-%Y%m%d-%H%M%S.log")
+            self.spill_path = os.path.join(folder, name)
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write("".join(record.format() + "\n" for record in records))
+        except OSError:
+            return
+        self.spilled += len(records)
+
+
+class LogPane(ttk.Frame):
+    # Renders each poll tick with a single Text insert and trims the widget to
+    # the buffer capacity, so a chatty batch can't stall the Tk loop.
+    def __init__(self, parent, capacity=LOG_CAPACITY):
+        super().__init__(parent)
+        self.buffer = LogBuffer(capacity)
+        self._shown = 0
+
+        filter_row = ttk.Frame(self)
+        filter_row.pack(fill=tk.X, pady=(0, 4))
+        ttk.Label(filter_row, text="レベル").pack(side=tk.LEFT)
+        self.level_combo = ttk.Combobox(filter_row, values=list(LEVEL_FILTERS), state="readonly", width=10)
+        self.level_combo.set("すべて")
+        self.level_combo.pack(side=tk.LEFT, padx=(6, 12))
+        self.level_combo.bind("<<ComboboxSelected>>", lambda e: self.rerender())
+        ttk.Label(filter_row, text="ジョブ番号").pack(side=tk.LEFT)
+        self.job_var = tk.StringVar(value="")
+        self.job_var.trace_add("write", lambda *_: self.rerender())
+        ttk.Entry(filter_row, textvariable=self.job_var, width=6).pack(side=tk.LEFT, padx=(6, 12))
+        ttk.Button(filter_row, text="クリア", command=self.clear).pack(side=tk.LEFT)
+        self.spill_var = tk.StringVar(value="")
+        ttk.Label(filter_row, textvariable=self.spill_var, foreground="#555555").pack(side=tk.RIGHT)
+
+        body = ttk.Frame(self)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.text = tk.Text(body, height=10, state=tk.DISABLED, wrap="none")
+        scrollbar = ttk.Scrollbar(body, orient="vertical", command=self.text.yview)
+        self.text.configure(yscrollcommand=scrollbar.set)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        for level, color in LEVEL_COLORS.items():
+            self.text.tag_configure(level, foreground=color)
+
+    def _matches(self, record):
+        if LEVEL_RANK.get(record.level, 1) < LEVEL_FILTERS.get(self.level_combo.get(), 0):
+            return False
+        job = self.job_var.get().strip()
+        return not job or str(record.job) == job
+
+    def append(self, records):
+        if not records:
+            return
+        self.buffer.extend(records)
+        if self.buffer.spill_path:
+            self.spill_var.set(f"古いログ {self.buffer.spilled} 行: {self.buffer.spill_path}")
+        visible = [record for record in records if self._matches(record)]
+        self._insert(visible[-self.buffer.capacity :])
+
+    def rerender(self):
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.configure(state=tk.DISABLED)
+        self._shown = 0
+        self._insert([record for record in self.buffer.records if self._matches(record)], follow=True)
+
+    def clear(self):
+        self.buffer.clear()
+        self.rerender()
+
+    def _insert(self, records, follow=None):
+        if not records:
+            return
+        if follow is None:
+            follow = self.text.yview()[1] >= 0.999
+        args = []
+        for record in records:
+            args.append(record.message + "\n")
+            args.append(record.level)
+        self.text.configure(state=tk.NORMAL)
+        self.text.insert(tk.END, *args)
+        self._shown += len(records)
+        excess = self._shown - self.buffer.capacity
+        if excess > 0:
+            self.text.delete("1.0", f"{excess + 1}.0")
+            self._shown -= excess
+        self.text.configure(state=tk.DISABLED)
+        if follow:
+            self.text.see(tk.END)
@@ -0,0 +1,243 @@
+import json
+import math
+import os
+import platform
+import sys
+import threading
+import unicodedata
+from dataclasses import fields
+
+import cache
+
+METRICS_FILE = "metrics.jsonl"
+METRICS_VERSION = 1
+
+# Settings that only decide where/whether outputs are written; they don't
+# change what the encoder does, so they are left out of the option key.
+NON_ENCODING_SETTINGS = (
+    "formats",
+    "output_mode",
+    "subdir_name",
+    "out_dir",
+    "suffix",
+    "name_template",
+    "overwrite",
+    "post_action",
+    "parallel",
+    "info",
+    "cache",
+    "cache_hash",
+    "verify_output",
+    "priority",
+    "cpu_share",
+)
+
+
+def default_path():
+    return os.path.join(cache.cache_dir(), METRICS_FILE)
+
+
+def options_key(settings):
+    parts = []
+    for field in fields(settings):
+        if field.name in NON_ENCODING_SETTINGS:
+            continue
+        value = getattr(settings, field.name)
+        if value == field.default:
+            continue
+        parts.append(field.name if value is True else f"{field.name}={value}")
+    return ",".join(parts) or "-"
+
+
+def wait_child(proc):
+    # Reaps the child ourselves so its rusage (CPU time, peak RSS) isn't lost
+    # to Popen.wait(); falls back to a plain wait where wait4 is missing.
+    if not hasattr(os, "wait4"):
+        return proc.wait(), None
+    while True:
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+            break
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            return proc.wait(), None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage
+
+
+def max_rss_bytes(usage):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class JobStats:
+    def __init__(self):
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        self.max_rss = None
+        self.exec_time = 0.0
+        self.argv = ()
+        self.exit_code = None
+        self.duration = None
+        self.copy = ()
+        self.loudnorm_pass = None
+        # set when the job wrote other files than planned (tracks)
+        self.outputs = ()
+
+    def add_usage(self, usage, wall):
+        self.exec_time += wall
+        if usage is None:
+            return
+        self.cpu_user += usage.ru_utime
+        self.cpu_system += usage.ru_stime
+        self.max_rss = max(self.max_rss or 0, max_rss_bytes(usage))
+
+    def add_parallel(self, parts):
+        # children that ran side by side: CPU adds up, the wall time is the
+        # slowest one and their peaks were held at the same time
+        self.exec_time += max((part.exec_time for part in parts), default=0.0)
+        for part in parts:
+            self.cpu_user += part.cpu_user
+            self.cpu_system += part.cpu_system
+        peaks = [part.max_rss for part in parts if part.max_rss]
+        if peaks:
+            self.max_rss = max(self.max_rss or 0, sum(peaks))
+
+
+class MetricsLog:
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+
+
+def host_info():
+    return {"host": platform.node(), "machine": platform.machine(), "platform": sys.platform}
+
+
+def load(path, since=None):
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since and record.get("time", "") < since:
+                    continue
+                records.append(record)
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+GROUPINGS = {
+    "format": lambda record: "+".join(record.get("formats") or ["?"]),
+    "options": lambda record: record.get("options") or "-",
+    "combo": lambda record: f"{'+'.join(record.get('formats') or ['?'])} {record.get('options') or '-'}",
+    "host": lambda record: record.get("host") or "?",
+    "priority": lambda record: f"{record.get('priority') or 'normal'}"
+    + (f" cpu={record['cpu_share']}%" if record.get("cpu_share") else ""),
+}
+
+
+def summarize(records, by="format"):
+    key = GROUPINGS[by]
+    groups = {}
+    for record in records:
+        groups.setdefault(key(record), []).append(record)
+    rows = []
+    for name, items in groups.items():
+        ran = [r for r in items if r.get("status") == "done"]
+        wall = [r["wall"] for r in ran if r.get("wall")]
+        audio = sum(r.get("duration") or 0.0 for r in ran)
+        wall_total = sum(wall)
+        rows.append(
+            {
+                "group": name,
+                "jobs": len(items),
+                "done": len(ran),
+                "failed": sum(1 for r in items if r.get("status") == "failed"),
+                "skipped": sum(1 for r in items if r.get("status") in ("skipped", "cached")),
+                "copy": sum(1 for r in ran if r.get("copy")),
+                "audio_seconds": audio,
+                "realtime": audio / wall_total if wall_total else None,
+                "input_mb_s": sum(r.get("input_bytes") or 0 for r in ran) / wall_total / 1048576
+                if wall_total
+                else None,
+                "output_mb_s": sum(r.get("output_bytes") or 0 for r in ran) / wall_total / 1048576
+                if wall_total
+                else None,
+                "cpu_per_audio_s": sum((r.get("cpu_user") or 0) + (r.get("cpu_system") or 0) for r in ran) / audio
+                if audio
+                else None,
+                "wall_p50": percentile(wall, 50),
+                "wall_p90": percentile(wall, 90),
+                "wall_p99": percentile(wall, 99),
+                "wait_p50": percentile([r.get("queue_wait") or 0.0 for r in ran], 50),
+                "rss_max_mb": max((r.get("max_rss") or 0 for r in ran), default=0) / 1048576,
+            }
+        )
+    rows.sort(key=lambda row: -(row["wall_p50"] or 0.0))
+    return rows
+
+
+REPORT_COLUMNS = (
+    ("group", "グループ", "{}"),
+    ("jobs", "件数", "{}"),
+    ("done", "完了", "{}"),
+    ("failed", "失敗", "{}"),
+    ("skipped", "スキップ", "{}"),
+    ("copy", "コピー", "{}"),
+    ("realtime", "実時間比", "{:.1f}x"),
+    ("input_mb_s", "入力MB/s", "{:.2f}"),
+    ("output_mb_s", "出力MB/s", "{:.2f}"),
+    ("cpu_per_audio_s", "CPU秒/音声秒", "{:.3f}"),
+    ("wall_p50", "p50秒", "{:.2f}"),
+    ("wall_p90", "p90秒", "{:.2f}"),
+    ("wall_p99", "p99秒", "{:.2f}"),
+    ("wait_p50", "待ちp50", "{:.2f}"),
+    ("rss_max_mb", "最大RSS MB", "{:.1f}"),
+)
+
+
+def _width(text):
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+
+def _pad(text, width):
+    return text + " " * (width - _width(text))
+
+
+def format_table(rows):
+    header = [title for _, title, _ in REPORT_COLUMNS]
+    body = []
+    for row in rows:
+        cells = []
+        for key, _, fmt in REPORT_COLUMNS:
+            value = row.get(key)
+            cells.append("-" if value is None else fmt.format(value))
+        body.append(cells)
+    widths = [max(_width(cells[i]) for cells in [header] + body) for i in range(len(header))]
+    lines = ["  ".join(_pad(cell, width) for cell, width in zip(cells, widths)).rstrip() for cells in [header] + body]
+    return "\n".join(lines)
@@ -0,0 +1,199 @@
+import json
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import cache
+
+PROBE_CACHE = "probe.jsonl"
+LRU_SIZE = 4096
+PREFETCH_WORKERS = 2
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    path: str
+    format: dict
+    streams: tuple
+
+    @property
+    def duration(self):
+        duration = _float(self.format.get("duration"))
+        if duration is None and self.audio:
+            duration = _float(self.audio.get("duration"))
+        return duration
+
+    @property
+    def audio(self):
+        for stream in self.streams:
+            if stream.get("codec_type") == "audio":
+                return stream
+        return None
+
+    @property
+    def audio_streams(self):
+        return [stream for stream in self.streams if stream.get("codec_type") == "audio"]
+
+    @property
+    def codec_name(self):
+        return (self.audio or {}).get("codec_name")
+
+    @property
+    def sample_rate(self):
+        return _int((self.audio or {}).get("sample_rate"))
+
+    @property
+    def channels(self):
+        return _int((self.audio or {}).get("channels"))
+
+    @property
+    def format_name(self):
+        return self.format.get("format_name", "")
+
+    def summary_lines(self):
+        lines = []
+        for stream in self.streams:
+            for key in ("codec_name", "codec_type", "channels", "sample_rate", "bit_rate"):
+                if key in stream:
+                    lines.append(f"{key}={stream[key]}")
+        for key in ("duration", "bit_rate"):
+            if key in self.format:
+                lines.append(f"{key}={self.format[key]}")
+        return lines
+
+
+class ProbeService:
+    # One ffprobe (JSON) per input, memoized by path + size + mtime in an LRU
+    # backed by a JSONL store, with a small pool that probes queued files
+    # ahead of the encoders.
+    def __init__(self, locate, persist=True):
+        self.locate = locate
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._pending = {}
+        self._pool = None
+        self._ffprobe = None
+        self._ffprobe_checked = False
+
+    def ffprobe(self):
+        with self._lock:
+            if not self._ffprobe_checked:
+                self._ffprobe = self.locate()
+                self._ffprobe_checked = True
+            return self._ffprobe
+
+    def reset_tool(self):
+        with self._lock:
+            self._ffprobe_checked = False
+
+    def available(self):
+        return bool(self.ffprobe())
+
+    def _key(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return cache.make_key(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+    def peek(self, path):
+        key = self._key(path)
+        with self._lock:
+            return self._lru.get(key) if key else None
+
+    def get(self, path):
+        key = self._key(path)
+        if key is None:
+            return None
+        with self._lock:
+            info = self._lru.get(key)
+            if info is not None:
+                self._lru.move_to_end(key)
+                return info
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[key] = future
+        if not owner:
+            return future.result()
+        try:
+            info = self._load(path, key)
+        except Exception:
+            info = None
+        with self._lock:
+            self._pending.pop(key, None)
+            if info is not None:
+                self._lru[key] = info
+                while len(self._lru) > LRU_SIZE:
+                    self._lru.popitem(last=False)
+        future.set_result(info)
+        return info
+
+    def inspect(self, path):
+        # uncached and unpersisted, for files about to be renamed or deleted
+        try:
+            return self._load(path, None)
+        except Exception:
+            return None
+
+    def prefetch(self, paths):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix="probe")
+            pool = self._pool
+        return [pool.submit(self.get, path) for path in paths]
+
+    def _load(self, path, key):
+        store = cache.store(PROBE_CACHE) if self.persist and key else None
+        if store is not None:
+            data = store.get(key)
+            if data:
+                return MediaInfo(path, data.get("format", {}), tuple(data.get("streams", ())))
+        ffprobe = self.ffprobe()
+        if not ffprobe:
+            return None
+        cmd = [
+            ffprobe,
+            "-v",
+            "error",
+            "-print_format",
+            "json",
+            "-show_format",
+            "-show_streams",
+            path,
+        ]
+        result = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8", errors="replace"
+        )
+        if result.returncode != 0:
+            return None
+        try:
+            data = json.loads(result.stdout or "{}")
+        except ValueError:
+            return None
+        data = {
+            "format": {k: v for k, v in data.get("format", {}).items() if k != "filename"},
+            "streams": data.get("streams", []),
+        }
+        if store is not None:
+            store.set(key, data)
+        return MediaInfo(path, data["format"], tuple(data["streams"]))
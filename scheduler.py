@@ -0,0 +1,261 @@
+import functools
+import math
+import os
+import platform
+import subprocess
+import sys
+from dataclasses import dataclass
+
+# Rough relative CPU cost per second of audio (1.0 = a typical lossy encoder).
+# Audio encoders in ffmpeg are effectively single threaded, so the cost
+# decides whether a job is CPU bound (one job per core) or I/O bound (a few
+# jobs saturate the disk and more only add seeks), and roughly how many cores
+# one ffmpeg can keep busy (decode, filter graph and each encoder run side by
+# side) - threads beyond that only sit idle.
+CODEC_COST = {
+    "pcm_s16le": 0.1,
+    "pcm_s24le": 0.1,
+    "pcm_s32le": 0.1,
+    "flac": 0.3,
+    "aac": 1.0,
+    "libmp3lame": 0.8,
+    "libopus": 1.0,
+    "libvorbis": 1.0,
+}
+FILTER_COST = {
+    "loudnorm": 2.0,
+    "aresample": 0.2,
+    "replaygain": 0.3,
+    "silenceremove": 0.2,
+    "volume": 0.05,
+    "afade": 0.05,
+    "atrim": 0.02,
+    "asetpts": 0.0,
+}
+SOXR_COST = 0.6
+DECODE_COST = 0.2
+IO_BOUND_COST = 0.6
+IO_BOUND_WORKERS = 4
+MAX_THREADS_PER_JOB = 16
+
+# Background priority: (nice value, Linux I/O class, I/O level). "low" stays
+# in the best-effort I/O class at its lowest level; "idle" only gets disk and
+# CPU time nobody else wants.
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+PRIORITIES = {
+    "low": (10, IOPRIO_CLASS_BE, 7),
+    "idle": (19, IOPRIO_CLASS_IDLE, 0),
+}
+PRIORITY_LABELS = {None: "通常", "low": "低", "idle": "アイドル"}
+# ioprio_set has no libc wrapper
+IOPRIO_SET_SYSCALL = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+    "riscv64": 30,
+}
+
+
+@dataclass(frozen=True)
+class Layout:
+    cores: int
+    workers: int
+    threads: int
+    cost: float
+    auto: bool
+
+    def describe(self):
+        mode = "自動" if self.auto else "固定"
+        return (
+            f"並列 ({mode}): {self.workers} ジョブ x {self.threads} スレッド "
+            f"(使用可能コア {self.cores}, 推定負荷 {self.cost:.2f})"
+        )
+
+
+def _read_first_line(path):
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            return f.readline().strip()
+    except OSError:
+        return ""
+
+
+def _read_lines(path):
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+def _cgroup_v2_path():
+    # on hybrid v1/v2 hosts the "0::" line comes after the v1 controllers
+    for line in _read_lines("/proc/self/cgroup"):
+        if line.startswith("0::"):
+            return line[3:]
+    return ""
+
+
+def cgroup_cpu_quota():
+    candidates = []
+    rel = _cgroup_v2_path()
+    if rel:
+        candidates.append(os.path.join("/sys/fs/cgroup", rel.lstrip("/"), "cpu.max"))
+    candidates.append("/sys/fs/cgroup/cpu.max")
+    for path in candidates:
+        parts = _read_first_line(path).split()
+        if len(parts) == 2 and parts[0] != "max":
+            try:
+                return int(parts[0]) / int(parts[1])
+            except (ValueError, ZeroDivisionError):
+                pass
+    quota = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    try:
+        quota_us = int(quota)
+        period_us = int(period)
+    except ValueError:
+        return None
+    if quota_us <= 0 or period_us <= 0:
+        return None
+    return quota_us / period_us
+
+
+def usable_cpu_count():
+    try:
+        count = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        count = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota:
+        count = min(count, max(1, math.floor(quota)))
+    return max(1, count)
+
+
+def share_cores(share):
+    if not share or share >= 100:
+        return None
+    return max(1, math.floor(usable_cpu_count() * share / 100))
+
+
+def share_cpus(share):
+    # A hard cap: children are pinned to this many CPUs. The highest-numbered
+    # ones are used since interrupts and the desktop tend to live on CPU 0.
+    count = share_cores(share)
+    if count is None or not hasattr(os, "sched_setaffinity"):
+        return None
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except OSError:
+        return None
+    return frozenset(cpus[-count:])
+
+
+@functools.lru_cache(maxsize=None)
+def _ioprio_setter():
+    if not sys.platform.startswith("linux"):
+        return None
+    number = IOPRIO_SET_SYSCALL.get(platform.machine())
+    if number is None:
+        return None
+    try:
+        import ctypes
+
+        syscall = ctypes.CDLL(None, use_errno=True).syscall
+    except (OSError, AttributeError):
+        return None
+
+    def set_ioprio(pid, io_class, level):
+        return syscall(number, IOPRIO_WHO_PROCESS, pid, (io_class << IOPRIO_CLASS_SHIFT) | level) == 0
+
+    return set_ioprio
+
+
+def priority_kwargs(priority=None, share=0):
+    # Popen arguments for the Windows priority classes. On POSIX the child is
+    # lowered by apply_priority once started: a preexec_fn isn't safe with
+    # Popen called from several runner threads at once.
+    if os.name == "nt":
+        flags = {"low": subprocess.BELOW_NORMAL_PRIORITY_CLASS, "idle": subprocess.IDLE_PRIORITY_CLASS}
+        return {"creationflags": flags[priority]} if priority in flags else {}
+    return {}
+
+
+def _process_threads(pid):
+    # nice, the scheduler class, I/O priority and affinity are per thread on
+    # Linux, and ffmpeg may have started its threads already
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except (OSError, ValueError):
+        return [pid]
+
+
+def apply_priority(pid, priority=None, share=0):
+    if os.name == "nt":
+        return
+    nice, io_class, io_level = PRIORITIES.get(priority, (0, None, 0))
+    cpus = share_cpus(share)
+    if not nice and cpus is None:
+        return
+    set_ioprio = _ioprio_setter() if io_class else None
+    # errors are ignored: a child at normal priority beats no child at all
+    for tid in _process_threads(pid):
+        try:
+            if nice and os.getpriority(os.PRIO_PROCESS, tid) < nice:
+                os.setpriority(os.PRIO_PROCESS, tid, nice)
+            if priority == "idle" and hasattr(os, "SCHED_IDLE"):
+                os.sched_setscheduler(tid, os.SCHED_IDLE, os.sched_param(0))
+        except OSError:
+            pass
+        if set_ioprio:
+            set_ioprio(tid, io_class, io_level)
+        if cpus:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except OSError:
+                pass
+
+
+def describe_priority(priority=None, share=0):
+    parts = [f"優先度: {PRIORITY_LABELS.get(priority, priority)}"]
+    if priority in PRIORITIES:
+        nice, io_class, io_level = PRIORITIES[priority]
+        io = "idle" if io_class == IOPRIO_CLASS_IDLE else f"best-effort {io_level}"
+        parts.append(f"(nice {nice}, I/O {io})")
+    cores = share_cores(share)
+    if cores:
+        parts.append(f"CPU 上限 {share}% ({cores} コア)")
+    return " ".join(parts)
+
+
+def estimate_cost(codecs, filters, resample=None):
+    if isinstance(codecs, str):
+        codecs = [codecs]
+    cost = DECODE_COST + sum(CODEC_COST.get(codec, 1.0) for codec in codecs)
+    for spec in filters:
+        name = spec.split("=", 1)[0]
+        cost += FILTER_COST.get(name, 0.1)
+    if resample == "soxr":
+        cost += SOXR_COST
+    return cost
+
+
+def plan_layout(job_count, cost, parallel=0, cores=None):
+    cores = cores or usable_cpu_count()
+    job_count = max(job_count, 1)
+    auto = parallel <= 0
+    if auto:
+        workers = min(job_count, cores)
+        if cost < IO_BOUND_COST:
+            workers = min(workers, IO_BOUND_WORKERS)
+    else:
+        workers = min(parallel, job_count)
+    workers = max(workers, 1)
+    threads = min(max(1, cores // workers), max(1, math.ceil(cost)), MAX_THREADS_PER_JOB)
+    return Layout(cores, workers, threads, cost, auto)
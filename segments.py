@@ -0,0 +1,248 @@
+import math
+import os
+import threading
+from dataclasses import dataclass, replace
+
+import engine
+
+# Only inputs this long are split; below that the extra processes and the
+# join cost more than they save.
+MIN_DURATION = 600.0
+MIN_SEGMENT = 120.0
+MAX_SEGMENTS = 16
+# Whole seconds decoded on each side of a cut, so the resampler sees the real
+# neighbouring audio instead of starting and ending on silence.
+CONTEXT_SECONDS = 1
+AAC_FRAME = 1024
+# Extra AAC frames encoded on each side of an inner cut and dropped again when
+# the frames are spliced, so the frames next to the cut were encoded with the
+# same audio around them as a single pass would have had.
+AAC_OVERLAP_FRAMES = 8
+ADTS_HEADER = 7
+# Inputs whose demuxers seek to the exact sample; every segment has to start
+# precisely where a single pass would have been at that point.
+EXACT_SEEK_CODECS = ("flac", "alac", "wavpack", "tta")
+# Filters that look at the whole stream (integrated loudness, gain over the
+# track, where the silence ends) give different results on each piece.
+WHOLE_STREAM_SETTINGS = (
+    ("loudnorm", "loudnorm"),
+    ("replaygain", "replaygain"),
+    ("silence_trim", "silenceremove"),
+)
+
+
+@dataclass(frozen=True)
+class Segment:
+    index: int
+    # output samples from the start of the (trimmed) audio
+    start: int
+    end: int
+    # samples encoded before start / after end and dropped when joining
+    lead: int
+    tail: int
+    # whole seconds from the start of the audio where decoding begins
+    seek: int
+
+
+@dataclass(frozen=True)
+class SegmentPlan:
+    # "pcm": wav pieces joined as is, "adts": aac frames spliced
+    mode: str
+    rate: int
+    total: int
+    segments: tuple
+
+    @property
+    def last(self):
+        return self.segments[-1]
+
+
+def join_mode(settings):
+    # None = the pieces can't be joined without encoding the whole file again
+    # in one process, which would leave nothing running in parallel that
+    # matters (the encoder is the slow part)
+    if len(settings.formats) != 1:
+        return None
+    mode = engine.FORMATS[settings.primary_format].get("segment_join")
+    if mode == "adts" and settings.aac_profile not in (None, "LC"):
+        # SBR profiles use 2048-sample frames with their own delay
+        return None
+    return mode
+
+
+def refusal(settings, media):
+    if len(settings.formats) != 1:
+        return "複数の出力形式は区間をつなげられません"
+    if join_mode(settings) is None:
+        # joining would mean one more serial encode of the whole file
+        return f"{settings.primary_format} は区間をそのままつなげられません (WAV と AAC のみ)"
+    for name, label in WHOLE_STREAM_SETTINGS:
+        if getattr(settings, name):
+            return f"{label} はファイル全体を見るため分割できません"
+    if media is None or not media.duration or not media.sample_rate:
+        return "長さまたはサンプルレートが不明です"
+    codec = media.codec_name or "?"
+    if not (codec.startswith("pcm_") or codec in EXACT_SEEK_CODECS):
+        return f"{codec} は正確な位置にシークできません"
+    return None
+
+
+def plan_segments(settings, media, count):
+    duration = engine.effective_duration(settings, media.duration)
+    count = min(count, MAX_SEGMENTS, int(duration // MIN_SEGMENT))
+    if duration < MIN_DURATION or count < 2:
+        return None
+    mode = join_mode(settings)
+    rate = int(settings.sample_rate) if settings.sample_rate else media.sample_rate
+    total = round(duration * rate)
+    frame = AAC_FRAME if mode == "adts" else 1
+    overlap = AAC_OVERLAP_FRAMES * AAC_FRAME if mode == "adts" else 0
+    # inner cuts fall on frame boundaries of a single pass over the audio
+    bounds = [0] + [total * i // count // frame * frame for i in range(1, count)] + [total]
+    segments = []
+    for i in range(count):
+        start, end = bounds[i], bounds[i + 1]
+        lead = overlap if i else 0
+        tail = overlap if i < count - 1 else 0
+        seek = max((start - lead) // rate - CONTEXT_SECONDS, 0)
+        segments.append(Segment(i, start, end, lead, tail, seek))
+    return SegmentPlan(mode, rate, total, tuple(segments))
+
+
+def _fade_out_point(settings):
+    if settings.fade_out is None or settings.fade_out_start is None:
+        return None
+    return max(settings.fade_out_start - (settings.trim_start or 0.0), 0.0)
+
+
+def fades_fit(settings, plan):
+    # fades are applied inside the first and last piece only
+    if settings.fade_in and settings.fade_in * plan.rate > plan.segments[0].end:
+        return False
+    point = _fade_out_point(settings)
+    return point is None or point * plan.rate >= plan.last.start + plan.last.lead
+
+
+def segment_filters(settings, plan, segment):
+    # the trim window is done by the seek and atrim below; an explicit
+    # aresample puts the timestamps in output samples for atrim
+    local = replace(
+        settings,
+        trim_start=None,
+        trim_end=None,
+        sample_rate=str(plan.rate),
+        resample=settings.resample or "swr",
+    )
+    filters = engine.pre_loudnorm_filters(local)
+    offset = segment.seek * plan.rate
+    trim = f"atrim=start_pts={segment.start - segment.lead - offset}"
+    if segment is not plan.last:
+        # the last piece runs to the real end; the probed duration can be
+        # a little short
+        trim += f":end_pts={segment.end + segment.tail - offset}"
+    filters += [trim, "asetpts=PTS-STARTPTS"]
+    if segment.index == 0 and settings.fade_in:
+        filters.append(f"afade=t=in:st=0:d={settings.fade_in}")
+    point = _fade_out_point(settings)
+    if segment is plan.last and point is not None:
+        start = point - (segment.start - segment.lead) / plan.rate
+        filters.append(f"afade=t=out:st={engine.format_seconds(start)}:d={settings.fade_out}")
+    return filters
+
+
+def segment_command(settings, path, plan, segment, out_path):
+    origin = settings.trim_start or 0.0
+    cmd = ["ffmpeg", "-y"]
+    if origin + segment.seek:
+        cmd += ["-ss", engine.format_seconds(origin + segment.seek)]
+    if segment is not plan.last:
+        needed = math.ceil((segment.end + segment.tail) / plan.rate) + CONTEXT_SECONDS
+        cmd += ["-t", str(needed - segment.seek)]
+    elif settings.trim_end is not None:
+        cmd += ["-t", engine.format_seconds(max(settings.trim_end - origin - segment.seek, 0.0))]
+    cmd += ["-i", path, "-map", "0:a:0", "-vn", "-map_metadata", "-1"]
+    cmd += engine.codec_args(settings, settings.primary_format)
+    cmd += ["-f", engine.FORMATS[settings.primary_format]["muxer"]]
+    cmd += ["-af", ",".join(segment_filters(settings, plan, segment)), out_path]
+    return cmd
+
+
+def part_extension(plan, settings):
+    return "." + engine.FORMATS[settings.primary_format]["ext"]
+
+
+def write_concat_list(path, parts):
+    with open(path, "w", encoding="utf-8") as f:
+        for part in parts:
+            escaped = os.path.abspath(part).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def join_command(settings, path, plan, list_path, outputs):
+    # Joins the wav pieces as they are. The pieces carry only audio; tags and
+    # cover art come from the source, the way a single pass would have
+    # copied them.
+    cmd = ["ffmpeg", "-n" if settings.overwrite == "skip" else "-y"]
+    cmd += ["-f", "concat", "-safe", "0", "-i", list_path, "-i", path]
+    for output in outputs:
+        cmd += ["-map", "0:a"]
+        if not settings.audio_only and settings.album_art != "strip" and engine.FORMATS[output.format].get("cover_art"):
+            cmd += ["-map", "1:v?", "-c:v", "copy"]
+        cmd += ["-map_metadata", "-1" if settings.metadata == "strip" else "1"]
+        cmd += ["-c:a", "copy", output.path]
+    return cmd
+
+
+def iter_adts_frames(f):
+    while True:
+        header = f.read(ADTS_HEADER)
+        if not header:
+            return
+        if len(header) < ADTS_HEADER or header[0] != 0xFF or header[1] & 0xF0 != 0xF0:
+            raise ValueError("ADTS フレームの同期が取れません")
+        length = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+        body = f.read(length - ADTS_HEADER)
+        if length < ADTS_HEADER or len(body) < length - ADTS_HEADER:
+            raise ValueError("ADTS フレームが途中で切れています")
+        yield header + body
+
+
+def splice_adts(plan, parts, out_path):
+    # The encoder's first frame is priming, so the frame that carries a
+    # piece's first sample comes one after its lead. Priming is kept only at
+    # the very start and the end padding only at the very end, which is what
+    # a single pass writes.
+    with open(out_path, "wb") as out:
+        for segment, part in zip(plan.segments, parts):
+            first = segment.lead // AAC_FRAME + 1 if segment.index else 0
+            stop = None
+            if segment is not plan.last:
+                stop = segment.lead // AAC_FRAME + 1 + (segment.end - segment.start) // AAC_FRAME
+            with open(part, "rb") as f:
+                for n, frame in enumerate(iter_adts_frames(f)):
+                    if stop is not None and n >= stop:
+                        break
+                    if n >= first:
+                        out.write(frame)
+
+
+class SegmentProgress:
+    # Folds the pieces' progress into one entry for the job.
+    def __init__(self, tracker, index, plan):
+        self.tracker = tracker
+        self.index = index
+        self.limits = {s.index: (s.end - s.start + s.lead + s.tail) / plan.rate for s in plan.segments}
+        self.done = {}
+        self.speed = {}
+        self._lock = threading.Lock()
+
+    def update(self, segment, update):
+        with self._lock:
+            if "out_time" in update:
+                self.done[segment.index] = min(update["out_time"], self.limits[segment.index])
+            if update.get("speed"):
+                self.speed[segment.index] = update["speed"]
+            values = {"out_time": sum(self.done.values())}
+            if self.speed:
+                values["speed"] = sum(self.speed.values())
+        self.tracker.update(self.index, **values)
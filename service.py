@@ -0,0 +1,515 @@
+import hmac
+import itertools
+import json
+import math
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import fields, replace
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import cluster
+import engine
+import metrics
+import scheduler
+from engine import FORMATS, Settings
+
+DEFAULT_PORT = 8766
+CHUNK_SIZE = 64 * 1024
+DEFAULT_QUEUE = 16
+QUEUE_TIMEOUT = 300.0
+RETRY_AFTER = 5
+STDERR_LINES = 20
+# values end up inside ffmpeg filter strings, so nothing that could open a
+# second filter or option (",", ";", ":", "=", "[")
+SAFE_VALUE = re.compile(r"^[A-Za-z0-9._+-]*$")
+# only meaningful for files on disk or for the batch runner
+UNSUPPORTED_SETTINGS = (set(metrics.NON_ENCODING_SETTINGS) - {"formats"}) | {
+    "loudnorm_two_pass",
+    "force_reencode",
+    "segment_parallel",
+    # one request streams one output
+    "split_silence",
+    "split_cue",
+    "regions",
+    "regions_file",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def _coerce(field, value):
+    kind = str(field.type)
+    optional = "None" in kind
+    if "bool" in kind:
+        if value.lower() in ("1", "true", "yes", "on"):
+            return True
+        if value.lower() in ("", "0", "false", "no", "off"):
+            return False
+        raise ValueError(value)
+    if not SAFE_VALUE.match(value):
+        raise ValueError(value)
+    if optional and not value:
+        return None
+    if "float" in kind:
+        number = float(value)
+        # "inf"/"nan" parse as floats but make no sense as seconds or dB
+        if not math.isfinite(number):
+            raise ValueError(value)
+        return number
+    if "int" in kind:
+        return int(value)
+    choices = engine.SETTING_CHOICES.get(field.name)
+    if choices and value not in choices:
+        raise ValueError(value)
+    # plain str fields are stripped/compared by the engine, never None
+    return value
+
+
+def settings_from_query(query):
+    # the same option names as Settings (and the journal/metrics records);
+    # "format" is accepted for the single output format
+    names = {field.name: field for field in fields(Settings)}
+    values = {}
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name in ("format", "formats"):
+            if value not in FORMATS:
+                raise RequestError(400, f"未対応の形式です: {value}")
+            values["formats"] = (value,)
+            continue
+        field = names.get(name)
+        if field is None or name in UNSUPPORTED_SETTINGS:
+            raise RequestError(400, f"このモードでは使えないオプションです: {name}")
+        try:
+            values[name] = _coerce(field, value)
+        except ValueError:
+            raise RequestError(400, f"不正な値です: {name}={value}")
+    fmt = FORMATS[values.get("formats", Settings.formats)[0]]
+    if "bitrate" not in values and fmt.get("bitrate"):
+        values["bitrate"] = fmt.get("bitrate_default", "")
+    return Settings(**values)
+
+
+def request_chunks(rfile, length=None, chunked=False):
+    if not chunked:
+        remaining = length or 0
+        while remaining > 0:
+            data = rfile.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise ConnectionError("リクエスト本文が途中で切れました")
+            remaining -= len(data)
+            yield data
+        return
+    while True:
+        line = rfile.readline(1024)
+        try:
+            size = int(line.split(b";")[0], 16)
+        except ValueError:
+            raise ConnectionError("チャンク形式が不正です")
+        if size == 0:
+            # trailers, then the blank line
+            while rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                pass
+            return
+        remaining = size
+        while remaining:
+            data = rfile.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise ConnectionError("リクエスト本文が途中で切れました")
+            remaining -= len(data)
+            yield data
+        rfile.readline(1024)
+
+
+def _spill(folder, chunks, suffix):
+    fd, path = tempfile.mkstemp(prefix="acv-service-", suffix=suffix, dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except BaseException:
+        engine.remove_quietly([path])
+        raise
+    return path
+
+
+class ConversionService:
+    # One ffmpeg per request, at most `jobs` at a time. Further requests wait
+    # for a slot before their body is read, so a client's upload stalls in
+    # TCP instead of piling up in memory here; once `queue` requests are
+    # waiting the service answers 503 with Retry-After.
+    def __init__(
+        self,
+        jobs=0,
+        queue=DEFAULT_QUEUE,
+        queue_timeout=QUEUE_TIMEOUT,
+        log=print,
+        token="",
+        priority=None,
+        metrics_log=None,
+        spill_dir=None,
+    ):
+        cores = scheduler.usable_cpu_count()
+        self.jobs = jobs or cores
+        self.threads = min(max(1, cores // self.jobs), scheduler.MAX_THREADS_PER_JOB)
+        self.max_queue = queue
+        self.queue_timeout = queue_timeout
+        self.log = log
+        self.token = token
+        self.priority = priority
+        self.metrics = metrics.MetricsLog() if metrics_log is None else metrics_log
+        self.spill_dir = spill_dir or tempfile.gettempdir()
+        self.control = engine.BatchControl()
+        self.served = 0
+        self._slots = threading.BoundedSemaphore(self.jobs)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self._ids = itertools.count(1)
+        self._server = None
+
+    def serve(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        threading.Thread(target=self._server.serve_forever, name="service-http", daemon=True).start()
+        return self._server.server_address
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.control.cancel()
+
+    def status(self):
+        with self._lock:
+            return {
+                "jobs": self.jobs,
+                "active": self._active,
+                "waiting": self._waiting,
+                "queue": self.max_queue,
+                "served": self.served,
+                "formats": {key: {"mime": fmt["mime"], "streamed": not fmt.get("seekable_output")} for key, fmt in FORMATS.items()},
+            }
+
+    def acquire(self):
+        # a free slot is taken straight away; only waiting counts against the queue
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self._active += 1
+            return True
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                return False
+            self._waiting += 1
+        acquired = False
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                if acquired:
+                    self._active += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self.served += 1
+        self._slots.release()
+
+    def command(self, settings, source, target):
+        argv = engine.build_command(settings, source, (engine.Output(settings.primary_format, target),))
+        # a pipe has no extension to pick the muxer from
+        argv = argv[:-1] + ["-f", FORMATS[settings.primary_format]["muxer"], argv[-1]]
+        threads = str(self.threads)
+        return [argv[0], "-nostats", "-threads", threads, "-filter_threads", threads, *argv[1:]]
+
+    def convert(self, handler, settings, chunks):
+        request_id = f"request-{next(self._ids)}"
+        fmt = FORMATS[settings.primary_format]
+        started = time.monotonic()
+        chunks = iter(chunks)
+        first = next(chunks, b"")
+        body = itertools.chain([first], chunks)
+        temp_in = temp_out = None
+        try:
+            source = "pipe:0"
+            if first[4:8] == b"ftyp":
+                # mp4/m4a inputs usually keep the moov atom at the end, which
+                # the demuxer has to seek to
+                temp_in = source = _spill(self.spill_dir, body, ".m4a")
+                body = ()
+            target = "pipe:1"
+            if fmt.get("seekable_output"):
+                temp_out = target = _spill(self.spill_dir, (), f".{fmt['ext']}")
+            argv = self.command(settings, source, target)
+            job = _Job(self, request_id, settings, argv, body if source == "pipe:0" else None)
+            if temp_in:
+                job.input_bytes = os.path.getsize(temp_in)
+            status = job.run(handler, temp_out)
+        finally:
+            engine.remove_quietly([path for path in (temp_in, temp_out) if path])
+        return status, job, started
+
+    def record(self, settings, status, job, started, queued):
+        if not self.metrics:
+            return
+        wall = time.monotonic() - started
+        self.metrics.write(
+            {
+                "v": metrics.METRICS_VERSION,
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "batch": "service",
+                "options": metrics.options_key(settings),
+                "workers": self.jobs,
+                "threads": self.threads,
+                "priority": self.priority or "normal",
+                **metrics.host_info(),
+                "index": job.request_id,
+                "formats": list(settings.formats),
+                "status": status,
+                "exit_code": job.returncode,
+                "input_bytes": job.input_bytes,
+                "output_bytes": job.output_bytes,
+                "wall": wall,
+                "exec_time": job.stats.exec_time,
+                "cpu_user": job.stats.cpu_user,
+                "cpu_system": job.stats.cpu_system,
+                "max_rss": job.stats.max_rss,
+                "queue_wait": max(started - queued, 0.0),
+                "argv": list(job.argv),
+                "streamed": job.streamed,
+            }
+        )
+
+
+class _Job:
+    def __init__(self, service, request_id, settings, argv, body):
+        self.service = service
+        self.request_id = request_id
+        self.settings = settings
+        self.argv = argv
+        self.body = body
+        self.stats = metrics.JobStats()
+        self.returncode = None
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.streamed = False
+        self.body_complete = body is None
+        self.tail = deque(maxlen=STDERR_LINES)
+
+    def run(self, handler, spilled):
+        service = self.service
+        started = time.monotonic()
+        settings = replace(self.settings, priority=service.priority)
+        proc = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE if self.body is not None else subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL if spilled else subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            **engine.popen_group_kwargs(settings),
+        )
+        engine.lower_priority(proc, settings)
+        service.control.register(self.request_id, proc)
+        threads = [threading.Thread(target=self._drain_stderr, args=(proc,), daemon=True)]
+        if self.body is not None:
+            threads.append(threading.Thread(target=self._feed, args=(proc,), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            if spilled:
+                status = self._send_file(handler, proc, spilled, threads)
+            else:
+                status = self._stream(handler, proc, threads)
+        except BaseException:
+            # client went away or the service is shutting down
+            engine.terminate_process(proc, grace=2.0)
+            self._reap(proc)
+            raise
+        finally:
+            service.control.unregister(proc)
+        self.stats.exec_time = time.monotonic() - started
+        return status
+
+    def _reap(self, proc):
+        self.returncode, usage = metrics.wait_child(proc)
+        self.stats.add_usage(usage, 0.0)
+
+    def _feed(self, proc):
+        try:
+            for chunk in self.body:
+                proc.stdin.write(chunk)
+                self.input_bytes += len(chunk)
+            self.body_complete = True
+        except (BrokenPipeError, ConnectionError, OSError):
+            # ffmpeg stopped reading (error, or -t trimmed the input)
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    def _drain_stderr(self, proc):
+        for line in proc.stderr:
+            line = line.decode("utf-8", "replace").strip()
+            if line:
+                self.tail.append(line)
+
+    def _finish(self, proc, threads):
+        self._reap(proc)
+        for thread in threads:
+            thread.join()
+
+    def _failed(self, handler):
+        message = "\n".join(self.tail) or f"ffmpeg が終了コード {self.returncode} で終了しました"
+        handler.send_json(422, {"error": "変換に失敗しました", "exit_code": self.returncode, "stderr": message})
+        return "failed"
+
+    def _stream(self, handler, proc, threads):
+        data = proc.stdout.read(CHUNK_SIZE)
+        if not data:
+            # nothing written yet: the status line can still tell the truth
+            self._finish(proc, threads)
+            if self.returncode != 0:
+                return self._failed(handler)
+        handler.send_response(200)
+        handler.send_header("Content-Type", FORMATS[self.settings.primary_format]["mime"])
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        self.streamed = True
+        while data:
+            handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.output_bytes += len(data)
+            data = proc.stdout.read(CHUNK_SIZE)
+        if self.returncode is None:
+            self._finish(proc, threads)
+        if self.returncode != 0:
+            # headers are gone; dropping the connection without the final
+            # chunk is how the client learns the body is incomplete
+            handler.close_connection = True
+            return "failed"
+        handler.wfile.write(b"0\r\n\r\n")
+        return "done"
+
+    def _send_file(self, handler, proc, path, threads):
+        self._finish(proc, threads)
+        if self.returncode != 0:
+            return self._failed(handler)
+        self.output_bytes = os.path.getsize(path)
+        handler.send_response(200)
+        handler.send_header("Content-Type", FORMATS[self.settings.primary_format]["mime"])
+        handler.send_header("Content-Length", str(self.output_bytes))
+        handler.end_headers()
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                handler.wfile.write(data)
+        return "done"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "AudioConverter-Service/1"
+
+    responded = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_response(self, code, message=None):
+        self.responded = True
+        super().send_response(code, message)
+
+    def send_json(self, code, body, headers=()):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.service.token
+        return not token or hmac.compare_digest(self.headers.get(cluster.TOKEN_HEADER, ""), token)
+
+    def do_GET(self):
+        if not self._authorized():
+            return self.send_json(403, {"error": "token"})
+        if urlsplit(self.path).path == "/status":
+            return self.send_json(200, self.server.service.status())
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        service = self.server.service
+        self.responded = False
+        url = urlsplit(self.path)
+        # anything answered before the body is consumed must close the
+        # connection, or the unread body would be parsed as the next request
+        client_close = self.close_connection
+        self.close_connection = True
+        if url.path != "/convert":
+            return self.send_json(404, {"error": "not found"})
+        if not self._authorized():
+            return self.send_json(403, {"error": "token"})
+        chunked = "chunked" in self.headers.get("Transfer-Encoding", "").lower()
+        length = self.headers.get("Content-Length")
+        if not chunked and length is None:
+            return self.send_json(411, {"error": "Content-Length か chunked 転送が必要です"})
+        try:
+            settings = settings_from_query(url.query)
+            length = int(length or 0)
+        except RequestError as exc:
+            return self.send_json(exc.code, {"error": str(exc)})
+        except ValueError:
+            return self.send_json(400, {"error": "Content-Length が不正です"})
+        queued = time.monotonic()
+        if not service.acquire():
+            return self.send_json(503, {"error": "混雑しています"}, [("Retry-After", str(RETRY_AFTER))])
+        try:
+            status, job, started = service.convert(self, settings, request_chunks(self.rfile, length, chunked))
+        except (BrokenPipeError, ConnectionError) as exc:
+            service.log(engine.log_line(f"接続が切れました: {exc}", "warning"))
+            return
+        except OSError as exc:
+            # ffmpeg could not be started
+            service.log(engine.log_line(f"ffmpeg を起動できません: {exc}", "error"))
+            return self.send_json(500, {"error": str(exc)})
+        except Exception as exc:
+            # a bug in one request must not drop the connection without an
+            # answer; once the status line is out, closing is all that is left
+            service.log(engine.log_line(f"変換に失敗しました: {exc!r}", "error"))
+            if not self.responded:
+                self.send_json(500, {"error": "内部エラー"})
+            return
+        finally:
+            service.release()
+        self.close_connection = client_close or not job.body_complete or status != "done"
+        service.record(settings, status, job, started, queued)
+        level = "info" if status == "done" else "error"
+        service.log(
+            engine.log_line(
+                f"{job.request_id}: {settings.primary_format} {status} "
+                f"(入力 {job.input_bytes} B, 出力 {job.output_bytes} B, {time.monotonic() - queued:.2f}s)",
+                level,
+            )
+        )
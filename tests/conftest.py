@@ -0,0 +1,86 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+import engine  # noqa: E402
+
+# ffmpeg stand-in: writes every output path it is given and logs its argv
+STUB_FFMPEG = """
+import json, os, sys, time
+args = sys.argv[1:]
+with open(os.environ["STUB_LOG"], "a") as f:
+    f.write(json.dumps(args) + "\\n")
+if "-progress" in args:
+    print("out_time_us=1000000\\nspeed=10x\\nprogress=end", flush=True)
+inputs = {args[i + 1] for i, a in enumerate(args) if a == "-i"}
+for i, a in enumerate(args):
+    if i and args[i - 1] in ("-i", "-filter_complex", "-af", "-map", "-f", "-metadata"):
+        continue
+    if os.sep in a and a not in inputs and not a.startswith("[") and os.path.isdir(os.path.dirname(a)):
+        with open(a, "wb") as f:
+            f.write(b"converted")
+"""
+
+# ffprobe stand-in: the codec follows the extension, STUB_DURATION the length
+STUB_FFPROBE = """
+import json, os, sys
+path = sys.argv[-1]
+codec = {".wav": "pcm_s24le", ".flac": "flac", ".mp3": "mp3"}.get(os.path.splitext(path)[1], "aac")
+duration = os.environ.get("STUB_DURATION", "3.0")
+print(json.dumps({
+    "format": {"duration": duration, "format_name": "stub"},
+    "streams": [{"codec_type": "audio", "codec_name": codec, "sample_rate": "44100", "channels": 2}],
+}))
+"""
+
+
+def _write_tool(folder, name, body):
+    path = os.path.join(folder, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"#!{sys.executable}\n" + textwrap.dedent(body))
+    os.chmod(path, 0o755)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    folder = tmp_path / "cache"
+    folder.mkdir()
+    monkeypatch.setenv("AUDIOCONVERTER_CACHE_DIR", str(folder))
+    # the stores remember their path
+    monkeypatch.setattr(cache, "_stores", {})
+    return folder
+
+
+@pytest.fixture
+def stub_tools(tmp_path, monkeypatch):
+    if os.name == "nt":
+        pytest.skip("stub tools are POSIX scripts")
+    folder = tmp_path / "bin"
+    folder.mkdir()
+    _write_tool(folder, "ffmpeg", STUB_FFMPEG)
+    _write_tool(folder, "ffprobe", STUB_FFPROBE)
+    log = tmp_path / "ffmpeg.log"
+    monkeypatch.setenv("PATH", str(folder) + os.pathsep + os.environ.get("PATH", ""))
+    monkeypatch.setenv("STUB_LOG", str(log))
+    engine.PROBE.reset_tool()
+    yield log
+    engine.PROBE.reset_tool()
+
+
+@pytest.fixture
+def media(tmp_path):
+    folder = tmp_path / "in"
+    folder.mkdir()
+
+    def make(name, data=b"source audio"):
+        path = folder / name
+        path.write_bytes(data)
+        return str(path)
+
+    return make
@@ -0,0 +1,61 @@
+import os
+import time
+
+import cache
+
+
+def test_content_key_changes_with_an_in_place_edit(tmp_path):
+    path = tmp_path / "master.wav"
+    data = bytearray(b"\0" * 512 * 1024)
+    path.write_bytes(bytes(data))
+    before = cache.content_key(str(path))
+    # same length, change outside the sampled blocks
+    data[200 * 1024] = 1
+    path.write_bytes(bytes(data))
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    assert cache.content_key(str(path)) != before
+
+
+def test_content_key_survives_a_rename(tmp_path):
+    path = tmp_path / "a.flac"
+    path.write_bytes(b"audio")
+    before = cache.content_key(str(path))
+    moved = tmp_path / "b.flac"
+    os.rename(path, moved)
+    assert cache.content_key(str(moved)) == before
+
+
+def test_store_keeps_the_last_value_across_loads(tmp_path):
+    path = str(tmp_path / "store.jsonl")
+    store = cache.JsonStore(path)
+    store.set("a", 1)
+    store.set("a", 2)
+    store.set("b", 3)
+    store.delete("b")
+    again = cache.JsonStore(path)
+    assert again.get("a") == 2
+    assert again.get("b") is None
+    assert len(again) == 1
+
+
+def test_store_is_compacted_on_load(tmp_path):
+    path = tmp_path / "store.jsonl"
+    # another process kept overwriting one key
+    path.write_text("".join(f'{{"k": "a", "v": {n}}}\n' for n in range(500)), encoding="utf-8")
+    store = cache.JsonStore(str(path))
+    assert store.get("a") == 499
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_store_drops_the_oldest_entries_past_its_limit(tmp_path, monkeypatch):
+    path = str(tmp_path / "store.jsonl")
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(cache.time, "time", lambda: next(clock))
+    store = cache.JsonStore(path, max_entries=3)
+    for key in "abcd":
+        store.set(key, key.upper())
+    store.set("a", "A2")
+    for kept in (store, cache.JsonStore(path, max_entries=3)):
+        assert len(kept) == 3
+        assert kept.get("b") is None
+        assert kept.get("a") == "A2"
@@ -0,0 +1,25 @@
+import os
+
+import cli
+
+
+def test_relative_input_is_converted_next_to_itself(stub_tools, media, monkeypatch):
+    path = media("a.flac")
+    monkeypatch.chdir(os.path.dirname(path))
+    assert cli.main(["convert", "-f", "mp3", "a.flac"]) == 0
+    assert os.path.isfile(os.path.join(os.path.dirname(path), "a.mp3"))
+
+
+def test_dry_run_prints_absolute_paths(media, monkeypatch, capsys):
+    path = media("a.flac")
+    monkeypatch.chdir(os.path.dirname(path))
+    assert cli.main(["convert", "--dry-run", "-f", "mp3", "a.flac"]) == 0
+    out = capsys.readouterr().out.strip()
+    assert out.startswith("ffmpeg ")
+    assert out.endswith(os.path.join(os.path.dirname(path), "a.mp3"))
+
+
+def test_bad_region_list_stops_before_converting(media, capsys):
+    path = media("a.flac")
+    assert cli.main(["convert", "--dry-run", "--regions", "0:30-0:10", path]) == 2
+    assert "区間リストを読めません" in capsys.readouterr().err
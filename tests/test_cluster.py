@@ -0,0 +1,75 @@
+import os
+import threading
+
+import cluster
+import engine
+from engine import Settings
+
+
+def _coordinator(paths, **kwargs):
+    settings = Settings(formats=("wav",))
+    kwargs.setdefault("log", lambda line: None)
+    return cluster.Coordinator(settings, engine.plan_batch(settings, paths), metrics_log=False, **kwargs)
+
+
+def test_batch_runs_on_several_local_workers(stub_tools, media):
+    paths = [media(f"{n}.flac") for n in range(6)]
+    coordinator = _coordinator(paths, lease=10.0)
+    host, port = coordinator.serve(port=0)[:2]
+    workers = [
+        cluster.Worker(f"http://{host}:{port}", log=lambda line: None, name=f"node-{n}") for n in range(3)
+    ]
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in threads:
+        thread.start()
+    result = coordinator.run()
+    for thread in threads:
+        thread.join(30)
+    assert (result.total, result.failures) == (6, 0)
+    assert all(os.path.exists(path[: -len(".flac")] + ".wav") for path in paths)
+    assert sum(len(worker.results) for worker in workers) == 6
+    assert all(worker.lease_seconds == 10.0 for worker in workers)
+
+
+def test_expired_leases_are_retried_then_failed(media):
+    coordinator = _coordinator([media("a.flac")], lease=1.0, attempts=2)
+    coordinator._queue.append(1)
+    now = coordinator._checked
+    first = coordinator.lease("gone")
+    coordinator._expire(now + 2.0)
+    assert first["lease"] not in coordinator.leases
+    assert list(coordinator._queue) == [1]
+    coordinator.lease("gone")
+    coordinator._expire(now + 4.0)
+    assert coordinator.statuses == {1: "failed"}
+    assert coordinator._done.is_set()
+
+
+def test_a_stalled_coordinator_extends_leases_instead_of_expiring_them(media):
+    coordinator = _coordinator([media("a.flac")], lease=1.0)
+    coordinator._queue.append(1)
+    reply = coordinator.lease("node")
+    # the coordinator itself was stopped for a minute
+    later = coordinator._checked + 60.0
+    coordinator._expire(later)
+    assert reply["lease"] in coordinator.leases
+    assert coordinator.leases[reply["lease"]][2] == later + 1.0
+
+
+def test_paused_coordinator_hands_out_nothing(media):
+    control = engine.BatchControl()
+    coordinator = _coordinator([media("a.flac")], control=control)
+    coordinator._queue.append(1)
+    control.pause()
+    assert "job" not in coordinator.lease("node")
+    control.resume()
+    assert "job" in coordinator.lease("node")
+
+
+def test_worker_reports_cancelled_jobs_for_someone_else(media):
+    coordinator = _coordinator([media("a.flac")])
+    coordinator._queue.append(1)
+    reply = coordinator.lease("leaving")
+    coordinator.complete(reply["lease"], "cancelled")
+    assert list(coordinator._queue) == [1]
+    assert coordinator.attempts[1] == 0
@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import engine
+from engine import Settings
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="process groups are POSIX")
+
+
+def _sleeper():
+    return subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"], start_new_session=True)
+
+
+def _state(pid):
+    with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+        return f.read().rsplit(")", 1)[1].split()[0]
+
+
+def _wait_state(pid, states):
+    deadline = time.monotonic() + 5
+    while _state(pid) not in states:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_pause_stops_and_resume_continues_registered_processes():
+    control = engine.BatchControl()
+    proc = _sleeper()
+    try:
+        control.register("a.flac", proc)
+        control.pause()
+        assert control.paused
+        _wait_state(proc.pid, "T")
+        control.resume()
+        _wait_state(proc.pid, "SR")
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_processes_started_while_paused_are_stopped_at_once():
+    control = engine.BatchControl()
+    control.pause()
+    proc = _sleeper()
+    try:
+        control.register("a.flac", proc)
+        _wait_state(proc.pid, "T")
+    finally:
+        control.resume()
+        proc.kill()
+        proc.wait()
+
+
+def test_cancel_single_inputs():
+    control = engine.BatchControl()
+    first, second = _sleeper(), _sleeper()
+    try:
+        control.register("a.flac", first)
+        control.register("b.flac", second)
+        control.cancel(["a.flac"])
+        assert first.wait(10) is not None
+        assert second.poll() is None
+        assert control.is_cancelled("a.flac")
+        assert not control.is_cancelled("b.flac")
+        assert not control.cancel_requested.is_set()
+    finally:
+        second.kill()
+        second.wait()
+
+
+def test_cancel_all_also_ends_a_pause():
+    control = engine.BatchControl()
+    control.pause()
+    control.cancel(keep_journal=True)
+    assert not control.paused
+    assert control.keep_journal
+    proc = _sleeper()
+    control.register("late.flac", proc)
+    assert proc.wait(10) is not None
+
+
+def test_paused_batch_starts_nothing_until_resumed(stub_tools, media):
+    path = media("song.flac")
+    control = engine.BatchControl()
+    control.pause()
+    worker = threading.Thread(
+        target=engine.run_batch,
+        args=(Settings(formats=("wav",)), [path]),
+        kwargs={"log": lambda line: None, "control": control},
+    )
+    worker.start()
+    time.sleep(0.5)
+    assert not os.path.exists(stub_tools)
+    control.resume()
+    worker.join(30)
+    assert os.path.exists(path[: -len(".flac")] + ".wav")
+
+
+def test_cancel_of_an_input_does_not_carry_over_to_the_next_batch(stub_tools, media):
+    # a watch service keeps one control for every file that arrives
+    path = media("song.flac")
+    control = engine.BatchControl()
+    control.cancel([path])
+    runner = engine.BatchRunner(Settings(formats=("wav",)), log=lambda line: None, control=control)
+    runner.begin(job_count=1)
+    (job,) = engine.plan_batch(runner.settings, [path])
+    runner.add(job)
+    assert runner.run_job(job) == "done"
+    control.cancel([path])
+    result = engine.run_batch(Settings(formats=("mp3",)), [path], log=lambda line: None, control=control)
+    assert (result.failures, result.cancelled) == (0, 0)
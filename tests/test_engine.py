@@ -0,0 +1,173 @@
+import json
+import os
+
+import engine
+import tracks
+from engine import Output, Settings
+
+
+def _settings(**values):
+    values.setdefault("formats", ("mp3",))
+    values.setdefault("bitrate", "192k")
+    return Settings(**values)
+
+
+def _calls(log):
+    with open(log, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_plan_batch_names_outputs_next_to_input(media):
+    path = media("song.flac")
+    (job,) = engine.plan_batch(_settings(formats=("mp3", "opus")), [path])
+    assert job.output_paths == [path[: -len(".flac")] + ".mp3", path[: -len(".flac")] + ".opus"]
+    assert job.argv[0] == "ffmpeg"
+    assert job.argv[-1] == job.output_paths[-1]
+
+
+def test_plan_batch_custom_dir_and_template(media, tmp_path):
+    path = media("song.flac")
+    out = tmp_path / "out"
+    out.mkdir()
+    settings = _settings(output_mode="custom", out_dir=str(out), name_template="{n}-{name}")
+    jobs = engine.plan_batch(settings, [path], start=3)
+    assert jobs[0].output_path == str(out / "3-song.mp3")
+
+
+def test_plan_batch_never_targets_the_input(media):
+    path = media("master.wav")
+    (job,) = engine.plan_batch(_settings(formats=("wav",)), [path])
+    assert job.output_path == path[: -len(".wav")] + "_1.wav"
+    (job,) = engine.plan_batch(_settings(formats=("wav",), overwrite="skip"), [path])
+    assert not job.skip
+    assert job.output_path != path
+
+
+def test_plan_batch_overwrite_policies(media):
+    path = media("song.flac")
+    existing = path[: -len(".flac")] + ".mp3"
+    with open(existing, "wb") as f:
+        f.write(b"old")
+    (job,) = engine.plan_batch(_settings(overwrite="skip"), [path])
+    assert job.skip
+    (job,) = engine.plan_batch(_settings(overwrite="number"), [path])
+    assert job.output_path == path[: -len(".flac")] + "_1.mp3"
+    (job,) = engine.plan_batch(_settings(overwrite="overwrite"), [path])
+    assert job.output_path == existing
+
+
+def test_plan_batch_numbers_clashes_within_the_batch(media, tmp_path):
+    first = media("song.flac")
+    second = str(tmp_path / "song.wav")
+    with open(second, "wb") as f:
+        f.write(b"x")
+    settings = _settings(output_mode="custom", out_dir=os.path.dirname(first), overwrite="number")
+    jobs = engine.plan_batch(settings, [first, second])
+    assert len({job.output_path for job in jobs}) == 2
+
+
+def test_split_jobs_are_not_skipped_on_the_whole_file_name(media):
+    path = media("disc.flac")
+    with open(path[: -len(".flac")] + ".mp3", "wb") as f:
+        f.write(b"old")
+    settings = _settings(overwrite="skip", split_cue=True)
+    (job,) = engine.plan_batch(settings, [path])
+    assert not job.skip
+    assert engine.whole_outputs(settings, job) == ()
+
+
+def test_track_outputs_apply_the_policy_per_track(media):
+    path = media("live.flac")
+    with open(path[: -len(".flac")] + "_02.mp3", "wb") as f:
+        f.write(b"old")
+    settings = _settings(overwrite="skip", split_silence=True)
+    (job,) = engine.plan_batch(settings, [path])
+    groups = engine.track_outputs(settings, job, 3)
+    assert [len(group) for group in groups] == [1, 0, 1]
+    assert groups[0][0].path.endswith("live_01.mp3")
+
+
+def test_build_command_trim_seeks_on_the_input():
+    settings = _settings(trim_start=60.0, trim_end=90.0)
+    argv = engine.build_command(settings, "in.flac", (Output("mp3", "out.mp3"),))
+    assert argv[argv.index("-ss") + 1] == "59.5"
+    assert argv[argv.index("-t") + 1] == "30.5"
+    assert argv.index("-ss") < argv.index("-i")
+    assert "atrim=start=0.5:end=30.5" in argv[argv.index("-af") + 1]
+
+
+def test_build_command_filters_and_codec():
+    settings = _settings(loudnorm=True, loudnorm_target="-14", fade_in=2.0)
+    argv = engine.build_command(settings, "in.flac", (Output("mp3", "out.mp3"),))
+    chain = argv[argv.index("-af") + 1].split(",")
+    assert chain[0].startswith("loudnorm=I=-14")
+    assert chain[-1] == "afade=t=in:st=0:d=2.0"
+    assert argv[argv.index("-c:a") + 1] == "libmp3lame"
+    assert argv[argv.index("-b:a") + 1] == "192k"
+
+
+def test_build_command_several_formats_share_one_decode():
+    settings = _settings(formats=("mp3", "flac"), volume_db="3")
+    outputs = (Output("mp3", "out.mp3"), Output("flac", "out.flac"))
+    argv = engine.build_command(settings, "in.wav", outputs)
+    assert argv.count("-i") == 1
+    assert "asplit=2" in argv[argv.index("-filter_complex") + 1]
+    assert argv[-1] == "out.flac"
+
+
+def test_build_command_stream_copy():
+    argv = engine.build_command(_settings(), "in.mp3", (Output("mp3", "out.mp3"),), copy=("mp3",))
+    assert argv[argv.index("-c:a") + 1] == "copy"
+
+
+def test_track_command_cuts_clips_with_their_own_fades():
+    # with a region list the fades are per clip, so the decode can start late
+    settings = _settings(fade_in=0.5, regions="0:10-0:20; 0:40-0:45")
+    regions = (
+        tracks.Region(10.0, 20.0, (("title", "one"),), 0.5, 1.0),
+        tracks.Region(40.0, 45.0, (), 0.5, None),
+    )
+    groups = ((Output("mp3", "a.mp3"),), (Output("mp3", "b.mp3"),))
+    argv = engine.track_command(settings, "in.flac", regions, groups)
+    assert argv[argv.index("-ss") + 1] == "9.5"
+    graph = argv[argv.index("-filter_complex") + 1]
+    assert "[s1]atrim=start=0:end=10,asetpts=PTS-STARTPTS,afade=t=in:st=0:d=0.5,afade=t=out:st=9:d=1" in graph
+    assert "[s2]atrim=start=30:end=35" in graph
+    assert "title=one" in argv
+
+
+def test_run_batch_writes_outputs_through_temp_files(stub_tools, media):
+    path = media("master.wav", b"24-bit master")
+    logs = []
+    summary = engine.run_batch(_settings(formats=("wav",)), [path], log=logs.append)
+    out = path[: -len(".wav")] + "_1.wav"
+    with open(path, "rb") as f:
+        assert f.read() == b"24-bit master"
+    with open(out, "rb") as f:
+        assert f.read() == b"converted"
+    assert not [name for name in os.listdir(os.path.dirname(path)) if engine.is_temp_output(name)]
+    (argv,) = _calls(stub_tools)
+    assert engine.is_temp_output(argv[-1])
+    assert summary is not None
+
+
+def test_track_command_decodes_everything_under_a_whole_file_fade():
+    settings = _settings(fade_in=0.5, split_silence=True)
+    regions = (tracks.Region(10.0, 20.0), tracks.Region(20.0, None))
+    groups = ((), (Output("mp3", "b.mp3"),))
+    argv = engine.track_command(settings, "in.flac", regions, groups)
+    assert "-ss" not in argv
+    assert "[s2]atrim=start=20," in argv[argv.index("-filter_complex") + 1]
+
+
+def test_run_batch_splits_at_regions_in_one_run(stub_tools, media, monkeypatch):
+    monkeypatch.setenv("STUB_DURATION", "60.0")
+    path = media("show.flac")
+    settings = _settings(regions="0:01-0:02; 0:05-", fade_out=0.5)
+    engine.run_batch(settings, [path], log=lambda line: None)
+    folder = os.path.dirname(path)
+    assert sorted(name for name in os.listdir(folder) if name.endswith(".mp3")) == ["show_01.mp3", "show_02.mp3"]
+    calls = _calls(stub_tools)
+    assert len(calls) == 1
+    graph = calls[0][calls[0].index("-filter_complex") + 1]
+    assert "afade=t=out:st=0.5:d=0.5" in graph
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import cache
+import engine
+import journal
+from engine import Settings
+
+
+def _calls(log):
+    if not os.path.exists(log):
+        return []
+    with open(log, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _interrupted(settings, paths, done=()):
+    # a batch that crashed after finishing the jobs in `done`
+    jobs = engine.plan_batch(settings, paths)
+    batch = journal.Journal.create()
+    batch.begin(settings, jobs)
+    for job in jobs:
+        if job.index in done:
+            for path in job.output_paths:
+                with open(path, "wb") as f:
+                    f.write(b"converted")
+            batch.job_state(job.index, "done", [cache.output_record(path) for path in job.output_paths])
+    batch.close()
+    return jobs
+
+
+def test_finished_batches_leave_no_journal(stub_tools, media):
+    batch = journal.Journal.create()
+    engine.run_batch(Settings(formats=("wav",)), [media("a.flac")], log=lambda line: None, batch_journal=batch)
+    assert not os.path.exists(batch.path)
+    assert journal.pending() == []
+
+
+def test_resume_reruns_only_unfinished_jobs(stub_tools, media):
+    settings = Settings(formats=("wav",))
+    jobs = _interrupted(settings, [media("a.flac"), media("b.flac")], done={1})
+    (state,) = journal.pending()
+    assert [job.index for job in state.remaining()] == [2]
+    assert state.settings == settings
+    result = engine.resume_batch(state, log=lambda line: None)
+    assert (result.total, result.failures) == (1, 0)
+    (argv,) = _calls(stub_tools)
+    assert jobs[1].input_path in argv
+    assert journal.pending() == []
+
+
+def test_outputs_changed_since_completion_are_redone(media):
+    settings = Settings(formats=("wav",))
+    jobs = _interrupted(settings, [media("a.flac")], done={1})
+    with open(jobs[0].output_path, "ab") as f:
+        f.write(b"edited")
+    (state,) = journal.pending()
+    assert state.remaining() == [state.jobs[0]]
+
+
+def test_a_torn_last_line_is_ignored(media):
+    _interrupted(Settings(formats=("wav",)), [media("a.flac"), media("b.flac")], done={1})
+    (state,) = journal.pending()
+    with open(state.path, "a", encoding="utf-8") as f:
+        f.write('{"t": "state", "i": 2, "s": "do')
+    (state,) = journal.pending()
+    assert [job.index for job in state.remaining()] == [2]
+
+
+def test_batches_of_live_processes_are_not_offered(media):
+    _interrupted(Settings(formats=("wav",)), [media("a.flac")])
+    (state,) = journal.pending()
+    owner = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        with open(state.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"t": "resume", "pid": owner.pid}) + "\n")
+        assert journal.pending() == []
+    finally:
+        owner.kill()
+        owner.wait()
+
+
+def test_jobs_round_trip_through_the_journal(media):
+    settings = Settings(formats=("mp3", "opus"), bitrate="192k")
+    (job,) = engine.plan_batch(settings, [media("a.flac")])
+    decoded = journal.decode_job(settings, json.loads(json.dumps(journal.encode_job(job))))
+    assert decoded.outputs == job.outputs
+    assert decoded.argv == job.argv
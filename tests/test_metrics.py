@@ -0,0 +1,81 @@
+import json
+
+import cli
+import engine
+import metrics
+from engine import Settings
+
+
+def _record(**values):
+    record = {"formats": ["mp3"], "options": "-", "status": "done", "wall": 1.0, "duration": 10.0}
+    record.update(values)
+    return record
+
+
+def test_batches_write_one_record_per_job(stub_tools, media, tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    paths = [media("a.flac"), media("b.flac")]
+    engine.run_batch(Settings(formats=("wav",)), paths, log=lambda line: None, metrics_log=metrics.MetricsLog(path))
+    records = metrics.load(path)
+    assert sorted(record["input"] for record in records) == sorted(paths)
+    assert {record["status"] for record in records} == {"done"}
+    assert len({record["batch"] for record in records}) == 1
+    assert all(record["formats"] == ["wav"] and record["wall"] >= 0 for record in records)
+
+
+def test_option_key_leaves_out_defaults_and_placement():
+    settings = Settings(formats=("mp3",), out_dir="/x", overwrite="skip", loudnorm=True, sample_rate="48000")
+    assert metrics.options_key(settings) == "sample_rate=48000,loudnorm"
+    assert metrics.options_key(Settings()) == "-"
+
+
+def test_load_skips_torn_lines_and_filters_by_date(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    lines = [json.dumps({"time": "2024-01-01T00:00:00"}), json.dumps({"time": "2024-02-01T00:00:00"}), '{"time": "20']
+    path.write_text("\n".join(lines), encoding="utf-8")
+    assert len(metrics.load(str(path))) == 2
+    assert metrics.load(str(path), since="2024-01-15") == [{"time": "2024-02-01T00:00:00"}]
+
+
+def test_percentile_interpolates():
+    assert metrics.percentile([], 50) is None
+    assert metrics.percentile([4.0, 1.0, 2.0, 3.0], 50) == 2.5
+    assert metrics.percentile([1.0, 2.0], 99) == 1.99
+
+
+def test_summary_per_format():
+    records = [
+        _record(wall=1.0, input_bytes=1048576, cpu_user=1.5, cpu_system=0.5),
+        _record(wall=3.0, input_bytes=1048576, cpu_user=3.0, cpu_system=1.0),
+        _record(status="failed", wall=0.5),
+        _record(formats=["opus"], status="cached"),
+    ]
+    rows = {row["group"]: row for row in metrics.summarize(records)}
+    mp3 = rows["mp3"]
+    assert (mp3["jobs"], mp3["done"], mp3["failed"]) == (3, 2, 1)
+    assert mp3["realtime"] == 5.0
+    assert mp3["input_mb_s"] == 0.5
+    assert mp3["cpu_per_audio_s"] == 0.3
+    assert (rows["opus"]["skipped"], rows["opus"]["realtime"]) == (1, None)
+
+
+def test_table_lines_up_wide_characters():
+    rows = metrics.summarize([_record(options="ラウドネス"), _record(options="x", wall=None)], by="options")
+    header, *body = metrics.format_table(rows).splitlines()
+    # the second column starts at the same display column on every line
+    starts = {metrics._width(header[: header.index("件数")])}
+    for row, line in zip(rows, body):
+        rest = line[len(row["group"]) :]
+        starts.add(metrics._width(row["group"]) + len(rest) - len(rest.lstrip(" ")))
+    assert len(starts) == 1
+    assert " - " in body[-1]
+
+
+def test_report_command(tmp_path, capsys):
+    path = tmp_path / "metrics.jsonl"
+    records = [_record(batch="one"), _record(batch="two", formats=["opus"])]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+    assert cli.main(["report", "--metrics", str(path), "--batch", "two", "--json"]) == 0
+    (row,) = json.loads(capsys.readouterr().out)
+    assert row["group"] == "opus"
+    assert cli.main(["report", "--metrics", str(tmp_path / "none.jsonl")]) == 1
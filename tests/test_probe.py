@@ -0,0 +1,88 @@
+import json
+import os
+
+import pytest
+
+import cache
+import probe
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="the ffprobe stand-in is a shell script")
+
+
+class _Calls:
+    # an ffprobe that counts its runs
+    def __init__(self, tmp_path):
+        self.log = tmp_path / "ffprobe.log"
+        self.tool = str(tmp_path / "ffprobe")
+        with open(self.tool, "w", encoding="utf-8") as f:
+            f.write(
+                "#!/bin/sh\n"
+                f'echo "$@" >> "{self.log}"\n'
+                """echo '{"format": {"duration": "12.5"}, "streams": [{"codec_type": "audio", "codec_name": "flac"}]}'\n"""
+            )
+        os.chmod(self.tool, 0o755)
+
+    @property
+    def count(self):
+        return len(self.log.read_text(encoding="utf-8").splitlines()) if self.log.exists() else 0
+
+
+def _service(calls):
+    return probe.ProbeService(lambda: calls.tool)
+
+
+def test_probe_results_are_memoized(tmp_path, media):
+    calls = _Calls(tmp_path)
+    path = media("a.flac")
+    service = _service(calls)
+    assert service.get(path).duration == 12.5
+    assert service.get(path).codec_name == "flac"
+    assert calls.count == 1
+    assert service.peek(path) is not None
+
+
+def test_probe_results_persist_across_processes(tmp_path, media, cache_dir):
+    calls = _Calls(tmp_path)
+    path = media("a.flac")
+    _service(calls).get(path)
+    # a new process: empty LRU, the same store on disk
+    cache._stores.clear()
+    info = _service(calls).get(path)
+    assert info.duration == 12.5
+    assert calls.count == 1
+    (line,) = (cache_dir / probe.PROBE_CACHE).read_text(encoding="utf-8").splitlines()
+    assert "filename" not in json.loads(line)["v"]["format"]
+
+
+def test_edited_inputs_are_probed_again(tmp_path, media):
+    calls = _Calls(tmp_path)
+    path = media("a.flac")
+    service = _service(calls)
+    service.get(path)
+    with open(path, "ab") as f:
+        f.write(b"more")
+    service.get(path)
+    assert calls.count == 2
+
+
+def test_lru_keeps_the_most_recently_used(tmp_path, media, monkeypatch):
+    monkeypatch.setattr(probe, "LRU_SIZE", 2)
+    calls = _Calls(tmp_path)
+    first, second, third = media("1.flac"), media("2.flac"), media("3.flac")
+    service = _service(calls)
+    service.get(first)
+    service.get(second)
+    service.get(first)
+    service.get(third)
+    assert service.peek(first) is not None
+    assert service.peek(second) is None
+    assert service.peek(third) is not None
+
+
+def test_prefetch_probes_in_the_background(tmp_path, media):
+    calls = _Calls(tmp_path)
+    paths = [media(f"{n}.flac") for n in range(3)]
+    service = _service(calls)
+    futures = service.prefetch(paths)
+    assert [future.result(10).duration for future in futures] == [12.5] * 3
+    assert all(service.peek(path) for path in paths)
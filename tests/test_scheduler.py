@@ -0,0 +1,140 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import scheduler
+
+HYBRID_CGROUP = """12:cpuset:/
+11:memory:/user.slice
+2:cpu,cpuacct:/user.slice
+1:name=systemd:/user.slice/session-1.scope
+0::/user.slice/session-1.scope
+"""
+
+
+@pytest.fixture
+def files(monkeypatch):
+    contents = {}
+
+    def lines(path):
+        return contents.get(path, "").splitlines()
+
+    def first_line(path):
+        return (lines(path) or [""])[0].strip()
+
+    monkeypatch.setattr(scheduler, "_read_lines", lines)
+    monkeypatch.setattr(scheduler, "_read_first_line", first_line)
+    return contents
+
+
+def test_cgroup_v2_path_is_found_below_the_v1_lines(files):
+    files["/proc/self/cgroup"] = HYBRID_CGROUP
+    files["/sys/fs/cgroup/user.slice/session-1.scope/cpu.max"] = "150000 100000\n"
+    assert scheduler._cgroup_v2_path() == "/user.slice/session-1.scope"
+    assert scheduler.cgroup_cpu_quota() == 1.5
+
+
+def test_cgroup_v1_quota(files):
+    files["/proc/self/cgroup"] = "2:cpu,cpuacct:/\n"
+    files["/sys/fs/cgroup/cpu/cpu.cfs_quota_us"] = "200000"
+    files["/sys/fs/cgroup/cpu/cpu.cfs_period_us"] = "100000"
+    assert scheduler.cgroup_cpu_quota() == 2.0
+
+
+def test_unlimited_cgroup_has_no_quota(files):
+    files["/proc/self/cgroup"] = "0::/\n"
+    files["/sys/fs/cgroup/cpu.max"] = "max 100000"
+    assert scheduler.cgroup_cpu_quota() is None
+
+
+def test_quota_caps_usable_cores(files, monkeypatch):
+    monkeypatch.setattr(scheduler.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    files["/sys/fs/cgroup/cpu.max"] = "250000 100000"
+    assert scheduler.usable_cpu_count() == 2
+
+
+def test_estimate_cost_adds_codecs_filters_and_soxr():
+    assert scheduler.estimate_cost("pcm_s16le", []) == pytest.approx(0.3)
+    cost = scheduler.estimate_cost(["libmp3lame", "flac"], ["loudnorm=I=-16", "volume=3dB"], "soxr")
+    assert cost == pytest.approx(0.2 + 0.8 + 0.3 + 2.0 + 0.05 + 0.6)
+
+
+def test_io_bound_batches_use_few_workers():
+    layout = scheduler.plan_layout(100, scheduler.estimate_cost("pcm_s16le", []), cores=16)
+    assert layout.workers == scheduler.IO_BOUND_WORKERS
+    assert layout.threads == 1
+
+
+def test_cpu_bound_batches_use_every_core():
+    layout = scheduler.plan_layout(100, scheduler.estimate_cost("libopus", []), cores=16)
+    assert (layout.workers, layout.threads) == (16, 1)
+
+
+def test_threads_follow_the_cost_of_a_job():
+    light = scheduler.plan_layout(2, scheduler.estimate_cost("libopus", []), cores=16)
+    heavy = scheduler.plan_layout(2, scheduler.estimate_cost(["libopus", "aac"], ["loudnorm"]), cores=16)
+    assert light.workers == heavy.workers == 2
+    assert light.threads == 2
+    assert heavy.threads == 5
+
+
+def test_fixed_parallelism_is_kept():
+    layout = scheduler.plan_layout(10, 1.0, parallel=3, cores=4)
+    assert (layout.workers, layout.threads, layout.auto) == (3, 1, False)
+
+
+def _child():
+    return subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+
+
+@pytest.mark.skipif(not hasattr(scheduler.os, "getpriority"), reason="POSIX priorities")
+def test_low_priority_is_applied_to_a_running_child():
+    proc = _child()
+    try:
+        scheduler.apply_priority(proc.pid, "low")
+        assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 10
+        # never raised back
+        scheduler.apply_priority(proc.pid, "low")
+        assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 10
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+@pytest.mark.skipif(not hasattr(scheduler.os, "SCHED_IDLE"), reason="Linux scheduler classes")
+def test_idle_priority_uses_the_idle_class():
+    proc = _child()
+    try:
+        scheduler.apply_priority(proc.pid, "idle")
+        assert os.sched_getscheduler(proc.pid) == os.SCHED_IDLE
+        assert os.getpriority(os.PRIO_PROCESS, proc.pid) == 19
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+@pytest.mark.skipif(not hasattr(scheduler.os, "sched_setaffinity"), reason="CPU affinity")
+def test_cpu_share_pins_a_child_to_the_last_cpus(monkeypatch):
+    cpus = sorted(os.sched_getaffinity(0))
+    monkeypatch.setattr(scheduler, "usable_cpu_count", lambda: len(cpus))
+    expected = frozenset(cpus[-max(1, len(cpus) // 2) :])
+    assert scheduler.share_cpus(50) == expected
+    proc = _child()
+    try:
+        scheduler.apply_priority(proc.pid, None, 50)
+        assert os.sched_getaffinity(proc.pid) == expected
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_no_share_means_no_cap():
+    assert scheduler.share_cores(0) is None
+    assert scheduler.share_cores(100) is None
+    assert scheduler.share_cpus(100) is None
+
+
+def test_priority_description():
+    assert scheduler.describe_priority("idle") == "優先度: アイドル (nice 19, I/O idle)"
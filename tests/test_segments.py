@@ -0,0 +1,38 @@
+import probe
+import segments
+from engine import Settings
+
+
+def _media(codec="flac", duration=3600.5):
+    stream = {"codec_type": "audio", "codec_name": codec, "sample_rate": "44100"}
+    return probe.MediaInfo("long.flac", {"duration": str(duration)}, (stream,))
+
+
+def test_only_splicing_outputs_are_segmented():
+    assert segments.join_mode(Settings(formats=("wav",))) == "pcm"
+    assert segments.join_mode(Settings(formats=("aac",))) == "adts"
+    assert segments.join_mode(Settings(formats=("aac",), aac_profile="HE")) is None
+    assert segments.refusal(Settings(formats=("mp3",)), _media())
+    assert segments.refusal(Settings(formats=("wav", "mp3")), _media())
+    assert segments.refusal(Settings(formats=("wav",)), _media()) is None
+    assert segments.refusal(Settings(formats=("wav",)), _media("mp3"))
+
+
+def test_last_piece_runs_to_the_end():
+    settings = Settings(formats=("wav",))
+    plan = segments.plan_segments(settings, _media(), 4)
+    assert len(plan.segments) == 4
+    assert plan.segments[0].start == 0 and plan.last.end == plan.total
+    for segment in plan.segments:
+        filters = ",".join(segments.segment_filters(settings, plan, segment))
+        assert ("end_pts=" in filters) == (segment is not plan.last)
+
+
+def test_aac_cuts_fall_on_frame_boundaries():
+    plan = segments.plan_segments(Settings(formats=("aac",)), _media(), 4)
+    assert all(segment.start % segments.AAC_FRAME == 0 for segment in plan.segments)
+    assert plan.segments[1].lead == segments.AAC_OVERLAP_FRAMES * segments.AAC_FRAME
+
+
+def test_short_inputs_are_not_split():
+    assert segments.plan_segments(Settings(formats=("wav",)), _media(duration=300.0), 4) is None
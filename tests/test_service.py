@@ -0,0 +1,74 @@
+import http.client
+import json
+
+import pytest
+
+import engine
+import service
+
+
+def test_empty_str_settings_stay_strings():
+    settings = service.settings_from_query("format=mp3&bitrate=&bitrate_value=&loudnorm=1&loudnorm_target=")
+    assert settings.bitrate == ""
+    assert settings.loudnorm_target == ""
+    argv = engine.build_command(settings, "in.wav", "out.mp3")
+    assert "loudnorm=I=-16:TP=-1.5:LRA=11" in argv
+
+
+def test_empty_optional_settings_are_unset():
+    settings = service.settings_from_query("format=mp3&trim_start=&sample_rate=")
+    assert settings.trim_start is None
+    assert settings.sample_rate is None
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "format=mp3&split_cue=1",
+        "format=mp3&regions=0-1",
+        "format=xyz",
+        "format=m4a&aac_profile=XX",
+        "format=mp3&overwrite=clobber",
+        "format=mp3&trim_start=inf",
+        "format=mp3&fade_in=nan",
+    ],
+)
+def test_rejected_settings(query):
+    with pytest.raises(service.RequestError) as info:
+        service.settings_from_query(query)
+    assert info.value.code == 400
+
+
+def test_free_slot_is_taken_without_a_queue():
+    server = service.ConversionService(jobs=1, queue=0, queue_timeout=0.05, metrics_log=False)
+    assert server.acquire()
+    assert not server.acquire()
+    server.release()
+    assert server.acquire()
+
+
+def test_known_choices_are_accepted():
+    settings = service.settings_from_query("format=m4a&aac_profile=HE&channels=1")
+    assert settings.aac_profile == "HE"
+    assert "aac_he" in engine.build_command(settings, "in.wav", "out.m4a")
+
+
+def test_unexpected_errors_answer_500(monkeypatch):
+    server = service.ConversionService(jobs=1, queue=1, queue_timeout=5, log=lambda line: None, metrics_log=False)
+
+    def broken(handler, settings, chunks):
+        raise RuntimeError("bug")
+
+    monkeypatch.setattr(server, "convert", broken)
+    host, port = server.serve(port=0)
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        conn.request("POST", "/convert?format=mp3", body=b"data")
+        response = conn.getresponse()
+        assert response.status == 500
+        assert json.loads(response.read())["error"]
+        conn.close()
+        # the slot goes back (right after the answer)
+        assert server.acquire()
+    finally:
+        server.shutdown()
@@ -0,0 +1,60 @@
+import os
+import time
+
+import engine
+import watch
+from engine import Settings
+
+
+def _stale_temp(folder, name="song"):
+    path = os.path.join(folder, f".{name}.acvtmp-{engine.TEMP_HOST}-999999999.mp3")
+    with open(path, "wb") as f:
+        f.write(b"partial")
+    return path
+
+
+def test_temp_outputs_carry_the_host(tmp_path):
+    temp = engine.temp_output_path(str(tmp_path / "song.mp3"))
+    name = os.path.basename(temp)
+    assert engine.is_temp_output(name)
+    assert f"{engine.TEMP_HOST}-{os.getpid()}" in name
+
+
+def test_sweep_keeps_other_hosts_in_flight_temps(tmp_path):
+    names = {
+        "stale_local": f".a.acvtmp-{engine.TEMP_HOST}-999999999.mp3",
+        "own": f".b.acvtmp-{engine.TEMP_HOST}-{os.getpid()}.mp3",
+        "remote": ".c.acvtmp-otherbox-1.mp3",
+        "old_remote": ".d.acvtmp-other-box-2.mp3",
+    }
+    for name in names.values():
+        (tmp_path / name).write_bytes(b"x")
+    old = time.time() - engine.TEMP_MAX_AGE - 60
+    os.utime(tmp_path / names["old_remote"], (old, old))
+    removed = {os.path.basename(path) for path in engine.sweep_temp_outputs(str(tmp_path))}
+    assert removed == {names["stale_local"], names["old_remote"]}
+
+
+def test_batch_start_sweeps_the_output_roots(stub_tools, media, tmp_path):
+    path = media("song.flac")
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "song.mp3").write_bytes(b"done before")
+    stale = _stale_temp(str(out), "other")
+    settings = Settings(formats=("mp3",), output_mode="custom", out_dir=str(out), overwrite="skip")
+    logs = []
+    result = engine.run_batch(settings, [path], log=logs.append)
+    # nothing was converted into the folder, it was swept anyway
+    assert result.skipped == 1
+    assert not os.path.exists(stale)
+    assert any("一時ファイル" in str(line) for line in logs)
+
+
+def test_watch_start_sweeps_the_watched_folders(tmp_path):
+    folder = tmp_path / "inbox"
+    folder.mkdir()
+    stale = _stale_temp(str(folder))
+    service = watch.WatchService(Settings(formats=("mp3",)), [str(folder)], log=lambda line: None, poll=True)
+    service.start()
+    service.stop()
+    assert not os.path.exists(stale)
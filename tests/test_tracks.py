@@ -0,0 +1,62 @@
+import pytest
+
+import tracks
+
+
+def test_silence_cuts_keep_tracks_long_enough():
+    silences = [[0.0, 1.0], [100.0, 104.0], [130.0, 132.0], [300.0, 302.0]]
+    assert tracks.silence_cuts(silences, 400.0, 60.0) == [102.0, 301.0]
+    # the last track would be shorter than the minimum
+    assert tracks.silence_cuts(silences, 360.0, 60.0) == [102.0]
+
+
+def test_cue_sheet(tmp_path):
+    sheet = tmp_path / "disc.cue"
+    sheet.write_bytes(
+        "\n".join(
+            [
+                'PERFORMER "アーティスト"',
+                'TITLE "アルバム"',
+                'FILE "disc.wav" WAVE',
+                "  TRACK 01 AUDIO",
+                '    TITLE "一曲目"',
+                "    INDEX 01 00:00:00",
+                "  TRACK 02 AUDIO",
+                '    TITLE "二曲目"',
+                "    INDEX 00 04:10:00",
+                "    INDEX 01 04:12:37",
+            ]
+        ).encode("cp932")
+    )
+    (tmp_path / "disc.flac").write_bytes(b"x")
+    found = tracks.find_cue(str(tmp_path / "disc.flac"))
+    assert found is not None
+    regions = tracks.cue_regions(found, str(tmp_path / "disc.flac"))
+    assert [region.start for region in regions] == [0.0, 252 + 37 / 75]
+    assert regions[0].end == regions[1].start
+    assert ("title", "二曲目") in regions[1].tags
+    assert ("album", "アルバム") in regions[1].tags
+
+
+def test_typed_region_list():
+    clips = tracks.parse_clip_list("0:10-0:25; 1:30-2:00, 1:00:00-")
+    assert [(clip.start, clip.end) for clip in clips] == [(10, 25), (90, 120), (3600, None)]
+    with pytest.raises(ValueError):
+        tracks.parse_clip_list("0:30-0:10")
+    with pytest.raises(ValueError):
+        tracks.parse_clip_list("abc")
+
+
+def test_region_file_with_header_and_files(tmp_path):
+    listing = tmp_path / "clips.csv"
+    listing.write_text("file,start,end,title,fade_out\na.wav,1,2,one,0.5\nb.wav,3,4,two,\n", encoding="utf-8")
+    clips = tracks.parse_clip_file(str(listing))
+    regions = tracks.clip_regions(clips, "/x/a.flac", fade_out=1.0)
+    assert [(region.start, region.end, region.fade_out) for region in regions] == [(1.0, 2.0, 0.5)]
+
+
+def test_audacity_labels(tmp_path):
+    listing = tmp_path / "labels.txt"
+    listing.write_text("12.5\t20\tlabel one\n30\t41.25\tlabel two\n", encoding="utf-8")
+    regions = tracks.clip_regions(tracks.parse_clip_file(str(listing)), "a.wav", offset=10.0, length=25.0)
+    assert [(region.start, region.end) for region in regions] == [(2.5, 10.0), (20.0, 25.0)]
@@ -0,0 +1,94 @@
+import os
+import queue
+import time
+
+import pytest
+
+import watch
+from engine import Settings
+
+
+def _watch(folder, **kwargs):
+    found = queue.Queue()
+    watcher = watch.FolderWatcher([str(folder)], found.put, interval=0.05, settle=0.1, log=lambda line: None, **kwargs)
+    watcher.start()
+    # let the watches be added before anything is written
+    time.sleep(0.3)
+    return watcher, found
+
+
+def _reported(found, expected=1, timeout=5.0):
+    # what arrives until the expected reports are in, and a little after
+    paths = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            paths.append(found.get(timeout=0.3 if len(paths) >= expected else 0.05))
+        except queue.Empty:
+            if len(paths) >= expected:
+                break
+    return paths
+
+
+@pytest.fixture(params=["inotify", "poll"])
+def backend(request):
+    if request.param == "inotify" and watch._load_inotify() is None:
+        pytest.skip("inotify is Linux only")
+    return request.param
+
+
+def test_finished_media_files_are_reported_once(tmp_path, backend):
+    watcher, found = _watch(tmp_path, poll=backend == "poll")
+    try:
+        assert watcher.backend == backend
+        (tmp_path / "song.flac").write_bytes(b"audio")
+        (tmp_path / "notes.txt").write_bytes(b"text")
+        (tmp_path / "upload.flac.part").write_bytes(b"half")
+        (tmp_path / ".song.acvtmp-host-1.mp3").write_bytes(b"ours")
+        assert _reported(found) == [str(tmp_path / "song.flac")]
+    finally:
+        watcher.stop()
+
+
+def test_files_moved_in_are_reported(tmp_path, backend):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    staged = tmp_path / "take.wav"
+    staged.write_bytes(b"audio")
+    watcher, found = _watch(inbox, poll=backend == "poll")
+    try:
+        os.rename(staged, inbox / "take.wav")
+        assert _reported(found) == [str(inbox / "take.wav")]
+    finally:
+        watcher.stop()
+
+
+def test_new_subfolders_are_watched_when_recursive(tmp_path, backend):
+    watcher, found = _watch(tmp_path, poll=backend == "poll", recursive=True)
+    try:
+        sub = tmp_path / "album"
+        sub.mkdir()
+        time.sleep(0.2)
+        (sub / "01.flac").write_bytes(b"audio")
+        assert _reported(found) == [str(sub / "01.flac")]
+    finally:
+        watcher.stop()
+
+
+def test_service_converts_new_files_but_not_its_own_outputs(stub_tools, tmp_path):
+    folder = tmp_path / "inbox"
+    folder.mkdir()
+    service = watch.WatchService(Settings(formats=("wav",)), [str(folder)], log=lambda line: None)
+    service.start()
+    try:
+        time.sleep(0.3)
+        (folder / "song.flac").write_bytes(b"audio")
+        deadline = time.monotonic() + 10
+        while not service.results and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # the .wav it wrote is media too, and must not come back as an input
+        time.sleep(0.5)
+    finally:
+        service.stop()
+    assert service.results == ["done"]
+    assert (folder / "song.wav").read_bytes() == b"converted"
@@ -0,0 +1,377 @@
+import csv
+import os
+import re
+from dataclasses import dataclass
+
+SILENCE_NOISE = "-50dB"
+SILENCE_START = re.compile(r"silence_start:\s*(-?[\d.]+)")
+SILENCE_END = re.compile(r"silence_end:\s*(-?[\d.]+)")
+CUE_FRAMES = 75
+# sheets and lists from Japanese tools are usually Shift_JIS; latin-1 never fails
+TEXT_ENCODINGS = ("utf-8-sig", "cp932", "latin-1")
+CUE_TIME = re.compile(r"^(\d+):(\d{1,2}):(\d{1,2})$")
+# sheet-level REM comments that map onto tags
+CUE_REM_TAGS = {"DATE": "date", "GENRE": "genre", "COMMENT": "comment"}
+# columns of a region list without a header row (also Audacity's label export)
+CLIP_COLUMNS = ("start", "end", "title", "fade_in", "fade_out")
+CLIP_HEADERS = {"label": "title", "name": "title", "in": "start", "out": "end"}
+
+
+@dataclass(frozen=True)
+class Region:
+    # seconds on the processed timeline (after the trim window)
+    start: float
+    # None = up to the end of the audio
+    end: float | None = None
+    # (key, value) pairs written as -metadata on this track's outputs
+    tags: tuple = ()
+    # fades of this track alone (extracted clips)
+    fade_in: float | None = None
+    fade_out: float | None = None
+
+
+class SilenceLog:
+    # Collects silencedetect's report from ffmpeg's stderr as it is printed,
+    # so a long recording never needs its whole log kept around.
+    def __init__(self):
+        self.silences = []
+        self._start = None
+
+    def feed(self, line):
+        match = SILENCE_START.search(line)
+        if match:
+            self._start = max(float(match.group(1)), 0.0)
+            return
+        match = SILENCE_END.search(line)
+        if match and self._start is not None:
+            self.silences.append([self._start, float(match.group(1))])
+            self._start = None
+
+
+def silence_cuts(silences, duration, min_length):
+    # Cut in the middle of each gap, but only where the tracks on both sides
+    # stay at least min_length long; leading/trailing silence and short
+    # pauses inside a track fall out of that rule.
+    cuts = []
+    last = 0.0
+    for start, end in silences:
+        point = (start + end) / 2.0
+        if point - last < min_length:
+            continue
+        if duration is not None and duration - point < min_length:
+            break
+        cuts.append(point)
+        last = point
+    return cuts
+
+
+def regions_from_cuts(cuts):
+    edges = [0.0, *cuts]
+    return tuple(
+        Region(start, edges[i + 1] if i + 1 < len(edges) else None) for i, start in enumerate(edges)
+    )
+
+
+@dataclass(frozen=True)
+class CueTrack:
+    file: str
+    # INDEX 01 in seconds
+    start: float
+    title: str = ""
+    performer: str = ""
+
+
+@dataclass(frozen=True)
+class CueSheet:
+    path: str
+    files: tuple
+    tracks: tuple
+    title: str = ""
+    performer: str = ""
+    # extra sheet-level tags from REM lines
+    tags: tuple = ()
+
+    def tracks_for(self, audio_path):
+        # FILE often still names the original rip (image.wav) after the
+        # image was converted (image.flac), so a matching stem is enough
+        name = os.path.basename(audio_path).lower()
+        stem = os.path.splitext(name)[0]
+        matched = [
+            track
+            for track in self.tracks
+            if os.path.basename(track.file).lower() == name
+            or os.path.splitext(os.path.basename(track.file).lower())[0] == stem
+        ]
+        if not matched and len(self.files) == 1 and _same_stem(self.path, audio_path):
+            matched = list(self.tracks)
+        return sorted(matched, key=lambda track: track.start)
+
+
+def _same_stem(a, b):
+    return os.path.splitext(os.path.basename(a))[0].lower() == os.path.splitext(os.path.basename(b))[0].lower()
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def cue_time(value):
+    match = CUE_TIME.match(value.strip())
+    if not match:
+        raise ValueError(f"CUE の時刻が読めません: {value}")
+    minutes, seconds, frames = (int(part) for part in match.groups())
+    return minutes * 60 + seconds + frames / CUE_FRAMES
+
+
+def _read_text(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    for encoding in TEXT_ENCODINGS:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("latin-1")
+
+
+def _file_name(rest):
+    # FILE "name with spaces.wav" WAVE / FILE name.wav WAVE
+    rest = rest.strip()
+    if rest.startswith('"'):
+        return rest[1:].split('"', 1)[0]
+    return rest.rsplit(" ", 1)[0]
+
+
+def parse_cue(path):
+    folder = os.path.dirname(path)
+    sheet = {"title": "", "performer": ""}
+    tags = []
+    files = []
+    tracks = []
+    current_file = ""
+    track = None
+
+    def flush():
+        if track and track.pop("audio") and track.get("start") is not None:
+            tracks.append(CueTrack(**track))
+
+    for line in _read_text(path).splitlines():
+        keyword, _, rest = line.strip().partition(" ")
+        keyword = keyword.upper()
+        if keyword == "FILE":
+            current_file = os.path.join(folder, _file_name(rest))
+            files.append(current_file)
+        elif keyword == "TRACK":
+            flush()
+            # data tracks of mixed-mode discs have no audio to cut
+            audio = rest.split()[-1].upper() == "AUDIO" if rest.split() else False
+            track = {"file": current_file, "start": None, "audio": audio}
+        elif keyword == "INDEX" and track is not None:
+            number, _, stamp = rest.strip().partition(" ")
+            if number.isdigit() and int(number) == 1:
+                track["start"] = cue_time(stamp)
+        elif keyword in ("TITLE", "PERFORMER"):
+            target = track if track is not None else sheet
+            target[keyword.lower()] = _unquote(rest)
+        elif keyword == "REM" and track is None:
+            name, _, value = rest.strip().partition(" ")
+            if name.upper() in CUE_REM_TAGS and value.strip():
+                tags.append((CUE_REM_TAGS[name.upper()], _unquote(value)))
+    flush()
+    return CueSheet(path, tuple(files), tuple(tracks), sheet["title"], sheet["performer"], tuple(tags))
+
+
+def find_cue(audio_path):
+    # a sibling image.cue / image.flac.cue first, then any sheet in the
+    # folder whose FILE names this audio
+    folder = os.path.dirname(audio_path)
+    stem = os.path.splitext(audio_path)[0]
+    candidates = [f"{stem}.cue", f"{audio_path}.cue"]
+    try:
+        candidates += sorted(
+            os.path.join(folder, name) for name in os.listdir(folder or ".") if name.lower().endswith(".cue")
+        )
+    except OSError:
+        pass
+    seen = set()
+    for path in candidates:
+        if path in seen or not os.path.isfile(path):
+            continue
+        seen.add(path)
+        try:
+            sheet = parse_cue(path)
+        except (OSError, ValueError):
+            continue
+        if sheet.tracks_for(audio_path):
+            return sheet
+    return None
+
+
+def cue_audio(cue_path):
+    # the audio image a sheet given as an input stands for
+    try:
+        sheet = parse_cue(cue_path)
+    except (OSError, ValueError):
+        return None
+    for path in sheet.files:
+        if os.path.isfile(path):
+            return path
+    folder = os.path.dirname(cue_path) or "."
+    try:
+        names = sorted(os.listdir(folder))
+    except OSError:
+        return None
+    for name in names:
+        path = os.path.join(folder, name)
+        if _same_stem(path, cue_path) and not name.lower().endswith(".cue") and os.path.isfile(path):
+            return path
+    return None
+
+
+def cue_regions(sheet, audio_path, offset=0.0, length=None):
+    # Gaps (INDEX 00) stay at the end of the previous track, the usual way
+    # images are split; anything before track 1 stays in track 1. offset
+    # and length are the trim window, the regions are relative to it.
+    cue_tracks = sheet.tracks_for(audio_path)
+    regions = []
+    for i, track in enumerate(cue_tracks):
+        start = 0.0 if i == 0 else track.start
+        end = cue_tracks[i + 1].start if i + 1 < len(cue_tracks) else None
+        start -= offset
+        if end is not None:
+            end -= offset
+            if end <= 0:
+                continue
+        if length is not None and start >= length:
+            break
+        tags = [("album", sheet.title), ("album_artist", sheet.performer)]
+        tags += [("title", track.title), ("artist", track.performer or sheet.performer)]
+        tags += list(sheet.tags)
+        regions.append(Region(max(start, 0.0), end, tuple((key, value) for key, value in tags if value)))
+    return tuple(regions)
+
+
+@dataclass(frozen=True)
+class Clip:
+    # seconds in the source file
+    start: float
+    # None = up to the end of the audio
+    end: float | None = None
+    title: str = ""
+    # None = the default fades of the batch
+    fade_in: float | None = None
+    fade_out: float | None = None
+    # "" = every input; otherwise the name (or stem) of the file it is cut from
+    file: str = ""
+
+    def matches(self, audio_path):
+        if not self.file:
+            return True
+        name = os.path.basename(self.file).lower()
+        return name == os.path.basename(audio_path).lower() or _same_stem(name, audio_path)
+
+
+def clip_time(value):
+    # 90 / 1:30 / 1:01:30.5
+    parts = value.strip().split(":")
+    try:
+        if len(parts) > 3 or not all(parts):
+            raise ValueError
+        seconds = 0.0
+        for part in parts:
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise ValueError(f"時刻が読めません: {value}") from None
+    if seconds < 0:
+        raise ValueError(f"時刻が読めません: {value}")
+    return seconds
+
+
+def _optional_seconds(value):
+    if not value.strip():
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"秒数が読めません: {value}") from None
+
+
+def make_clip(start, end="", title="", fade_in="", fade_out="", file=""):
+    clip = Clip(
+        clip_time(start),
+        clip_time(end) if end.strip() else None,
+        title.strip(),
+        _optional_seconds(fade_in),
+        _optional_seconds(fade_out),
+        file.strip(),
+    )
+    if clip.end is not None and clip.end <= clip.start:
+        raise ValueError(f"終了が開始より前です: {start}-{end}")
+    return clip
+
+
+def parse_clip_list(text):
+    # the typed form: "0:10-0:25; 1:30-2:00, 5:00-" (no end = to the end)
+    clips = []
+    for entry in re.split(r"[,;\n]", text):
+        if not entry.strip():
+            continue
+        start, dash, end = entry.partition("-")
+        if not dash:
+            raise ValueError(f"区間は 開始-終了 で指定してください: {entry.strip()}")
+        clips.append(make_clip(start, end))
+    return tuple(clips)
+
+
+def parse_clip_file(path):
+    # CSV or tab-separated; a header row may name the columns (file, start,
+    # end, title, fade_in, fade_out), otherwise they are CLIP_COLUMNS in order
+    text = _read_text(path)
+    delimiter = "\t" if "\t" in text else ","
+    rows = [row for row in csv.reader(text.splitlines(), delimiter=delimiter) if row and row[0].strip()]
+    rows = [row for row in rows if not row[0].lstrip().startswith("#")]
+    columns = CLIP_COLUMNS
+    if rows:
+        try:
+            clip_time(rows[0][0])
+        except ValueError:
+            columns = tuple(CLIP_HEADERS.get(name.strip().lower(), name.strip().lower()) for name in rows[0])
+            rows = rows[1:]
+            if "start" not in columns:
+                raise ValueError(f"start 列がありません: {path}")
+    clips = []
+    for number, row in enumerate(rows, 1):
+        values = {name: value for name, value in zip(columns, row) if name in Clip.__dataclass_fields__}
+        try:
+            clips.append(make_clip(**values))
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f"{os.path.basename(path)} の {number} 件目: {exc}") from None
+    return tuple(clips)
+
+
+def clip_regions(clips, audio_path, offset=0.0, length=None, fade_in=None, fade_out=None):
+    # The clips of this input as regions relative to the trim window; clips
+    # outside it are dropped and open ends run to its end.
+    regions = []
+    for clip in clips:
+        if not clip.matches(audio_path):
+            continue
+        start = clip.start - offset
+        end = length if clip.end is None else clip.end - offset
+        if end is not None and length is not None:
+            end = min(end, length)
+        if (end is not None and end <= max(start, 0.0)) or (length is not None and start >= length):
+            continue
+        regions.append(
+            Region(
+                max(start, 0.0),
+                end,
+                (("title", clip.title),) if clip.title else (),
+                fade_in if clip.fade_in is None else clip.fade_in,
+                fade_out if clip.fade_out is None else clip.fade_out,
+            )
+        )
+    return tuple(regions)
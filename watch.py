@@ -0,0 +1,244 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import engine
+import scheduler
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+TEMP_SUFFIXES = (".part", ".tmp", ".crdownload", ".partial", ".download")
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FolderWatcher:
+    # Reports files that have finished being written: on Linux via inotify
+    # (IN_CLOSE_WRITE / IN_MOVED_TO, so no polling while idle), elsewhere or
+    # with poll=True by scanning and waiting for size/mtime to settle.
+    def __init__(self, dirs, on_file, recursive=False, poll=False, interval=0.5, settle=1.0, log=print):
+        self.dirs = [os.path.abspath(path) for path in dirs]
+        self.on_file = on_file
+        self.recursive = recursive
+        self.interval = interval
+        self.settle = settle
+        self.log = log
+        self.libc = None if poll else _load_inotify()
+        self.backend = "inotify" if self.libc else "poll"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        target = self._run_inotify if self.libc else self._run_poll
+        self._thread = threading.Thread(target=target, name="watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _accept(self, path):
+        name = os.path.basename(path)
+        if name.lower().endswith(TEMP_SUFFIXES) or engine.is_temp_output(name):
+            return False
+        return engine.is_media_file(name) and os.path.isfile(path)
+
+    def _emit(self, path):
+        if self._accept(path):
+            try:
+                self.on_file(path)
+            except Exception as exc:
+                self.log(engine.log_line(f"監視: {path}: {exc}", "error"))
+
+    def _walk_dirs(self):
+        for root in self.dirs:
+            yield root
+            if not self.recursive:
+                continue
+            for dirpath, dirnames, _ in os.walk(root):
+                dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+                for name in dirnames:
+                    yield os.path.join(dirpath, name)
+
+    # inotify
+
+    def _run_inotify(self):
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.log(engine.log_line("監視: inotify を初期化できないためポーリングに切り替えます", "warning"))
+            self.backend = "poll"
+            self._run_poll()
+            return
+        watches = {}
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF
+        if self.recursive:
+            mask |= IN_CREATE
+
+        def add_watch(path):
+            wd = self.libc.inotify_add_watch(fd, os.fsencode(path), mask)
+            if wd < 0:
+                self.log(
+                    engine.log_line(f"監視: 追加できません: {path} ({os.strerror(ctypes.get_errno())})", "warning")
+                )
+                return
+            watches[wd] = path
+
+        try:
+            for path in self._walk_dirs():
+                add_watch(path)
+            while not self._stop.is_set() and watches:
+                ready, _, _ = select.select([fd], [], [], self.interval)
+                if not ready:
+                    continue
+                try:
+                    buf = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset < len(buf):
+                    wd, event_mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+                    offset += EVENT_HEADER.size
+                    name = buf[offset : offset + length].rstrip(b"\0")
+                    offset += length
+                    base = watches.get(wd)
+                    if base is None:
+                        continue
+                    if event_mask & (IN_IGNORED | IN_DELETE_SELF):
+                        watches.pop(wd, None)
+                        continue
+                    path = os.path.join(base, os.fsdecode(name))
+                    if event_mask & IN_ISDIR:
+                        if event_mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                            add_watch(path)
+                        continue
+                    if event_mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self._emit(path)
+        finally:
+            os.close(fd)
+
+    # polling fallback
+
+    def _scan(self):
+        found = {}
+        for root in self._walk_dirs():
+            try:
+                with os.scandir(root) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                st = entry.stat()
+                                found[entry.path] = (st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def _run_poll(self):
+        done = self._scan()
+        pending = {}
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            for path, state in self._scan().items():
+                if done.get(path) == state:
+                    continue
+                seen = pending.get(path)
+                if seen is None or seen[0] != state:
+                    pending[path] = (state, now)
+                elif now - seen[1] >= self.settle:
+                    del pending[path]
+                    done[path] = state
+                    self._emit(path)
+
+
+class WatchService:
+    # Converts every file that lands in the watched folders with one settings
+    # snapshot, routing outputs through the normal sync/subdir/custom modes.
+    def __init__(
+        self, settings, dirs, log=print, progress=None, recursive=False, poll=False, metrics_log=None, control=None
+    ):
+        self.settings = settings
+        self.log = log
+        self.control = control or engine.BatchControl()
+        self.runner = engine.BatchRunner(
+            settings, log=log, progress=progress, metrics_log=metrics_log, control=self.control
+        )
+        self.runner.begin(job_count=sys.maxsize)
+        self.pool = ThreadPoolExecutor(self.runner.layout.workers, thread_name_prefix="watch-job")
+        self.watcher = FolderWatcher(dirs, self._on_file, recursive=recursive, poll=poll, log=log)
+        self._lock = threading.Lock()
+        self._produced = set()
+        self._active = set()
+        self._next_index = 1
+        self.results = []
+
+    def start(self):
+        # leftovers of a crashed run, where files dropped into the watched
+        # folders will be written
+        inside = [os.path.join(folder, "") for folder in self.watcher.dirs]
+        self.runner.sweep(engine.output_roots(self.settings, inside))
+        self.watcher.start()
+        self.log(f"監視を開始しました ({self.watcher.backend}): {', '.join(self.watcher.dirs)}")
+        self.log(self.runner.layout.describe())
+        if self.settings.priority or self.settings.cpu_share:
+            self.log(scheduler.describe_priority(self.settings.priority, self.settings.cpu_share))
+
+    def stop(self, cancel=False):
+        self.watcher.stop()
+        if cancel:
+            self.control.cancel()
+        self.pool.shutdown(wait=True)
+        self.log("監視を停止しました。")
+
+    def _on_file(self, path):
+        with self._lock:
+            if path in self._produced or path in self._active:
+                return
+            self._active.add(path)
+            index = self._next_index
+            self._next_index += 1
+        jobs = engine.plan_batch(self.settings, [path], start=index)
+        with self._lock:
+            for job in jobs:
+                self._produced.update(job.output_paths)
+        for job in jobs:
+            self.runner.add(job)
+            self.pool.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            status = self.runner.run_job(job)
+        except Exception as exc:
+            self.log(engine.log_line(f"エラー: {job.input_path}: {exc}", "error", job.index))
+            status = "failed"
+        with self._lock:
+            # tracks of a split input only get their names while it runs
+            self._produced.update(self.runner.written.pop(job.index, ()))
+            self._active.discard(job.input_path)
+            self.results.append(status)
+        return status